@@ -29,5 +29,9 @@ setuptools.setup(
         'Flask >= 1.1',
         'requests >= 2.0',
         'karafs >= 0.1.1',
-    ]
+    ],
+    extras_require={
+        # the batch operations (`tchess.batch`)
+        'numpy': ['numpy >= 1.13'],
+    }
 )
@@ -1,4 +1,4 @@
 """ TChess """
 
-from .tchess import run, Game, Piece, load_game_from_file, VERSION
+from .tchess import run, Game, Piece, MoveLog, load_game_from_file, VERSION
 from . import moves
@@ -3,4 +3,5 @@
 import sys
 import tchess
 
-tchess.run(sys.argv[1:])
+if __name__ == '__main__':
+    tchess.run(sys.argv[1:])
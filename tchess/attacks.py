@@ -0,0 +1,163 @@
+""" The attack maps (the cells that each color attacks)
+
+An `AttackMap` keeps the number of the attackers of each cell for both of the colors and
+is updated by each move, so "is this cell attacked?" and "is the king in check?" are
+lookups, not scans of all of the pieces.
+
+The map has the attacked cells of each piece (`targets`) and the attackers of each cell
+(`attackers`). A move only changes the attacks of the moved piece, the captured piece and
+the sliders whose rays pass through the source or the target cell, and these are exactly
+the attackers of the two cells, so only these pieces are calculated again:
+
+    >>> attack_map = AttackMap(game.board)
+    >>> attack_map.is_attacked((3, 3), 'black')
+    >>> attack_map.move(game.board, src, dst) # after the move is applied on the board
+"""
+
+try:
+    from .tchess import Piece
+    from . import moves
+except ImportError:
+    from tchess import Piece
+    import moves
+
+COLORS = ('white', 'black')
+
+def piece_targets(board, x, y):
+    """ Returns the cells that the piece of a cell attacks (as `x * 8 + y` indexes)
+
+    The rays of the sliders stop at the first piece (that piece is attacked, whatever its color is).
+    """
+    piece = board[x][y]
+    result = []
+    if piece.name == Piece.PAWN:
+        a = x + (1 if piece.color == 'white' else -1)
+        if 0 <= a < 8:
+            for b in (y - 1, y + 1):
+                if 0 <= b < 8:
+                    result.append(a * 8 + b)
+        return result
+
+    if piece.name in (Piece.KNIGHT, Piece.KING):
+        for dx, dy in (moves.KNIGHT_OFFSETS if piece.name == Piece.KNIGHT else moves.KING_OFFSETS):
+            a = x + dx
+            b = y + dy
+            if 0 <= a < 8 and 0 <= b < 8:
+                result.append(a * 8 + b)
+        return result
+
+    directions = ()
+    if piece.name in (Piece.ROOK, Piece.QUEEN):
+        directions += moves.ROOK_DIRECTIONS
+    if piece.name in (Piece.BISHOP, Piece.QUEEN):
+        directions += moves.BISHOP_DIRECTIONS
+    for dx, dy in directions:
+        a = x + dx
+        b = y + dy
+        while 0 <= a < 8 and 0 <= b < 8:
+            result.append(a * 8 + b)
+            if board[a][b] is not None:
+                break
+            a += dx
+            b += dy
+    return result
+
+class AttackMap:
+    """ Attackers of the cells of a board, updated by the moves """
+
+    def __init__(self, board):
+        # {color: number of the attackers of each cell}
+        self.counts = {color: [0] * 64 for color in COLORS}
+        # the attacked cells of the piece of each cell
+        self.targets = [None] * 64
+        # the cells of the pieces that attack each cell
+        self.attackers = [set() for i in range(64)]
+        self.colors = [None] * 64
+        self.kings = {}
+        for x in range(8):
+            for y in range(8):
+                if board[x][y] is not None:
+                    self.add(board, x * 8 + y)
+
+    def add(self, board, cell):
+        """ Adds the attacks of the piece of a cell """
+        piece = board[cell // 8][cell % 8]
+        targets = piece_targets(board, cell // 8, cell % 8)
+        counts = self.counts[piece.color]
+        for target in targets:
+            counts[target] += 1
+            self.attackers[target].add(cell)
+        self.targets[cell] = targets
+        self.colors[cell] = piece.color
+        if piece.name == Piece.KING:
+            self.kings[piece.color] = cell
+
+    def remove(self, cell):
+        """ Removes the attacks of the piece that was on a cell """
+        targets = self.targets[cell]
+        if targets is None:
+            return
+        counts = self.counts[self.colors[cell]]
+        for target in targets:
+            counts[target] -= 1
+            self.attackers[target].discard(cell)
+        self.targets[cell] = None
+        self.colors[cell] = None
+
+    def move(self, board, src, dst):
+        """ Updates the map after a piece is moved from `src` to `dst` (`board` is the board after the move) """
+        src = src[0] * 8 + src[1]
+        dst = dst[0] * 8 + dst[1]
+        changed = (self.attackers[src] | self.attackers[dst]) - {src, dst}
+        self.remove(src)
+        self.remove(dst)
+        for cell in changed:
+            self.remove(cell)
+        for color in COLORS:
+            if self.kings.get(color) in (src, dst):
+                del self.kings[color]
+        self.add(board, dst)
+        for cell in changed:
+            self.add(board, cell)
+
+    def is_attacked(self, cell, color):
+        """ Checks the cell `(x, y)` is attacked by a color """
+        return self.counts[color][cell[0] * 8 + cell[1]] > 0
+
+    def king(self, color):
+        """ Returns location of the king of a color (or None) """
+        cell = self.kings.get(color)
+        if cell is None:
+            return None
+        return cell // 8, cell % 8
+
+    def in_check(self, color):
+        """ Checks the king of a color is attacked """
+        cell = self.kings.get(color)
+        enemy = 'black' if color == 'white' else 'white'
+        return cell is not None and self.counts[enemy][cell] > 0
+
+    def king_can_go(self, board, color, target):
+        """ Checks the king of a color can go to a cell without being attacked
+
+        The cells behind the king on the rays of the checking sliders are attacked too
+        (the king doesn't block the ray that it's moving away from).
+        """
+        enemy = 'black' if color == 'white' else 'white'
+        index = target[0] * 8 + target[1]
+        if self.counts[enemy][index] > 0:
+            return False
+        king = self.kings.get(color)
+        if king is None:
+            return True
+        for cell in self.attackers[king]:
+            if self.colors[cell] != enemy:
+                continue
+            piece = board[cell // 8][cell % 8]
+            if piece.name not in (Piece.ROOK, Piece.BISHOP, Piece.QUEEN):
+                continue
+            dx = (king // 8 > cell // 8) - (king // 8 < cell // 8)
+            dy = (king % 8 > cell % 8) - (king % 8 < cell % 8)
+            if (king // 8 + dx, king % 8 + dy) == (target[0], target[1]):
+                return False
+        return True
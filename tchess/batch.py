@@ -0,0 +1,199 @@
+""" Vectorized operations over batches of positions (requires numpy)
+
+The positions are the 65 byte encodings of `tchess.encoding` (`encode_board(game.board, game.turn)`).
+A batch is a `uint8` array of shape `(n, 65)`: 64 cell codes and the turn of each position.
+It can also be converted to 12 planes of 64 cells for each position (one plane for each piece
+of each color, in order of the piece codes).
+
+The scores are the same as `tchess.engine.evaluate`, but a whole batch is scored in one
+pass without a Python loop over the cells. The moves of all of the positions are generated
+together by shifting and masking the boards (`generate_moves`), not by calling
+`Piece.allowed_moves` for each cell of each board.
+
+    >>> data = batch.from_encodings([encoding.encode_board(game.board, game.turn) for game in games])
+    >>> scores = batch.evaluate(data)
+    >>> positions, moves = batch.generate_moves(data)
+"""
+
+import numpy
+
+try:
+    from .tchess import Piece
+    from . import encoding
+    from . import engine
+except ImportError:
+    from tchess import Piece
+    import encoding
+    import engine
+
+# bytes of each encoded position
+POSITION_SIZE = 65
+
+def make_weights():
+    """ Returns the piece-square values of each cell code: array of shape (13, 64)
+
+    The values of the black pieces are negative, so sum of a position is its score for white.
+    """
+    weights = numpy.zeros((13, 64), dtype=numpy.int32)
+    for code in range(1, 13):
+        piece = encoding.PIECES[code]
+        table = engine.PIECE_SQUARE[piece.color][piece.name]
+        sign = 1 if piece.color == 'white' else -1
+        weights[code] = [sign * table[x][y] for x in range(8) for y in range(8)]
+    return weights
+
+WEIGHTS = make_weights()
+
+def from_encodings(encodings):
+    """ Converts a list of encoded positions (bytes of `encoding.encode_board`) to a batch """
+    data = numpy.frombuffer(b''.join(encodings), dtype=numpy.uint8)
+    if data.size % POSITION_SIZE != 0:
+        raise ValueError('the encoded positions should be ' + str(POSITION_SIZE) + ' bytes')
+    return data.reshape(-1, POSITION_SIZE)
+
+def from_games(games):
+    """ Converts a list of games to a batch """
+    return from_encodings([encoding.encode_board(game.board, game.turn) for game in games])
+
+def to_planes(data):
+    """ Returns the piece planes of a batch: bool array of shape (n, 12, 64)
+
+    Plane `code - 1` is True in the cells that have the piece of that code.
+    """
+    cells = data[:, :64]
+    return cells[:, numpy.newaxis, :] == numpy.arange(1, 13, dtype=numpy.uint8)[numpy.newaxis, :, numpy.newaxis]
+
+def evaluate_planes(planes):
+    """ Returns scores of the piece planes for white: int array of shape (n,) """
+    return numpy.tensordot(planes.astype(numpy.int32), WEIGHTS[1:], axes=([1, 2], [0, 1]))
+
+def evaluate(data, for_white=False):
+    """ Returns scores of a batch: int array of shape (n,)
+
+    The scores are for the side to move of each position (like `engine.evaluate(board, turn)`),
+    or for white if `for_white` is True.
+    """
+    # each cell code selects its row of the weights, the column is the cell
+    scores = WEIGHTS[data[:, :64], numpy.arange(64)].sum(axis=1)
+    if for_white:
+        return scores
+    return numpy.where(data[:, 64] == 0, scores, -scores)
+
+# directions of the pieces: (dx, dy)
+KNIGHT_DIRECTIONS = ((1, 2), (-1, 2), (1, -2), (-1, -2), (2, 1), (2, -1), (-2, 1), (-2, -1))
+KING_DIRECTIONS = ((1, 1), (1, 0), (1, -1), (0, 1), (0, -1), (-1, 1), (-1, 0), (-1, -1))
+ROOK_DIRECTIONS = ((1, 0), (-1, 0), (0, 1), (0, -1))
+BISHOP_DIRECTIONS = ((1, 1), (1, -1), (-1, 1), (-1, -1))
+
+def shift(cells, dx, dy):
+    """ Shifts boolean boards of shape (n, 8, 8) by (dx, dy), the cells that leave the board are dropped """
+    result = numpy.zeros_like(cells)
+    result[:, max(dx, 0):8 + min(dx, 0), max(dy, 0):8 + min(dy, 0)] = \
+        cells[:, max(-dx, 0):8 + min(-dx, 0), max(-dy, 0):8 + min(-dy, 0)]
+    return result
+
+class MoveCollector:
+    """ Collects the target cells of the shifted boards as moves """
+
+    def __init__(self):
+        self.positions = []
+        self.sources = []
+        self.targets = []
+        self.promotions = []
+
+    def add(self, targets, dx, dy, promotion_row=None):
+        """ Adds the moves of the target cells, the source of each one is (x - dx, y - dy) """
+        indexes = numpy.flatnonzero(targets)
+        cells = indexes & 63
+        self.positions.append(indexes >> 6)
+        self.sources.append(cells - (dx * 8 + dy))
+        self.targets.append(cells)
+        if promotion_row is None:
+            self.promotions.append(numpy.zeros(len(cells), dtype=cells.dtype))
+        else:
+            self.promotions.append(numpy.where(cells >> 3 == promotion_row, Piece.QUEEN + 1, 0))
+
+    def result(self):
+        """ Returns (position indexes, move codes) sorted by position and move """
+        positions = numpy.concatenate(self.positions).astype(numpy.int64)
+        codes = numpy.concatenate(self.sources) | (numpy.concatenate(self.targets) << 6) \
+            | (numpy.concatenate(self.promotions) << 12)
+        order = numpy.lexsort((codes, positions))
+        return positions[order], codes[order].astype(numpy.uint16)
+
+def generate_moves(data):
+    """ Generates the moves of the side to move of all of the positions of a batch
+
+    The moves are pseudo-legal: the targets of `Piece.pseudo_moves` (pawns are promoted to queen),
+    the moves that leave the king in check are not removed. They are generated for all of the
+    positions together by shifting and masking the piece planes, not cell by cell.
+
+    Returns (position indexes, move codes): two arrays of the same length, a move is the 16 bit
+    code of `encoding.encode_move` and its position is the index of the position in the batch.
+    """
+    planes = to_planes(data).reshape(-1, 12, 8, 8)
+    black_turn = (data[:, 64] == 1)[:, numpy.newaxis, numpy.newaxis]
+    white = planes[:, :6].any(axis=1)
+    black = planes[:, 6:].any(axis=1)
+    own = numpy.where(black_turn, black, white)
+    enemy = numpy.where(black_turn, white, black)
+    empty = ~(white | black)
+    not_own = ~own
+
+    def pieces(name):
+        return numpy.where(black_turn, planes[:, 6 + name], planes[:, name])
+
+    collector = MoveCollector()
+
+    # pawns
+    for color_pawns, step, home, last in (
+        (planes[:, Piece.PAWN] & ~black_turn, 1, 1, 7),
+        (planes[:, 6 + Piece.PAWN] & black_turn, -1, 6, 0),
+    ):
+        single = shift(color_pawns, step, 0) & empty
+        collector.add(single, step, 0, last)
+        home_row = numpy.zeros_like(color_pawns)
+        home_row[:, home + step] = True
+        collector.add(shift(single & home_row, step, 0) & empty, 2 * step, 0)
+        for dy in (1, -1):
+            collector.add(shift(color_pawns, step, dy) & enemy, step, dy, last)
+
+    # knights and kings
+    for name, directions in ((Piece.KNIGHT, KNIGHT_DIRECTIONS), (Piece.KING, KING_DIRECTIONS)):
+        cells = pieces(name)
+        for dx, dy in directions:
+            collector.add(shift(cells, dx, dy) & not_own, dx, dy)
+
+    # sliding pieces, the rays go on only through the empty cells
+    queens = pieces(Piece.QUEEN)
+    for name, directions in ((Piece.ROOK, ROOK_DIRECTIONS), (Piece.BISHOP, BISHOP_DIRECTIONS)):
+        sliders = pieces(name) | queens
+        for dx, dy in directions:
+            ray = sliders
+            for distance in range(1, 8):
+                ray = shift(ray, dx, dy)
+                if not ray.any():
+                    break
+                collector.add(ray & not_own, dx * distance, dy * distance)
+                ray = ray & empty
+
+    return collector.result()
+
+def split_moves(data, positions, codes):
+    """ Converts the result of `generate_moves` to a list of moves of each position
+
+    The moves are tuples of `((src_x, src_y), (dst_x, dst_y), promotion)` like the engine moves.
+    """
+    result = [[] for i in range(len(data))]
+    for position, code in zip(positions.tolist(), codes.tolist()):
+        result[position].append(encoding.decode_move(code))
+    return result
+
+def is_valid_move(data, codes):
+    """ Checks a move for each position of a batch (e.g. the moves of training data)
+
+    `codes` is an array of shape (n,) of the 16 bit move codes. Returns a bool array of shape (n,).
+    """
+    positions, valid_codes = generate_moves(data)
+    keys = positions * 65536 + valid_codes
+    return numpy.isin(numpy.arange(len(data), dtype=numpy.int64) * 65536 + numpy.asarray(codes, dtype=numpy.int64), keys)
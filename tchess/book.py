@@ -0,0 +1,126 @@
+""" The opening book
+
+A book file is a header and a sorted list of entries:
+
+    header: b'TCBK', format version (uint32), number of entries (uint32)
+    entry:  position hash (uint64), move (uint16), weight (uint16)
+
+The entries are sorted by (hash, move), so the moves of a position are found
+with a binary search. The file is opened with `mmap`, it's never read completely.
+Hashes and moves are the zobrist hashes and 16 bit moves of `tchess.encoding`.
+"""
+
+import mmap
+import random
+import struct
+
+try:
+    from .tchess import Game, Piece, load_game_from_file
+    from . import encoding
+except ImportError:
+    from tchess import Game, Piece, load_game_from_file
+    import encoding
+
+MAGIC = b'TCBK'
+FORMAT_VERSION = 1
+HEADER = struct.Struct('<4sII')
+ENTRY = struct.Struct('<QHH')
+
+# how many plies of each game are added to the book by default
+DEFAULT_PLIES = 20
+
+MAX_WEIGHT = 2 ** 16 - 1
+
+class BookError(Exception):
+    """ Raised when a book file is invalid """
+
+def game_moves(game, max_plies=DEFAULT_PLIES):
+    """ Replays logs of a game and yields (position hash, move, color) for each move """
+    replay = Game.from_state(white_player=game.white_player, black_player=game.black_player)
+    replay.enable_beep = False
+    for src, dst, promotion in game.logs.moves():
+        if len(replay.logs) >= max_plies:
+            break
+        key = encoding.position_hash(replay.board, replay.turn)
+        color = replay.turn
+        piece = replay.board[src[0]][src[1]] if 0 <= src[0] < 8 and 0 <= src[1] < 8 else None
+        logs_count = len(replay.logs)
+        replay.apply_move(src, dst, promotion)
+        if len(replay.logs) > logs_count:
+            # the promotion is kept only if the pawn is actually promoted
+            promotion = None
+            if piece.name == Piece.PAWN and dst[0] in (0, 7):
+                promotion = replay.board[dst[0]][dst[1]].name
+            yield key, (src, dst, promotion), color
+
+def build(paths, output, max_plies=DEFAULT_PLIES):
+    """ Builds a book file from the saved games and returns number of the entries
+
+    Weight of a move is the number of times it's played, the moves of the winners are counted twice.
+    """
+    weights = {}
+    for path in paths:
+        game = load_game_from_file(path)
+        for key, move, color in game_moves(game, max_plies):
+            item = (key, encoding.encode_move(move))
+            weights[item] = weights.get(item, 0) + (2 if game.winner == color else 1)
+
+    with open(output, 'wb') as book_file:
+        book_file.write(HEADER.pack(MAGIC, FORMAT_VERSION, len(weights)))
+        for key, move in sorted(weights):
+            book_file.write(ENTRY.pack(key, move, min(weights[(key, move)], MAX_WEIGHT)))
+    return len(weights)
+
+class OpeningBook:
+    """ A book file that is opened with mmap """
+
+    def __init__(self, path):
+        self.file = open(path, 'rb')
+        try:
+            self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            self.file.close()
+            raise BookError('invalid book file `' + path + '`')
+        if len(self.data) < HEADER.size:
+            self.close()
+            raise BookError('invalid book file `' + path + '`')
+        magic, version, self.count = HEADER.unpack_from(self.data, 0)
+        if magic != MAGIC or version != FORMAT_VERSION or len(self.data) < HEADER.size + self.count * ENTRY.size:
+            self.close()
+            raise BookError('invalid book file `' + path + '`')
+
+    def close(self):
+        """ Closes the book file """
+        self.data.close()
+        self.file.close()
+
+    def entry(self, index):
+        """ Returns (hash, move code, weight) of an entry """
+        return ENTRY.unpack_from(self.data, HEADER.size + index * ENTRY.size)
+
+    def lookup(self, key):
+        """ Returns list of (move, weight) of the position hash """
+        # binary search for the first entry of the key
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if self.entry(middle)[0] < key:
+                low = middle + 1
+            else:
+                high = middle
+
+        result = []
+        while low < self.count:
+            entry_key, move, weight = self.entry(low)
+            if entry_key != key:
+                break
+            result.append((encoding.decode_move(move), weight))
+            low += 1
+        return result
+
+    def choose(self, board, turn, rand=random):
+        """ Returns a book move of the position (chosen randomly by weights) or None """
+        moves = self.lookup(encoding.position_hash(board, turn))
+        if not moves:
+            return None
+        return rand.choices([move for move, weight in moves], [weight for move, weight in moves])[0]
@@ -0,0 +1,285 @@
+""" The game database (SQLite)
+
+The saved games are pickle files that are loaded one by one, this module ingests them
+into one SQLite database, so the games are queried with the indexes without loading them:
+
+    >>> db = database.GameDatabase('games.db')
+    >>> db.add_games(load_game_from_file(path) for path in paths)
+    >>> db.query(winner='white', max_moves=39) # the games that white won in under 40 moves
+
+The database is in WAL mode and the games are inserted in batches, each batch in one transaction.
+The logs of the games are kept too, so a game can be loaded again (`load_game`).
+
+The positions of the games are indexed too: table `positions` has a row for each position of each
+game (its zobrist hash, the game and the ply). It's a `WITHOUT ROWID` table, so the rows are stored
+sorted by the hash in the b-tree of the primary key and the games that reached a position are found
+with one range lookup (`find_position`), without replaying the games.
+"""
+
+import sqlite3
+
+try:
+    from .tchess import Game, Piece, MoveLog
+    from . import pgn
+    from . import encoding
+except ImportError:
+    from tchess import Game, Piece, MoveLog
+    import pgn
+    import encoding
+
+# version of the tables, it's kept in `PRAGMA user_version`
+SCHEMA_VERSION = 3
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS games (
+    id INTEGER PRIMARY KEY,
+    white TEXT NOT NULL,
+    black TEXT NOT NULL,
+    winner TEXT,
+    result TEXT NOT NULL,
+    draw TEXT,
+    plies INTEGER NOT NULL,
+    source TEXT,
+    logs TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS games_white ON games (white);
+CREATE INDEX IF NOT EXISTS games_black ON games (black);
+CREATE INDEX IF NOT EXISTS games_winner ON games (winner, plies);
+CREATE INDEX IF NOT EXISTS games_result ON games (result, plies);
+CREATE INDEX IF NOT EXISTS games_plies ON games (plies);
+CREATE TABLE IF NOT EXISTS positions (
+    hash INTEGER NOT NULL,
+    game_id INTEGER NOT NULL,
+    ply INTEGER NOT NULL,
+    PRIMARY KEY (hash, game_id, ply)
+) WITHOUT ROWID;
+'''
+
+# number of the games that are inserted in each transaction
+BATCH_SIZE = 1000
+
+# the columns of the query results
+COLUMNS = ('id', 'white', 'black', 'winner', 'result', 'draw', 'plies', 'source')
+
+class DatabaseError(Exception):
+    """ Raised when a database is invalid """
+
+def game_plies(game):
+    """ Returns number of the moves of both of the players in the logs of a game """
+    return len(game.logs)
+
+def signed_hash(key):
+    """ Converts a 64 bit hash to a signed number (the integers of SQLite are signed) """
+    return key - (1 << 64) if key >= (1 << 63) else key
+
+def position_hashes(logs):
+    """ Yields (ply, position hash) of the start position and the position after each move of the logs
+    (`MoveLog` or the commands)
+
+    The logs are the moves that are already validated, so the pieces are moved without validating
+    them again and the hash is updated with the changed cells (not calculated for all of the board).
+    """
+    board = Game.get_start_board()
+    turn = 'white'
+    key = encoding.position_hash(board, turn)
+    ply = 0
+    yield ply, key
+    for src, dst, promotion in MoveLog(logs, strict=False).moves():
+        piece = board[src[0]][src[1]]
+        if piece is None:
+            continue
+        placed = piece
+        if piece.name == Piece.PAWN and dst[0] in (0, 7) and promotion is not None:
+            placed = encoding.PIECES[encoding.piece_code(Piece(promotion, piece.color))]
+        key ^= encoding.piece_hash(piece, src[0], src[1]) ^ encoding.piece_hash(board[dst[0]][dst[1]], dst[0], dst[1]) \
+            ^ encoding.piece_hash(placed, dst[0], dst[1]) ^ encoding.ZOBRIST_BLACK_TURN
+        board[src[0]][src[1]] = None
+        board[dst[0]][dst[1]] = placed
+        ply += 1
+        yield ply, key
+
+def moves_to_plies(moves, last=True):
+    """ Converts number of the (full) moves to number of the plies: the last or the first ply of the move """
+    return moves * 2 if last else moves * 2 - 1
+
+class GameDatabase:
+    """ A SQLite database of games """
+
+    def __init__(self, path):
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        version = self.connection.execute('PRAGMA user_version').fetchone()[0]
+        if version not in (0, 1, 2, SCHEMA_VERSION):
+            self.connection.close()
+            raise DatabaseError('database `' + path + '` has version ' + str(version) + ', not ' + str(SCHEMA_VERSION))
+        with self.connection:
+            self.connection.executescript(SCHEMA)
+            if version in (1, 2):
+                # the games of the older versions don't have the draw reason
+                self.connection.execute('ALTER TABLE games ADD COLUMN draw TEXT')
+            if version == 1:
+                # the positions of the games of version 1 are not indexed
+                self.index_positions(self.connection.execute('SELECT id, logs FROM games').fetchall())
+            self.connection.execute('PRAGMA user_version = ' + str(SCHEMA_VERSION))
+
+    def close(self):
+        """ Closes the database """
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def add_games(self, games, source=None, batch_size=BATCH_SIZE):
+        """ Adds the games (any iterable of `Game`s, it's read lazily) and returns number of them
+
+        `source` is a string (for example the file) that is saved with the games, and the
+        draw reason of the drawn games (`Game.draw_reason`) is saved too.
+        """
+        count = 0
+        batch = []
+        for game in games:
+            batch.append((
+                game.white_player, game.black_player, game.winner, pgn.game_result(game),
+                getattr(game, 'draw_reason', None), game_plies(game), source, '\n'.join(game.logs),
+            ))
+            if len(batch) >= batch_size:
+                count += self.insert(batch)
+                batch = []
+        if batch:
+            count += self.insert(batch)
+        return count
+
+    def insert(self, rows):
+        """ Inserts the rows of the games and their positions in one transaction """
+        with self.connection:
+            games = []
+            for row in rows:
+                cursor = self.connection.execute(
+                    'INSERT INTO games (white, black, winner, result, draw, plies, source, logs) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                    row,
+                )
+                games.append((cursor.lastrowid, row[-1]))
+            self.index_positions(games)
+        return len(rows)
+
+    def index_positions(self, games):
+        """ Adds the positions of the games to the index, `games` is a list of (game id, logs) """
+        self.connection.executemany(
+            'INSERT OR IGNORE INTO positions (hash, game_id, ply) VALUES (?, ?, ?)',
+            (
+                (signed_hash(key), game_id, ply)
+                for game_id, logs in games
+                for ply, key in position_hashes(logs.split('\n') if logs else [])
+            ),
+        )
+
+    def find_position(self, key, limit=None):
+        """ Returns the games that reached a position: list of dicts of `COLUMNS` and `ply`
+
+        `key` is the position hash (`encoding.position_hash(board, turn)`), `ply` is the first ply
+        of the game that the position is reached in (0 is the start position).
+        """
+        sql = 'SELECT ' + ', '.join('games.' + column for column in COLUMNS) + ', MIN(positions.ply)' \
+            + ' FROM positions JOIN games ON games.id = positions.game_id WHERE positions.hash = ?' \
+            + ' GROUP BY games.id ORDER BY games.id'
+        params = [signed_hash(key)]
+        if limit is not None:
+            sql += ' LIMIT ?'
+            params.append(limit)
+        return [dict(zip(COLUMNS + ('ply',), row)) for row in self.connection.execute(sql, params)]
+
+    def count(self):
+        """ Returns number of the games """
+        return self.connection.execute('SELECT COUNT(*) FROM games').fetchone()[0]
+
+    def query(self, white=None, black=None, player=None, winner=None, result=None,
+              min_moves=None, max_moves=None, position=None, limit=None, draw=None):
+        """ Returns the games that match all of the given filters: list of dicts of `COLUMNS`
+
+        `player` matches both of the colors, `winner` is a color or `draw`, `draw` is the
+        reason of the draw (`stalemate`, `repetition` or `fifty-move`), the moves
+        are the full moves (a move of white and a move of black) and `position` is hash
+        of a position that the games have reached.
+        """
+        conditions = []
+        params = []
+        if position is not None:
+            conditions.append('id IN (SELECT game_id FROM positions WHERE hash = ?)')
+            params.append(signed_hash(position))
+        if white is not None:
+            conditions.append('white = ?')
+            params.append(white)
+        if black is not None:
+            conditions.append('black = ?')
+            params.append(black)
+        if player is not None:
+            conditions.append('(white = ? OR black = ?)')
+            params += [player, player]
+        if winner is not None:
+            if winner == 'draw':
+                conditions.append("result = '1/2-1/2'")
+            else:
+                conditions.append('winner = ?')
+                params.append(winner)
+        if result is not None:
+            conditions.append('result = ?')
+            params.append(result)
+        if draw is not None:
+            conditions.append('draw = ?')
+            params.append(draw)
+        if min_moves is not None:
+            conditions.append('plies >= ?')
+            params.append(moves_to_plies(min_moves, last=False))
+        if max_moves is not None:
+            conditions.append('plies <= ?')
+            params.append(moves_to_plies(max_moves))
+
+        sql = 'SELECT ' + ', '.join(COLUMNS) + ' FROM games'
+        if conditions:
+            sql += ' WHERE ' + ' AND '.join(conditions)
+        sql += ' ORDER BY id'
+        if limit is not None:
+            sql += ' LIMIT ?'
+            params.append(limit)
+        return [dict(zip(COLUMNS, row)) for row in self.connection.execute(sql, params)]
+
+    def load_game(self, game_id):
+        """ Returns a game of the database by replaying its logs (or None if it doesn't exist) """
+        row = self.connection.execute('SELECT white, black, logs FROM games WHERE id = ?', (game_id,)).fetchone()
+        if row is None:
+            return None
+        game = Game.from_state(white_player=row[0], black_player=row[1])
+        game.enable_beep = False
+        for move in MoveLog(row[2].split('\n') if row[2] else [], strict=False).moves():
+            game.apply_move(*move)
+        return game
+
+def parse_filters(arguments):
+    """ Converts the `name=value` arguments of `--db-query` to the arguments of `GameDatabase.query` """
+    filters = {}
+    for argument in arguments:
+        if '=' not in argument:
+            raise DatabaseError('invalid filter `' + argument + '`, filters should be `name=value`')
+        name, value = argument.split('=', 1)
+        name = name.replace('-', '_')
+        if name in ('min_moves', 'max_moves', 'limit'):
+            try:
+                value = int(value)
+            except ValueError:
+                raise DatabaseError('value of filter `' + argument + '` should be a number')
+        elif name == 'fen':
+            try:
+                game = pgn.from_fen(value)
+            except pgn.PGNError as error:
+                raise DatabaseError(str(error))
+            name = 'position'
+            value = encoding.position_hash(game.board, game.turn)
+        elif name not in ('white', 'black', 'player', 'winner', 'result', 'draw'):
+            raise DatabaseError('unknown filter `' + argument + '`')
+        filters[name] = value
+    return filters
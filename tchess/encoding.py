@@ -0,0 +1,80 @@
+""" Compact encodings of the game positions
+
+A position is encoded as 65 bytes: one byte for each cell of the board (row by row,
+`board[x][y]` is byte `x * 8 + y`) and one byte for the turn. The byte of a cell is 0 for
+an empty cell, `1 + piece.name` for a white piece and `7 + piece.name` for a black piece.
+
+These encodings are used to pass positions between processes instead of pickling `Game` objects.
+
+This module also has the 64 bit (zobrist) hash of the positions and the 16 bit encoding
+of the moves: bits 0-5 are the source cell, bits 6-11 the target cell and bits 12-14
+the promotion (0 for none, otherwise `1 + piece id`).
+"""
+
+import random
+
+try:
+    from .tchess import Piece
+except ImportError:
+    from tchess import Piece
+
+EMPTY = 0
+
+# the decoded pieces for each code (pieces are never changed, so they are shared by the boards)
+PIECES = [None] + [Piece(name, color) for color in ('white', 'black') for name in range(6)]
+
+TURNS = ('white', 'black')
+
+def piece_code(piece):
+    """ Returns code of a piece (0 for empty cell) """
+    if piece is None:
+        return EMPTY
+    return 1 + piece.name + (6 if piece.color == 'black' else 0)
+
+def encode_board(board, turn='white') -> bytes:
+    """ Encodes the board and turn to 65 bytes """
+    codes = [piece_code(piece) for row in board for piece in row]
+    codes.append(TURNS.index(turn))
+    return bytes(codes)
+
+def decode_board(data: bytes):
+    """ Decodes the bytes made by `encode_board` and returns (board, turn) """
+    board = [[PIECES[data[x * 8 + y]] for y in range(8)] for x in range(8)]
+    return board, TURNS[data[64]]
+
+# the random keys of the zobrist hash. the seed is fixed, so the hashes are the same
+# in all of the runs and can be stored in files
+ZOBRIST_RANDOM = random.Random(0x7c4e55)
+ZOBRIST_PIECES = [[0] * 64] + [[ZOBRIST_RANDOM.getrandbits(64) for sq in range(64)] for code in range(12)]
+ZOBRIST_BLACK_TURN = ZOBRIST_RANDOM.getrandbits(64)
+
+def piece_hash(piece, x, y):
+    """ Returns the zobrist key of a piece in a cell (0 for empty cell) """
+    if piece is None:
+        return 0
+    return ZOBRIST_PIECES[piece_code(piece)][x * 8 + y]
+
+def position_hash(board, turn='white'):
+    """ Returns the 64 bit zobrist hash of the position """
+    result = ZOBRIST_BLACK_TURN if turn == 'black' else 0
+    for x in range(8):
+        row = board[x]
+        for y in range(8):
+            if row[y] is not None:
+                result ^= ZOBRIST_PIECES[piece_code(row[y])][x * 8 + y]
+    return result
+
+def encode_move(move) -> int:
+    """ Encodes a move `((src_x, src_y), (dst_x, dst_y), promotion)` to 16 bits """
+    src, dst, promotion = move
+    code = (src[0] * 8 + src[1]) | ((dst[0] * 8 + dst[1]) << 6)
+    if promotion is not None:
+        code |= (promotion + 1) << 12
+    return code
+
+def decode_move(code: int):
+    """ Decodes a move that is encoded by `encode_move` """
+    src = code & 63
+    dst = (code >> 6) & 63
+    promotion = (code >> 12) & 7
+    return (src // 8, src % 8), (dst // 8, dst % 8), (promotion - 1 if promotion else None)
@@ -0,0 +1,595 @@
+""" The built-in AI opponent
+
+The engine searches the position with negamax and alpha-beta pruning, using
+iterative deepening until the time budget of the move is spent. Moves are
+generated by the game's own legal move generator (`tchess.moves.legal_moves`).
+
+With `workers` more than 1, the root moves are split between a pool of processes
+(the GIL doesn't let threads search in parallel). The processes get the position as
+the compact encoding of `tchess.encoding` and share the best root score found so far
+as the alpha bound (a lazy-SMP style shared bound).
+
+The search results are kept in a transposition table (`tchess.ttable`) keyed by
+the zobrist hash of the positions, which is updated incrementally on each move.
+If an opening book (`tchess.book`) is given, the book moves are played without search.
+If endgame tablebases (`tchess.tablebase`) are given, the positions that are in them are
+not searched, their exact result is used.
+
+A move in this module is a tuple of `((src_x, src_y), (dst_x, dst_y), promotion)`,
+the promotion is the `Piece` id of the new piece (or None).
+"""
+
+import time
+import multiprocessing
+
+try:
+    from .tchess import Piece
+    from . import moves
+    from . import encoding
+    from . import ttable
+    from . import tablebase
+except ImportError:
+    from tchess import Piece
+    import moves
+    import encoding
+    import ttable
+    import tablebase
+
+MATE_SCORE = 100000
+INFINITY = 1000000
+
+# scores more than this are mate scores (the mate is never further than this many plies)
+MATE_BOUND = MATE_SCORE - 1000
+
+# the search reaches this depth only if the time budget is not finished before that
+MAX_DEPTH = 64
+
+# how many plies of captures are searched after the main search depth
+QUIESCENCE_DEPTH = 4
+
+PIECE_VALUES = {
+    Piece.PAWN: 100,
+    Piece.KNIGHT: 320,
+    Piece.BISHOP: 330,
+    Piece.ROOK: 500,
+    Piece.QUEEN: 900,
+    Piece.KING: 0,
+}
+
+def square_bonus(name, color, x, y):
+    """ Returns the positional bonus of a piece in a cell """
+    center = 3.5 - max(abs(3.5 - x), abs(3.5 - y))
+    if name == Piece.PAWN:
+        advance = (x - 1) if color == 'white' else (6 - x)
+        return advance * 10 + int(center * 2)
+    if name in (Piece.KNIGHT, Piece.BISHOP):
+        return int(center * 10)
+    if name == Piece.QUEEN:
+        return int(center * 4)
+    if name == Piece.KING:
+        return -int(center * 10)
+    return 0
+
+# PIECE_SQUARE[color][name][x][y] is the value of the piece in that cell
+PIECE_SQUARE = {
+    color: {
+        name: [
+            [PIECE_VALUES[name] + square_bonus(name, color, x, y) for y in range(8)]
+            for x in range(8)
+        ] for name in PIECE_VALUES
+    } for color in ('white', 'black')
+}
+
+# the pieces that a promoted pawn is replaced with (pieces are never changed, so they are shared)
+PROMOTED_PIECES = {
+    'white': Piece(Piece.QUEEN, 'white'),
+    'black': Piece(Piece.QUEEN, 'black'),
+}
+
+class SearchTimeout(Exception):
+    """ Raised inside the search when the time budget is finished """
+
+class Position:
+    """ A copy of the board that the search makes/unmakes the moves on
+
+    The move validators only use `board` of the game, so this is enough for them.
+    """
+
+    def __init__(self, board, turn):
+        self.board = [list(row) for row in board]
+        self.turn = turn
+
+class SearchResult:
+    """ Result of a search """
+
+    def __init__(self, move, score, depth, nodes, seconds, probes=0, hits=0, from_book=False):
+        self.move = move
+        self.from_book = from_book
+        self.score = score
+        self.depth = depth
+        self.nodes = nodes
+        self.seconds = seconds
+        # transposition table statistics of the search
+        self.probes = probes
+        self.hits = hits
+
+    @property
+    def nps(self):
+        """ Searched nodes per second """
+        if self.seconds <= 0:
+            return self.nodes
+        return int(self.nodes / self.seconds)
+
+    @property
+    def hit_rate(self):
+        """ Rate of the transposition table probes that the position was found """
+        if self.probes == 0:
+            return 0.0
+        return self.hits / self.probes
+
+    def __str__(self):
+        if self.from_book:
+            return 'book move'
+        return (
+            'depth ' + str(self.depth) + ', ' + str(self.nodes) + ' nodes, ' + str(self.nps) + ' nodes/sec, '
+            + str(round(self.hit_rate * 100, 1)) + '% tt hits'
+        )
+
+def other_color(color):
+    """ Returns the opponent color """
+    return 'black' if color == 'white' else 'white'
+
+def generate_moves(position, color):
+    """ Returns all of the legal moves of a color using the game move validators """
+    result = []
+    board = position.board
+    for src, targets in moves.legal_moves(position, color):
+        is_pawn = board[src[0]][src[1]].name == Piece.PAWN
+        for dst in targets:
+            promotion = Piece.QUEEN if is_pawn and dst[0] in (0, 7) else None
+            result.append((src, (dst[0], dst[1]), promotion))
+    return result
+
+def in_check(board, color):
+    """ Checks the king of a color is in check """
+    king = moves.find_king(board, color)
+    return king is not None and moves.is_attacked(board, king, other_color(color))
+
+def no_moves_score(board, color, ply):
+    """ Returns score of a position that `color` has no legal move in: checkmate or stalemate """
+    if in_check(board, color):
+        return -(MATE_SCORE - ply)
+    return 0
+
+def make_move(board, move):
+    """ Makes the move on the board and returns what `unmake_move` needs """
+    src, dst, promotion = move
+    piece = board[src[0]][src[1]]
+    captured = board[dst[0]][dst[1]]
+    board[dst[0]][dst[1]] = piece if promotion is None else PROMOTED_PIECES[piece.color]
+    board[src[0]][src[1]] = None
+    return piece, captured
+
+def move_hash(board, move, key):
+    """ Returns hash of the position after the move (the move is not made yet) """
+    src, dst, promotion = move
+    piece = board[src[0]][src[1]]
+    placed = piece if promotion is None else PROMOTED_PIECES[piece.color]
+    return (
+        key ^ encoding.ZOBRIST_BLACK_TURN
+        ^ encoding.piece_hash(piece, src[0], src[1])
+        ^ encoding.piece_hash(placed, dst[0], dst[1])
+        ^ encoding.piece_hash(board[dst[0]][dst[1]], dst[0], dst[1])
+    )
+
+def score_to_table(score, ply):
+    """ Converts a mate score to be relative to the position before storing it in the table """
+    if score >= MATE_BOUND:
+        return score + ply
+    if score <= -MATE_BOUND:
+        return score - ply
+    return score
+
+def tablebase_score(value, ply):
+    """ Converts a tablebase result (see `tchess.tablebase`) to a search score """
+    if value > 0:
+        # the opponent is checkmated `value - 1` plies later, in the node of ply `ply + value - 1`
+        return MATE_SCORE - (ply + value - 1)
+    if value < 0:
+        return -(MATE_SCORE - (ply - value - 1))
+    return 0
+
+def score_from_table(score, ply):
+    """ Reverts `score_to_table` """
+    if score >= MATE_BOUND:
+        return score - ply
+    if score <= -MATE_BOUND:
+        return score + ply
+    return score
+
+def unmake_move(board, move, undo):
+    """ Reverts a move that is made by `make_move` """
+    src, dst, _ = move
+    board[src[0]][src[1]] = undo[0]
+    board[dst[0]][dst[1]] = undo[1]
+
+def evaluate(board, color):
+    """ Returns score of the position for `color` (material and piece-square values) """
+    score = 0
+    for x in range(8):
+        row = board[x]
+        for y in range(8):
+            piece = row[y]
+            if piece is not None:
+                if piece.color == 'white':
+                    score += PIECE_SQUARE['white'][piece.name][x][y]
+                else:
+                    score -= PIECE_SQUARE['black'][piece.name][x][y]
+    return score if color == 'white' else -score
+
+def move_to_command(move):
+    """ Converts a move to the game command string """
+    src, dst, promotion = move
+    command = 'mv ' + str(src[0]+1) + '.' + str(src[1]+1) + ' to ' + str(dst[0]+1) + '.' + str(dst[1]+1)
+    if promotion is not None:
+        command += ' > ' + Piece.ICONS[promotion]
+    return command
+
+# the best root score that is shared between the worker processes (see `init_worker`)
+WORKER_SHARED_ALPHA = None
+
+# the stop flag of the parent engine that is shared with the worker processes (see `Engine.stop`)
+WORKER_STOP_FLAG = None
+
+# transposition table of a worker process, it's kept between the tasks
+WORKER_TABLE = None
+
+# the endgame tablebases of a worker process
+WORKER_TABLEBASES = None
+
+def init_worker(shared_alpha, table_size, tablebases=None, stop_flag=None):
+    """ Initializes a worker process of the parallel search """
+    global WORKER_SHARED_ALPHA, WORKER_STOP_FLAG, WORKER_TABLE, WORKER_TABLEBASES
+    WORKER_SHARED_ALPHA = shared_alpha
+    WORKER_STOP_FLAG = stop_flag
+    WORKER_TABLE = ttable.TranspositionTable(table_size) if table_size else None
+    WORKER_TABLEBASES = tablebases
+
+def search_root_chunk(task):
+    """ Searches a chunk of the root moves in a worker process
+
+    Returns (best move, score, nodes, completed, table probes, table hits). The best
+    move is None if no move of the chunk is better than the shared alpha.
+    """
+    data, moves, depth, deadline = task
+    board, turn = encoding.decode_board(data)
+    engine = Engine(table_size=0, tablebases=WORKER_TABLEBASES)
+    engine.table = WORKER_TABLE
+    engine.stop_flag = WORKER_STOP_FLAG
+    engine.deadline = deadline
+    probes, hits = engine.table_stats()
+    try:
+        move, score = engine.search_root(Position(board, turn), moves, depth, moves[0], WORKER_SHARED_ALPHA)
+        completed = True
+    except SearchTimeout:
+        move, score, completed = None, -INFINITY, False
+    new_probes, new_hits = engine.table_stats()
+    return move, score, engine.nodes, completed, new_probes - probes, new_hits - hits
+
+class Engine:
+    """ The negamax/alpha-beta search engine """
+
+    def __init__(self, time_limit=1.0, max_depth=MAX_DEPTH, workers=1, table_size=ttable.DEFAULT_SIZE, book=None, tablebases=None):
+        self.time_limit = time_limit
+        self.book = book
+        # {material key: tablebase} (see `tablebase.load_directory`)
+        self.tablebases = tablebases or None
+        self.tablebase_hits = 0
+        self.max_depth = max_depth
+        self.workers = workers
+        self.nodes = 0
+        self.deadline = None
+        # set by `stop` (from another thread) to stop the current search
+        self._stopped = False
+        self.pool = None
+        self.shared_alpha = None
+        # the `stopped` flag that is shared with the worker processes (a `multiprocessing.Value`)
+        self.stop_flag = None
+        # the table is kept between the searches (with workers, each process has its own table)
+        self.table_size = table_size
+        self.table = None
+        if table_size and workers <= 1:
+            self.table = ttable.TranspositionTable(table_size)
+
+    def get_pool(self):
+        """ Returns the worker processes pool (creates it in the first call) """
+        if self.pool is None:
+            self.shared_alpha = multiprocessing.Value('i', -INFINITY)
+            self.stop_flag = multiprocessing.Value('b', int(self._stopped))
+            self.pool = multiprocessing.Pool(
+                self.workers, initializer=init_worker,
+                initargs=(self.shared_alpha, self.table_size, self.tablebases, self.stop_flag)
+            )
+        return self.pool
+
+    def table_stats(self):
+        """ Returns (probes, hits) of the transposition table """
+        if self.table is None:
+            return 0, 0
+        return self.table.probes, self.table.hits
+
+    def close(self):
+        """ Stops the worker processes """
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
+
+    def order_moves(self, board, moves, first=None):
+        """ Sorts the moves to search the better ones first (captures by MVV-LVA) """
+        def key(move):
+            if move == first:
+                return -INFINITY
+            captured = board[move[1][0]][move[1][1]]
+            if captured is None:
+                return 0
+            return -(PIECE_VALUES[captured.name] * 10 - PIECE_VALUES[board[move[0][0]][move[0][1]].name] // 100)
+        moves.sort(key=key)
+        return moves
+
+    def book_move(self, position, moves):
+        """ Returns a move of the opening book for the position (or None) """
+        if self.book is None:
+            return None
+        move = self.book.choose(position.board, position.turn)
+        # the book is built from the saved games, so its moves are validated
+        if move in moves:
+            return move
+        return None
+
+    def check_time(self):
+        """ Stops the search if the time budget is finished (or the search is stopped by `stop`) """
+        self.nodes += 1
+        if (self.nodes & 255) == 0 and (self.stopped or (self.deadline is not None and time.monotonic() > self.deadline)):
+            raise SearchTimeout()
+
+    @property
+    def stopped(self):
+        """ True if the search is stopped by `stop` (in the worker processes, the flag of the parent engine) """
+        return self._stopped or (self.stop_flag is not None and bool(self.stop_flag.value))
+
+    @stopped.setter
+    def stopped(self, value):
+        self._stopped = value
+        if self.stop_flag is not None:
+            self.stop_flag.value = int(value)
+
+    def stop(self):
+        """ Stops the current search (it returns the result of the last finished depth)
+
+        The flag is shared with the worker processes, so the chunks that they are searching are
+        stopped too. The next searches are stopped too, until `stopped` is set to False again.
+        """
+        self.stopped = True
+
+    def search(self, game, progress=None):
+        """ Searches the position of the game and returns a `SearchResult`
+
+        `progress` is called with the `SearchResult` of each finished depth.
+        """
+        if self.workers > 1:
+            return self.parallel_search(game, progress)
+
+        position = Position(game.board, game.turn)
+        start = time.monotonic()
+        self.nodes = 0
+        self.deadline = None
+        probes, hits = self.table_stats()
+
+        moves = generate_moves(position, position.turn)
+        if not moves:
+            return SearchResult(None, 0, 0, 0, time.monotonic() - start)
+        book_move = self.book_move(position, moves)
+        if book_move is not None:
+            return SearchResult(book_move, 0, 0, 0, time.monotonic() - start, from_book=True)
+
+        best_move = self.order_moves(position.board, moves)[0]
+        best_score = -INFINITY
+        depth = 0
+        for current_depth in range(1, self.max_depth + 1):
+            # the first depth is always completed, so there is always a searched move
+            if current_depth == 2:
+                self.deadline = start + self.time_limit
+            try:
+                move, score = self.search_root(position, moves, current_depth, best_move)
+            except SearchTimeout:
+                break
+            best_move, best_score, depth = move, score, current_depth
+            if progress is not None:
+                new_probes, new_hits = self.table_stats()
+                progress(SearchResult(
+                    best_move, best_score, depth, self.nodes, time.monotonic() - start, new_probes - probes, new_hits - hits
+                ))
+            if abs(best_score) >= MATE_SCORE - MAX_DEPTH:
+                # the mate is found, searching deeper is useless
+                break
+            if time.monotonic() > start + self.time_limit:
+                break
+
+        new_probes, new_hits = self.table_stats()
+        return SearchResult(
+            best_move, best_score, depth, self.nodes, time.monotonic() - start, new_probes - probes, new_hits - hits
+        )
+
+    def parallel_search(self, game, progress=None):
+        """ Searches the position by splitting the root moves between the worker processes """
+        position = Position(game.board, game.turn)
+        data = encoding.encode_board(game.board, game.turn)
+        start = time.monotonic()
+        self.nodes = 0
+        probes = hits = 0
+
+        moves = generate_moves(position, position.turn)
+        if not moves:
+            return SearchResult(None, 0, 0, 0, time.monotonic() - start)
+        book_move = self.book_move(position, moves)
+        if book_move is not None:
+            return SearchResult(book_move, 0, 0, 0, time.monotonic() - start, from_book=True)
+
+        pool = self.get_pool()
+        best_move = self.order_moves(position.board, moves)[0]
+        best_score = -INFINITY
+        depth = 0
+        for current_depth in range(1, self.max_depth + 1):
+            # the first depth is always completed, so there is always a searched move
+            deadline = None if current_depth == 1 else start + self.time_limit
+            self.shared_alpha.value = -INFINITY
+
+            # the moves are dealt like cards, so the good moves are spread between the workers
+            ordered = self.order_moves(position.board, moves, best_move)
+            chunks = [ordered[i::self.workers] for i in range(self.workers) if ordered[i::self.workers]]
+            results = pool.map(search_root_chunk, [(data, chunk, current_depth, deadline) for chunk in chunks])
+
+            self.nodes += sum(result[2] for result in results)
+            probes += sum(result[4] for result in results)
+            hits += sum(result[5] for result in results)
+            if not all(result[3] for result in results):
+                break
+            move, score = max(
+                [(result[0], result[1]) for result in results if result[0] is not None],
+                key=lambda item: item[1]
+            )
+            best_move, best_score, depth = move, score, current_depth
+            if progress is not None:
+                progress(SearchResult(best_move, best_score, depth, self.nodes, time.monotonic() - start, probes, hits))
+            if abs(best_score) >= MATE_SCORE - MAX_DEPTH:
+                break
+            if time.monotonic() > start + self.time_limit or self.stopped:
+                break
+
+        return SearchResult(best_move, best_score, depth, self.nodes, time.monotonic() - start, probes, hits)
+
+    def search_root(self, position, moves, depth, first, shared_alpha=None):
+        """ Searches the root moves and returns (best move, score)
+
+        If `shared_alpha` is given (a `multiprocessing.Value`), it's used as the alpha bound
+        and it's raised when a better move is found. In this case the best move is None if
+        no move is better than the shared alpha.
+        """
+        board = position.board
+        color = position.turn
+        key = encoding.position_hash(board, color)
+        alpha = -INFINITY
+        best_move = None
+        for move in self.order_moves(board, moves, first):
+            bound = alpha if shared_alpha is None else max(alpha, shared_alpha.value)
+            child_key = move_hash(board, move, key)
+            undo = make_move(board, move)
+            try:
+                score = -self.negamax(position, other_color(color), depth - 1, -INFINITY, -bound, 1, child_key)
+            finally:
+                unmake_move(board, move, undo)
+            if shared_alpha is None:
+                if best_move is None or score > alpha:
+                    alpha = score
+                    best_move = move
+            elif score > bound:
+                alpha = score
+                best_move = move
+                with shared_alpha.get_lock():
+                    if score > shared_alpha.value:
+                        shared_alpha.value = score
+        return best_move, alpha
+
+    def negamax(self, position, color, depth, alpha, beta, ply, key):
+        """ The negamax search with alpha-beta pruning, returns score for `color`
+
+        `key` is the zobrist hash of the position.
+        """
+        self.check_time()
+        board = position.board
+        table = self.table
+        table_move = None
+        if table is not None:
+            entry = table.probe(key)
+            if entry is not None:
+                entry_depth, flag, score, move_code = entry
+                if move_code:
+                    table_move = encoding.decode_move(move_code)
+                if entry_depth >= depth:
+                    score = score_from_table(score, ply)
+                    if flag == ttable.EXACT:
+                        return score
+                    if flag == ttable.LOWER and score >= beta:
+                        return score
+                    if flag == ttable.UPPER and score <= alpha:
+                        return score
+
+        if self.tablebases is not None:
+            value = tablebase.probe(self.tablebases, board, color)
+            if value is not None:
+                self.tablebase_hits += 1
+                return tablebase_score(value, ply)
+
+        legal_moves = generate_moves(position, color)
+
+        # checkmate or stalemate (see `Game.handle_check`)
+        if not legal_moves:
+            return no_moves_score(board, color, ply)
+
+        if depth <= 0:
+            return self.quiescence(position, color, legal_moves, alpha, beta, ply, QUIESCENCE_DEPTH)
+
+        original_alpha = alpha
+        best = -INFINITY
+        best_move = None
+        for move in self.order_moves(board, legal_moves, table_move):
+            child_key = move_hash(board, move, key)
+            undo = make_move(board, move)
+            try:
+                score = -self.negamax(position, other_color(color), depth - 1, -beta, -alpha, ply + 1, child_key)
+            finally:
+                unmake_move(board, move, undo)
+            if score > best:
+                best = score
+                best_move = move
+                if score > alpha:
+                    alpha = score
+                    if alpha >= beta:
+                        break
+
+        if table is not None:
+            if best <= original_alpha:
+                flag = ttable.UPPER
+            elif best >= beta:
+                flag = ttable.LOWER
+            else:
+                flag = ttable.EXACT
+            table.store(key, depth, flag, score_to_table(best, ply), encoding.encode_move(best_move))
+        return best
+
+    def quiescence(self, position, color, legal_moves, alpha, beta, ply, depth):
+        """ Searches only the captures to avoid stopping the search in middle of an exchange """
+        board = position.board
+        if not legal_moves:
+            return no_moves_score(board, color, ply)
+        stand_pat = evaluate(board, color)
+        if stand_pat >= beta or depth <= 0:
+            return stand_pat
+        if stand_pat > alpha:
+            alpha = stand_pat
+
+        captures = [move for move in legal_moves if board[move[1][0]][move[1][1]] is not None]
+        for move in self.order_moves(board, captures):
+            undo = make_move(board, move)
+            try:
+                self.check_time()
+                replies = generate_moves(position, other_color(color))
+                score = -self.quiescence(position, other_color(color), replies, -beta, -alpha, ply + 1, depth - 1)
+            finally:
+                unmake_move(board, move, undo)
+            if score >= beta:
+                return score
+            if score > alpha:
+                alpha = score
+        return alpha
@@ -0,0 +1,69 @@
+""" The headless mode (the `--headless` option)
+
+The commands are read from a stream (stdin or a file) one per line and the result of each one is
+written in one line, as text or as a JSON object (`--json`). Nothing is rendered, the beeps are
+disabled and the game is saved once after the last command (not after each one), so the scripts
+and the test harnesses that drive tchess only pay for the commands:
+
+    $ printf 'mv 2.4 4.4\nmv 7.5 5.5\ns 1.5\n' | tchess --headless --json
+"""
+
+import json
+
+# the commands that stop reading the commands
+EXIT_COMMANDS = ('exit', 'quit', 'q')
+
+def cell_name(cell):
+    """ Returns the 1 based name of a cell: [0, 3] -> `1.4` """
+    return str(cell[0] + 1) + '.' + str(cell[1] + 1)
+
+def run_command(game, command):
+    """ Runs a command on a game and returns its result message
+
+    The moves of a finished game are rejected (only `back` is allowed), like the interactive game.
+    """
+    if game.is_end and command != 'back':
+        return 'Error: the game is finished!'
+    return game.run_command(command)
+
+def to_json(game, command, result):
+    """ Returns the JSON line of the result of a command """
+    return json.dumps({
+        'command': command,
+        'result': result,
+        'cells': [cell_name(cell) for cell in sorted(game.highlight_cells)],
+        'turn': game.turn,
+        'check': game.current_check,
+        'is_end': game.is_end,
+        'winner': game.winner,
+        'draw': game.draw_reason,
+        'plies': len(game.logs),
+    })
+
+def to_text(game, result):
+    """ Returns the text line of the result of a command """
+    if not result and game.highlight_cells:
+        # the `s` command
+        result = ' '.join(cell_name(cell) for cell in sorted(game.highlight_cells))
+    if game.is_end:
+        result += ' (' + ' '.join(game.end_message()) + ')'
+    return result
+
+def run(game, stream, output, as_json=False):
+    """ Runs the commands of a stream (any iterable of lines) on a game and writes the results in `output`
+
+    The empty lines and the lines that start with `#` are skipped. Returns number of the commands.
+    """
+    game.enable_beep = False
+    count = 0
+    for line in stream:
+        command = line.strip().lower()
+        if not command or command.startswith('#'):
+            continue
+        if command in EXIT_COMMANDS:
+            break
+        result = run_command(game, command)
+        count += 1
+        output.write((to_json(game, command, result) if as_json else to_text(game, result)) + '\n')
+        output.flush()
+    return count
@@ -0,0 +1,132 @@
+""" The positions history of the games (persistent board snapshots)
+
+The logs of a game are the commands, so a past position is rebuilt by replaying them. The
+history keeps a `Snapshot` of each position instead: an immutable board (a tuple of row tuples)
+and the state of the game. A move changes at most two rows, so the snapshot of the next
+position is made of the two new rows and the other rows of the previous snapshot (the rows
+are shared, not copied). Keeping all of the positions of a long game costs a few tuples for
+each ply and any ply is accessed directly:
+
+    >>> history = game.history()
+    >>> history[10].board() # the board after 10 plies
+    >>> history[-2].turn
+
+The history also counts the positions by their zobrist hash (`Game.position_hash`), so the
+repetitions of a position are found without comparing the boards (`repetitions`).
+"""
+
+try:
+    from .tchess import Game
+except ImportError:
+    from tchess import Game
+
+class Snapshot:
+    """ An immutable position: the board rows and the state of the game after a ply """
+
+    __slots__ = ('rows', 'turn', 'current_check', 'is_end', 'winner', 'logs', 'key', 'clock', 'draw_reason')
+
+    def __init__(self, rows, turn, current_check=None, is_end=False, winner=None, logs=0, key=None, clock=0, draw_reason=None):
+        self.rows = rows
+        self.turn = turn
+        self.current_check = current_check
+        self.is_end = is_end
+        self.winner = winner
+        # number of the logs of the game in this position
+        self.logs = logs
+        # the position hash and the halfmove clock
+        self.key = key
+        self.clock = clock
+        self.draw_reason = draw_reason
+
+    @classmethod
+    def of(cls, game, rows=None):
+        """ Returns the snapshot of the current position of a game (`rows` are the rows of the board as tuples) """
+        if rows is None:
+            rows = tuple(tuple(row) for row in game.board)
+        return cls(
+            rows, game.turn, game.current_check, game.is_end, game.winner, len(game.logs),
+            game.position_hash(), game.halfmove_clock, game.draw_reason,
+        )
+
+    def moved(self, game, changed):
+        """ Returns the snapshot of a game after a move, `changed` are the rows that the move has changed """
+        rows = list(self.rows)
+        for x in changed:
+            rows[x] = tuple(game.board[x])
+        return Snapshot.of(game, tuple(rows))
+
+    def __getitem__(self, x):
+        return self.rows[x]
+
+    def board(self):
+        """ Returns a new (mutable) board list of the snapshot """
+        return [list(row) for row in self.rows]
+
+    def restore(self, game):
+        """ Sets the position and the state of a game to the snapshot (the logs are cut to the snapshot) """
+        game.board = self.board()
+        game.turn = self.turn
+        game.current_check = self.current_check
+        game.is_end = self.is_end
+        game.winner = self.winner
+        game.halfmove_clock = self.clock
+        game.draw_reason = self.draw_reason
+        del game.logs[self.logs:]
+
+class History:
+    """ The snapshots of all of the positions of a game, from the first one """
+
+    def __init__(self, snapshots):
+        self.snapshots = list(snapshots)
+        # {position hash: number of the snapshots of the position}
+        self.counts = {}
+        for snapshot in self.snapshots:
+            self.counts[snapshot.key] = self.counts.get(snapshot.key, 0) + 1
+
+    def __len__(self):
+        return len(self.snapshots)
+
+    def __getitem__(self, ply):
+        return self.snapshots[ply]
+
+    def __iter__(self):
+        return iter(self.snapshots)
+
+    @property
+    def last(self):
+        return self.snapshots[-1]
+
+    def push(self, game, changed):
+        """ Adds the position of a game after a move (see `Snapshot.moved`) """
+        snapshot = self.snapshots[-1].moved(game, changed)
+        self.snapshots.append(snapshot)
+        self.counts[snapshot.key] = self.counts.get(snapshot.key, 0) + 1
+
+    def pop(self):
+        """ Removes the last position and returns the previous one (the first position is not removed) """
+        if len(self.snapshots) > 1:
+            key = self.snapshots.pop().key
+            self.counts[key] -= 1
+            if not self.counts[key]:
+                del self.counts[key]
+        return self.snapshots[-1]
+
+    def repetitions(self, key):
+        """ Returns number of the positions of the history that have a position hash """
+        return self.counts.get(key, 0)
+
+    @classmethod
+    def of(cls, game):
+        """ Builds the history of a game by replaying its logs from the start position
+
+        The logs of a game that is not started from the start position (a FEN) can't be
+        replayed, the history of such a game starts from its current position.
+        """
+        replay = Game.from_state(white_player=game.white_player, black_player=game.black_player)
+        replay.enable_beep = False
+        replay.snapshots = history = cls([Snapshot.of(replay)])
+        for move in game.logs.moves():
+            replay.apply_move(*move)
+        if replay.board_key() != game.board_key() or replay.turn != game.turn:
+            return cls([Snapshot.of(game)])
+        return history
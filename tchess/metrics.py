@@ -0,0 +1,202 @@
+""" Minimal metrics in the Prometheus text format (used by the `/metrics` route of the server)
+
+    >>> requests_count = Counter('tchess_http_requests_total', 'Number of the requests', ('route',))
+    >>> requests_count.inc(route='/render')
+    >>> print(Registry([requests_count]).render())
+"""
+
+import time
+import bisect
+import threading
+from collections import deque
+
+# the default buckets of the histograms (seconds)
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+def format_value(value):
+    """ Formats a number for the text format """
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+def format_labels(names, values, extra=()):
+    """ Formats the labels of a sample: `{name="value",...}` """
+    items = list(zip(names, values)) + list(extra)
+    if not items:
+        return ''
+    return '{' + ','.join(
+        name + '="' + str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') + '"'
+        for name, value in items
+    ) + '}'
+
+class Metric:
+    """ Base class of the metrics, each one has a value for each set of label values """
+
+    TYPE = None
+
+    def __init__(self, name, description, labels=()):
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def key(self, labels):
+        """ Returns the label values in order of the label names """
+        return tuple(labels[name] for name in self.labels)
+
+    def samples(self):
+        """ Returns list of (name suffix, label values, extra labels, value) """
+        with self.lock:
+            return [('', key, (), value) for key, value in sorted(self.values.items())]
+
+    def render(self):
+        """ Returns the metric in the text format """
+        lines = [
+            '# HELP ' + self.name + ' ' + self.description,
+            '# TYPE ' + self.name + ' ' + self.TYPE,
+        ]
+        for suffix, key, extra, value in self.samples():
+            lines.append(self.name + suffix + format_labels(self.labels, key, extra) + ' ' + format_value(value))
+        return '\n'.join(lines)
+
+class Counter(Metric):
+    """ A number that only goes up """
+
+    TYPE = 'counter'
+
+    def inc(self, amount=1, **labels):
+        """ Increases the counter """
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+class Gauge(Metric):
+    """ A number that goes up and down (or a function that returns it) """
+
+    TYPE = 'gauge'
+
+    def __init__(self, name, description, labels=(), function=None):
+        super().__init__(name, description, labels)
+        # if set, this function returns {label values: value} (or the value if there are no labels)
+        self.function = function
+
+    def set(self, value, **labels):
+        """ Sets value of the gauge """
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = value
+
+    def samples(self):
+        if self.function is None:
+            return super().samples()
+        values = self.function()
+        if not isinstance(values, dict):
+            values = {(): values}
+        return [('', key, (), value) for key, value in sorted(values.items())]
+
+class Histogram(Metric):
+    """ Distribution of the observed values in cumulative buckets """
+
+    TYPE = 'histogram'
+
+    def __init__(self, name, description, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, description, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        """ Adds an observed value """
+        key = self.key(labels)
+        with self.lock:
+            item = self.values.get(key)
+            if item is None:
+                # counts of the buckets (the last one is +Inf), sum of the values
+                item = self.values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            item[0][bisect.bisect_left(self.buckets, value)] += 1
+            item[1] += value
+
+    def time(self, **labels):
+        """ Returns a context manager that observes the spent time of its block """
+        return Timer(self, labels)
+
+    def samples(self):
+        result = []
+        with self.lock:
+            for key, (counts, total) in sorted(self.values.items()):
+                seen = 0
+                for bound, count in zip(self.buckets + (float('inf'),), counts):
+                    seen += count
+                    result.append(('_bucket', key, (('le', format_value(float(bound))),), seen))
+                result.append(('_sum', key, (), total))
+                result.append(('_count', key, (), seen))
+        return result
+
+class Timer:
+    """ Observes the spent time of a block in a histogram """
+
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        self.histogram.observe(time.perf_counter() - self.start, **self.labels)
+
+class RateMeter:
+    """ Counts the events of the last `window` seconds to calculate their rate per second
+
+    The events are counted in one second buckets, so the meter keeps at most `window` buckets
+    however many events are marked (and however rarely the rate is read).
+    """
+
+    def __init__(self, window=60):
+        self.window = window
+        # [second, number of the events in the second] of the seconds that have events
+        self.buckets = deque()
+        self.lock = threading.Lock()
+
+    def trim(self, now):
+        """ Removes the buckets that are older than the window (the lock should be held) """
+        limit = int(now) - self.window
+        while self.buckets and self.buckets[0][0] <= limit:
+            self.buckets.popleft()
+
+    def mark(self):
+        """ Adds an event """
+        now = time.time()
+        second = int(now)
+        with self.lock:
+            if self.buckets and self.buckets[-1][0] == second:
+                self.buckets[-1][1] += 1
+            else:
+                self.buckets.append([second, 1])
+                self.trim(now)
+
+    def rate(self):
+        """ Returns number of the events per second in the window """
+        with self.lock:
+            self.trim(time.time())
+            return sum(count for second, count in self.buckets) / self.window
+
+class Registry:
+    """ A list of metrics that are rendered together """
+
+    CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+    def __init__(self, metrics=None):
+        self.metrics = list(metrics or [])
+
+    def add(self, metric):
+        """ Adds a metric and returns it """
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        """ Returns all of the metrics in the text format """
+        return '\n'.join(metric.render() for metric in self.metrics) + '\n'
@@ -0,0 +1,109 @@
+""" The cache of the legal moves
+
+The legal targets of the pieces are cached by (board key, cell), the board key is the zobrist
+hash of the pieces (`encoding.position_hash` without the turn, the targets of a piece don't
+depend on the turn). The cache is shared by all of the games of the process, so the `s` command,
+`Game.handle_check` and the moves of the common positions (the openings of the games of a server)
+are calculated once:
+
+    >>> targets = CACHE.get((key, cell))
+    >>> if targets is None:
+    ...     targets = CACHE.put((key, cell), calculate())
+    >>> CACHE.hit_rate
+
+The cache is a LRU: when it's full, the entry that is not used for the longest time is removed.
+"""
+
+import threading
+from collections import OrderedDict
+
+try:
+    from . import encoding
+except ImportError:
+    import encoding
+
+# the default number of the entries (a cell of a position)
+DEFAULT_SIZE = 65536
+
+class MoveCache:
+    """ A LRU cache with a fixed number of entries and hit statistics """
+
+    def __init__(self, size=DEFAULT_SIZE):
+        self.size = size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        """ Returns value of a key (or None if it's not in the cache) """
+        with self.lock:
+            value = self.entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        """ Adds a value and returns it, the least recently used entries are removed when the cache is full """
+        if self.size <= 0:
+            return value
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+        return value
+
+    def resize(self, size):
+        """ Changes the number of the entries (0 disables the cache) """
+        with self.lock:
+            self.size = size
+            while len(self.entries) > max(size, 0):
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        """ Removes the entries and resets the statistics """
+        with self.lock:
+            self.entries.clear()
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    @property
+    def hit_rate(self):
+        """ Rate of the lookups that the entry was found """
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def stats(self):
+        """ Returns the statistics as a dict """
+        return {
+            'size': self.size,
+            'entries': len(self.entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': self.hit_rate,
+        }
+
+# the cache of the process
+CACHE = MoveCache()
+
+def board_key(board):
+    """ Returns key of the pieces of a board """
+    return encoding.position_hash(board, 'white')
+
+def moved_key(key, piece, src, dst, captured, placed):
+    """ Returns key of the board after a move: `piece` moved from `src` to `dst`, `placed` is the piece
+    on `dst` after the move (the promoted piece) and `captured` is the piece that was on `dst` """
+    return key ^ encoding.piece_hash(piece, src[0], src[1]) ^ encoding.piece_hash(captured, dst[0], dst[1]) \
+        ^ encoding.piece_hash(placed, dst[0], dst[1])
@@ -1,10 +1,26 @@
 """ Piece move validators
 
 In this module, we have some functions to validate different pieces moves.
+
+The `*_move` functions return the pseudo-legal targets of a piece (they don't care about
+the king). `legal_targets` and `legal_moves` keep only the legal ones: the king of the
+player is found once, then the pins (the rays from the king to the enemy sliders that
+have only one piece of the player) and the check mask (the cells that stop the check:
+the checker and the cells between it and the king) are calculated. A pinned piece can
+only move on its pin ray, in check the other pieces can only move to the check mask, and
+the king can only move to the cells that are not attacked. So no move is made and undone
+to validate it.
 """
 
 # NOTE: the `self` argument for each function is the `Piece` object
 
+# the piece ids are read from the pieces (`piece.KING`, ...), so this module doesn't import `Piece`
+
+KNIGHT_OFFSETS = ((1, 2), (-1, 2), (1, -2), (-1, -2), (2, 1), (2, -1), (-2, 1), (-2, -1))
+KING_OFFSETS = ((1, 1), (1, 0), (1, -1), (0, 1), (0, -1), (-1, 1), (-1, 0), (-1, -1))
+ROOK_DIRECTIONS = ((1, 0), (-1, 0), (0, 1), (0, -1))
+BISHOP_DIRECTIONS = ((1, 1), (1, -1), (-1, 1), (-1, -1))
+
 def pawn_move(self, game, src):
     """ Validates pawn move """
     x = src[0]
@@ -36,18 +52,14 @@ def pawn_move(self, game, src):
         except IndexError:
             pass
         a += 1
-    try:
-        if game.board[x + pawns_one_row_front][y + 1] is not None:
-            if game.board[x + pawns_one_row_front][y + 1].color != self.color:
-                result.append([x + pawns_one_row_front, y + 1])
-    except IndexError:
-        pass
-    try:
-        if game.board[x + pawns_one_row_front][y - 1] is not None:
-            if game.board[x + pawns_one_row_front][y - 1].color != self.color:
-                result.append([x + pawns_one_row_front, y - 1])
-    except IndexError:
-        pass
+    # the captures (checked by range, a negative index would wrap to the other side of the board)
+    front = x + pawns_one_row_front
+    if 0 <= front < 8:
+        for side in (y + 1, y - 1):
+            if 0 <= side < 8:
+                if game.board[front][side] is not None:
+                    if game.board[front][side].color != self.color:
+                        result.append([front, side])
 
     return result
 
@@ -207,3 +219,173 @@ def bishop_move(self, game, src):
                 new_result.append(item)
 
     return new_result
+
+def find_king(board, color):
+    """ Returns location of the king of a color (or None if there is no king) """
+    for x in range(8):
+        row = board[x]
+        for y in range(8):
+            piece = row[y]
+            if piece is not None and piece.name == piece.KING and piece.color == color:
+                return x, y
+    return None
+
+def is_attacked(board, cell, color, ignore=None):
+    """ Checks the cell is attacked by the pieces of `color`
+
+    The `ignore` cell is considered empty (the king that is moving doesn't block the rays).
+    """
+    x, y = cell
+    for offsets, name in ((KNIGHT_OFFSETS, 'KNIGHT'), (KING_OFFSETS, 'KING')):
+        for dx, dy in offsets:
+            a = x + dx
+            b = y + dy
+            if 0 <= a < 8 and 0 <= b < 8:
+                piece = board[a][b]
+                if piece is not None and piece.color == color and piece.name == getattr(piece, name):
+                    return True
+
+    # the pawns attack forward (white pawns to +x)
+    a = x - (1 if color == 'white' else -1)
+    if 0 <= a < 8:
+        for b in (y - 1, y + 1):
+            if 0 <= b < 8:
+                piece = board[a][b]
+                if piece is not None and piece.color == color and piece.name == piece.PAWN:
+                    return True
+
+    for directions, name in ((ROOK_DIRECTIONS, 'ROOK'), (BISHOP_DIRECTIONS, 'BISHOP')):
+        for dx, dy in directions:
+            a = x + dx
+            b = y + dy
+            while 0 <= a < 8 and 0 <= b < 8:
+                piece = board[a][b]
+                if piece is not None and (a, b) != ignore:
+                    if piece.color == color and (piece.name == getattr(piece, name) or piece.name == piece.QUEEN):
+                        return True
+                    break
+                a += dx
+                b += dy
+    return False
+
+def pins_and_checks(board, color, king=None):
+    """ Calculates the pins and checks of the king of `color`
+
+    Returns (king, checks, check mask, pins) or None if there is no king:
+    number of the pieces that check the king, set of the cells that stop the check
+    and {location of a pinned piece: set of the cells of its pin ray}.
+    The king is searched on the board if its location is not given.
+    """
+    if king is None:
+        king = find_king(board, color)
+    if king is None:
+        return None
+    x, y = king
+    checks = 0
+    mask = set()
+    pins = {}
+
+    for directions, name in ((ROOK_DIRECTIONS, 'ROOK'), (BISHOP_DIRECTIONS, 'BISHOP')):
+        for dx, dy in directions:
+            ray = []
+            pinned = None
+            a = x + dx
+            b = y + dy
+            while 0 <= a < 8 and 0 <= b < 8:
+                ray.append((a, b))
+                piece = board[a][b]
+                if piece is not None:
+                    if piece.color == color:
+                        if pinned is not None:
+                            break
+                        pinned = (a, b)
+                    else:
+                        if piece.name == getattr(piece, name) or piece.name == piece.QUEEN:
+                            if pinned is None:
+                                checks += 1
+                                mask.update(ray)
+                            else:
+                                pins[pinned] = set(ray)
+                        break
+                a += dx
+                b += dy
+
+    for dx, dy in KNIGHT_OFFSETS:
+        a = x + dx
+        b = y + dy
+        if 0 <= a < 8 and 0 <= b < 8:
+            piece = board[a][b]
+            if piece is not None and piece.color != color and piece.name == piece.KNIGHT:
+                checks += 1
+                mask.add((a, b))
+
+    # the enemy pawns that attack the king
+    a = x + (1 if color == 'white' else -1)
+    if 0 <= a < 8:
+        for b in (y - 1, y + 1):
+            if 0 <= b < 8:
+                piece = board[a][b]
+                if piece is not None and piece.color != color and piece.name == piece.PAWN:
+                    checks += 1
+                    mask.add((a, b))
+
+    return king, checks, mask, pins
+
+def legal_targets(piece, board, src, targets, info, king_can_go=None):
+    """ Keeps the legal targets of a piece from its pseudo-legal targets
+
+    `info` is the result of `pins_and_checks` for color of the piece. `king_can_go(target)`
+    checks a target of the king is not attacked (by default the attackers are searched
+    with `is_attacked`, `Game` uses its attack map).
+    """
+    result = []
+    if info is None:
+        # there is no king, so every move is legal
+        for target in targets:
+            if 0 <= target[0] < 8 and 0 <= target[1] < 8:
+                result.append(target)
+        return result
+
+    king, checks, mask, pins = info
+    if piece.name == piece.KING:
+        enemy = 'black' if piece.color == 'white' else 'white'
+        for target in targets:
+            if 0 <= target[0] < 8 and 0 <= target[1] < 8:
+                if king_can_go is not None:
+                    if king_can_go(target):
+                        result.append(target)
+                elif not is_attacked(board, (target[0], target[1]), enemy, ignore=(src[0], src[1])):
+                    result.append(target)
+        return result
+
+    if checks > 1:
+        # only the king can escape from a double check
+        return result
+    pin = pins.get((src[0], src[1]))
+    for target in targets:
+        if 0 <= target[0] < 8 and 0 <= target[1] < 8:
+            cell = (target[0], target[1])
+            if checks and cell not in mask:
+                continue
+            if pin is not None and cell not in pin:
+                continue
+            result.append(target)
+    return result
+
+def legal_moves(game, color):
+    """ Returns the legal moves of all of the pieces of a color: [((x, y), [[x, y], ...]), ...]
+
+    The pins and checks are calculated once for all of the pieces.
+    """
+    board = game.board
+    info = pins_and_checks(board, color)
+    result = []
+    for x in range(8):
+        row = board[x]
+        for y in range(8):
+            piece = row[y]
+            if piece is not None and piece.color == color:
+                targets = legal_targets(piece, board, (x, y), piece.pseudo_moves(game, [x, y]), info)
+                if targets:
+                    result.append(((x, y), targets))
+    return result
@@ -0,0 +1,347 @@
+""" PGN and FEN (the standard notations of the games and the positions)
+
+The readers and writers are generators, a PGN file is read line by line and written game by
+game, so the big game databases are imported/exported with a constant memory:
+
+    >>> for game in pgn.import_games(open('games.pgn')):
+    ...     save_game(game, ...)
+    >>> pgn.write_games(open('out.pgn', 'w'), (load_game_from_file(path) for path in paths))
+
+The ranks are the rows of the board (`x + 1`) and the files are the columns from the
+queen side: file `a` is `y = 7` and file `h` is `y = 0` (the king is on `e1`, `y = 3`).
+
+Tchess has no castling and en passant, a PGN game that uses them raises `PGNError`.
+The castling and en passant fields of a FEN are ignored when it's read and written as `-`.
+"""
+
+import re
+
+try:
+    from .tchess import Game, Piece
+    from . import moves
+except ImportError:
+    from tchess import Game, Piece
+    import moves
+
+FILES = 'abcdefgh'
+
+# SAN letters of the pieces (the pawns don't have a letter in the moves)
+LETTERS = {
+    Piece.PAWN: 'P',
+    Piece.KING: 'K',
+    Piece.QUEEN: 'Q',
+    Piece.KNIGHT: 'N',
+    Piece.BISHOP: 'B',
+    Piece.ROOK: 'R',
+}
+PIECES = {letter: name for name, letter in LETTERS.items()}
+
+RESULTS = ('1-0', '0-1', '1/2-1/2', '*')
+
+START_FEN = 'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w - - 0 1'
+
+# the headers that are written first, in this order (the "seven tag roster")
+ROSTER = ('Event', 'Site', 'Date', 'Round', 'White', 'Black', 'Result')
+
+TAG = re.compile(r'^\[\s*(\w+)\s+"((?:[^"\\]|\\.)*)"\s*\]\s*$')
+TOKEN = re.compile(r'[{}();]|[^\s{}();]+')
+MOVE_NUMBER = re.compile(r'^\d+\.+')
+SAN = re.compile(r'^([KQRBN]?)([a-h]?)([1-8]?)(x?)([a-h][1-8])(?:=?([QRBN]))?$')
+
+# length of the movetext lines
+LINE_LENGTH = 79
+
+class PGNError(Exception):
+    """ Raised when a PGN game or a FEN can't be read """
+
+def square_name(cell):
+    """ Returns name of a cell: (0, 3) -> `e1` """
+    return FILES[7 - cell[1]] + str(cell[0] + 1)
+
+def parse_square(name):
+    """ Returns location of a cell name: `e1` -> (0, 3) """
+    return int(name[1]) - 1, 7 - FILES.index(name[0])
+
+class PGNGame:
+    """ A game of a PGN file: the headers, the SAN moves and the result """
+
+    def __init__(self, headers=None, moves=None, result='*'):
+        self.headers = {} if headers is None else headers
+        self.moves = [] if moves is None else moves
+        self.result = result
+
+def read_games(stream):
+    """ Reads the games of a PGN file (or any iterable of lines) and yields them as `PGNGame`s
+
+    The comments, variations and annotations are skipped.
+    """
+    game = PGNGame()
+    has_movetext = False
+    in_comment = False
+    variations = 0
+
+    for line in stream:
+        if line.startswith('%'):
+            # escaped line
+            continue
+        if not in_comment and not variations:
+            tag = TAG.match(line.strip())
+            if tag is not None:
+                if has_movetext:
+                    # the previous game has no result
+                    yield game
+                    game = PGNGame()
+                    has_movetext = False
+                game.headers[tag.group(1)] = tag.group(2).replace('\\"', '"').replace('\\\\', '\\')
+                continue
+
+        for token in TOKEN.findall(line):
+            if in_comment:
+                if token == '}':
+                    in_comment = False
+                continue
+            if token == '{':
+                in_comment = True
+            elif token == ';':
+                # the rest of the line is a comment
+                break
+            elif token == '(':
+                variations += 1
+            elif token == ')':
+                variations = max(0, variations - 1)
+            elif variations or token.startswith('$'):
+                continue
+            elif token in RESULTS:
+                game.result = token
+                yield game
+                game = PGNGame()
+                has_movetext = False
+            else:
+                token = MOVE_NUMBER.sub('', token)
+                if token:
+                    game.moves.append(token)
+                    has_movetext = True
+
+    if has_movetext or game.headers:
+        yield game
+
+def parse_san(game, san):
+    """ Returns the move of a SAN string in a game: (src, dst, promotion) """
+    text = san.rstrip('+#!?')
+    if text in ('O-O', 'O-O-O', '0-0', '0-0-0'):
+        raise PGNError('castling is not supported: ' + san)
+    match = SAN.match(text)
+    if match is None:
+        raise PGNError('invalid move: ' + san)
+    letter, file, rank, capture, target, promotion = match.groups()
+    name = PIECES[letter] if letter else Piece.PAWN
+    dst = parse_square(target)
+
+    found = []
+    for src, targets in moves.legal_moves(game, game.turn):
+        piece = game.board[src[0]][src[1]]
+        if piece.name != name or [dst[0], dst[1]] not in [list(item) for item in targets]:
+            continue
+        if file and square_name(src)[0] != file:
+            continue
+        if rank and square_name(src)[1] != rank:
+            continue
+        found.append(src)
+
+    if len(found) != 1:
+        if not found and name == Piece.PAWN and capture and game.board[dst[0]][dst[1]] is None:
+            raise PGNError('en passant is not supported: ' + san)
+        raise PGNError(('ambiguous' if found else 'illegal') + ' move: ' + san)
+    return found[0], dst, PIECES[promotion] if promotion else None
+
+def move_to_san(game, src, dst, promotion=None):
+    """ Returns the SAN string of a legal move in a game (before the move is applied, without `+` and `#`) """
+    piece = game.board[src[0]][src[1]]
+    capture = game.board[dst[0]][dst[1]] is not None
+    target = square_name(dst)
+
+    if piece.name == Piece.PAWN:
+        san = (square_name(src)[0] + 'x' if capture else '') + target
+        if promotion is not None:
+            san += '=' + LETTERS[promotion]
+        return san
+
+    # the other pieces of the same type that can go to the target
+    others = []
+    for cell, targets in moves.legal_moves(game, game.turn):
+        if tuple(cell) != tuple(src) and game.board[cell[0]][cell[1]].name == piece.name:
+            if [dst[0], dst[1]] in [list(item) for item in targets]:
+                others.append(square_name(cell))
+    name = square_name(src)
+    prefix = ''
+    if others:
+        if all(other[0] != name[0] for other in others):
+            prefix = name[0]
+        elif all(other[1] != name[1] for other in others):
+            prefix = name[1]
+        else:
+            prefix = name
+    return LETTERS[piece.name] + prefix + ('x' if capture else '') + target
+
+def apply_san(game, san):
+    """ Applies a SAN move on a game (it's logged as a `mv` command) """
+    src, dst, promotion = parse_san(game, san)
+    logs_count = len(game.logs)
+    result = game.apply_move(src, dst, promotion)
+    if len(game.logs) == logs_count:
+        raise PGNError('cannot apply move ' + san + ': ' + result)
+
+def replay(pgn_game):
+    """ Converts a `PGNGame` to a `Game` by applying its moves
+
+    The logs of a tchess game always start from the start position, so the games that
+    start from another position (the `FEN` header) are not supported.
+    """
+    fen = pgn_game.headers.get('FEN')
+    if fen is not None and fen.split()[:2] != START_FEN.split()[:2]:
+        raise PGNError('games that start from a FEN position are not supported')
+    game = Game.from_state(
+        white_player=pgn_game.headers.get('White', ''),
+        black_player=pgn_game.headers.get('Black', ''),
+    )
+    game.enable_beep = False
+    for san in pgn_game.moves:
+        if game.is_end:
+            raise PGNError('the game is finished before move ' + san)
+        apply_san(game, san)
+    return game
+
+def import_games(stream, errors=None):
+    """ Reads the games of a PGN file and yields them as `Game`s
+
+    The games that can't be replayed are skipped, if `errors` is a list,
+    (number of the game, error) of each one of them is added to it.
+    """
+    for number, pgn_game in enumerate(read_games(stream), 1):
+        try:
+            yield replay(pgn_game)
+        except PGNError as error:
+            if errors is not None:
+                errors.append((number, error))
+
+def game_result(game):
+    """ Returns the PGN result of a game """
+    if not game.is_end:
+        return '*'
+    if game.winner is None:
+        return '1/2-1/2'
+    return '1-0' if game.winner == 'white' else '0-1'
+
+def san_moves(game):
+    """ Replays logs of a game and yields the SAN strings of its moves """
+    replay_game = Game.from_state(white_player=game.white_player, black_player=game.black_player)
+    replay_game.enable_beep = False
+    for src, dst, promotion in game.logs.moves():
+        if not (0 <= src[0] < 8 and 0 <= src[1] < 8) or replay_game.board[src[0]][src[1]] is None:
+            continue
+        piece = replay_game.board[src[0]][src[1]]
+        if piece.name != Piece.PAWN or dst[0] not in (0, 7):
+            promotion = None
+        san = move_to_san(replay_game, src, dst, promotion)
+        logs_count = len(replay_game.logs)
+        replay_game.apply_move(src, dst, promotion)
+        if len(replay_game.logs) == logs_count:
+            continue
+        if replay_game.current_check is not None:
+            san += '#' if replay_game.is_end else '+'
+        yield san
+
+def format_game(game, headers=None):
+    """ Returns the PGN text of a game, `headers` are added to (or replace) the default headers """
+    result = game_result(game)
+    items = {
+        'Event': '?', 'Site': '?', 'Date': '????.??.??', 'Round': '?',
+        'White': game.white_player or '?', 'Black': game.black_player or '?', 'Result': result,
+    }
+    items.update(headers or {})
+    lines = []
+    for name in list(ROSTER) + [name for name in items if name not in ROSTER]:
+        lines.append('[' + name + ' "' + str(items[name]).replace('\\', '\\\\').replace('"', '\\"') + '"]')
+    lines.append('')
+
+    line = ''
+    for i, san in enumerate(san_moves(game)):
+        token = (str(i // 2 + 1) + '. ' if i % 2 == 0 else '') + san
+        if line and len(line) + 1 + len(token) > LINE_LENGTH:
+            lines.append(line)
+            line = ''
+        line = (line + ' ' + token) if line else token
+    line = (line + ' ' + result) if line else result
+    lines.append(line)
+    return '\n'.join(lines) + '\n'
+
+def write_games(stream, games, headers=None):
+    """ Writes the games (any iterable of `Game`s) in a PGN file one by one, returns number of the games """
+    count = 0
+    for game in games:
+        if count:
+            stream.write('\n')
+        stream.write(format_game(game, headers))
+        count += 1
+    return count
+
+def to_fen(game):
+    """ Returns the FEN of the position of a game """
+    rows = []
+    for x in range(7, -1, -1):
+        row = ''
+        empty = 0
+        for y in range(7, -1, -1):
+            piece = game.board[x][y]
+            if piece is None:
+                empty += 1
+                continue
+            if empty:
+                row += str(empty)
+                empty = 0
+            letter = LETTERS[piece.name]
+            row += letter if piece.color == 'white' else letter.lower()
+        if empty:
+            row += str(empty)
+        rows.append(row)
+    fullmove = (game.start_ply + len(game.logs)) // 2 + 1
+    return '/'.join(rows) + ' ' + game.turn[0] + ' - - ' + str(game.halfmove_clock) + ' ' + str(fullmove)
+
+def from_fen(fen, white_player='', black_player=''):
+    """ Returns a new game in the position of a FEN
+
+    The halfmove clock and the fullmove number are kept (`Game.halfmove_clock`, `Game.start_ply`).
+    """
+    fields = fen.split()
+    if len(fields) < 2 or fields[1] not in ('w', 'b'):
+        raise PGNError('invalid FEN: ' + fen)
+    rows = fields[0].split('/')
+    if len(rows) != 8:
+        raise PGNError('FEN should have 8 ranks: ' + fen)
+
+    board = [[None] * 8 for i in range(8)]
+    for rank, row in enumerate(rows):
+        x = 7 - rank
+        y = 7
+        for char in row:
+            if char.isdigit():
+                y -= int(char)
+            elif char.upper() in PIECES:
+                if y < 0:
+                    raise PGNError('rank ' + str(8 - rank) + ' of FEN should have 8 cells: ' + fen)
+                board[x][y] = Piece(PIECES[char.upper()], 'white' if char.isupper() else 'black')
+                y -= 1
+            else:
+                raise PGNError('invalid piece `' + char + '` in FEN: ' + fen)
+        if y != -1:
+            raise PGNError('rank ' + str(8 - rank) + ' of FEN should have 8 cells: ' + fen)
+
+    turn = 'white' if fields[1] == 'w' else 'black'
+    halfmove_clock = int(fields[4]) if len(fields) > 4 and fields[4].isdigit() else 0
+    fullmove = int(fields[5]) if len(fields) > 5 and fields[5].isdigit() else 1
+    game = Game.from_state(
+        board=board, turn=turn, white_player=white_player, black_player=black_player,
+        halfmove_clock=halfmove_clock, start_ply=max(0, fullmove - 1) * 2 + (1 if turn == 'black' else 0),
+    )
+    game.handle_check()
+    return game
@@ -0,0 +1,102 @@
+""" Pondering: the analysis of the position while the player is thinking (the `hint` command)
+
+While the game waits for the command of the player, a background thread searches the
+position with its own engine. The result of each finished depth of the iterative deepening
+is kept, so `hint` is answered from the deepest one without waiting:
+
+    >>> ponderer = Ponderer()
+    >>> ponderer.start(game) # before waiting for the command
+    >>> ponderer.hint(game) # the `SearchResult` of the deepest finished depth (or None)
+
+The analysis is cancelled and started again when the position is changed (`start` with
+another position). The commands that don't change the position don't stop it, it's cancelled
+when a move or `back` changes the position (`is_stale`) and before the AI searches, so the AI
+doesn't share the CPU with it. If the table of the AI is given, the
+analysis fills the table that the AI uses, otherwise it has a small table of its own.
+"""
+
+import threading
+
+try:
+    from . import engine
+except ImportError:
+    import engine
+
+# the maximum time of the analysis of a position (seconds)
+PONDER_TIME = 10.0
+
+# size of the transposition table of the analysis when the table of the AI is not given (bytes)
+PONDER_TABLE_SIZE = 1024 * 1024
+
+class Ponderer:
+    """ Searches the position of a game in a background thread """
+
+    def __init__(self, time_limit=PONDER_TIME, table=None):
+        self.engine = engine.Engine(time_limit=time_limit, table_size=0 if table is not None else PONDER_TABLE_SIZE)
+        if table is not None:
+            self.engine.table = table
+        self.thread = None
+        self.lock = threading.Lock()
+        # the analyzed position: (board key, turn)
+        self.key = None
+        # the result of the deepest finished depth
+        self.result = None
+
+    @staticmethod
+    def position_key(game):
+        return game.board_key(), game.turn
+
+    @property
+    def running(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def start(self, game):
+        """ Starts the analysis of the position of a game (the analysis of the same position is not started again) """
+        key = Ponderer.position_key(game)
+        if key == self.key:
+            return
+        self.cancel()
+        self.key = key
+        self.engine.stopped = False
+        # the thread searches a copy of the board, the game may be changed while it's searching
+        position = engine.Position(game.board, game.turn)
+        self.thread = threading.Thread(target=self.run, args=(position, key))
+        self.thread.daemon = True
+        self.thread.start()
+
+    def run(self, position, key):
+        """ Searches a position (it's run in the thread) """
+        def progress(result):
+            with self.lock:
+                if self.key == key:
+                    self.result = result
+        self.engine.search(position, progress=progress)
+
+    def cancel(self):
+        """ Stops the analysis and waits for the thread """
+        if self.thread is not None:
+            self.engine.stop()
+            self.thread.join()
+            self.thread = None
+        with self.lock:
+            self.key = None
+            self.result = None
+
+    def is_stale(self, game):
+        """ Checks the analysis is of another position than the position of a game """
+        return self.key is not None and self.key != Ponderer.position_key(game)
+
+    def hint(self, game):
+        """ Returns the `SearchResult` of the deepest finished depth of the position of a game (or None) """
+        with self.lock:
+            if self.key == Ponderer.position_key(game):
+                return self.result
+        return None
+
+def hint_message(result):
+    """ Returns the message of the `hint` command """
+    if result is None:
+        return 'There is no hint yet, try again in a moment.'
+    if result.move is None:
+        return 'There is no move.'
+    return 'Hint: `' + engine.move_to_command(result.move) + '` (' + str(result) + ', score ' + str(result.score) + ')'
@@ -0,0 +1,167 @@
+""" Timing of the phases of the game commands (the `--profile` option)
+
+The profiler wraps the methods of the phases only when it's installed, so the game
+doesn't pay anything when profiling is disabled:
+
+    parse:    `Game.run_command` (without the other phases that it runs)
+    move:     `Game.apply_move` (the logs, the history and the draws of a move)
+    validate: `Piece.allowed_moves` (the validation of a move in `Game.move` and the `s` command)
+    apply:    `Game.move`
+    check:    `Game.handle_check`
+    render:   `Game.render`
+    save:     `save_game`
+
+The phases nest (`parse` runs `move`, `move` runs `apply` and `check`, `apply` runs `validate`),
+time of each call is its own time: the time of the nested phases is not counted twice.
+The moves are timed in `Game.apply_move`, so the moves that are not parsed from a command
+(the replay, the AI, the PGN import and the tournaments) are timed too.
+The times are kept as histograms with power of 2 buckets (in microseconds).
+"""
+
+import sys
+import json
+import time
+
+try:
+    from . import tchess
+except ImportError:
+    import tchess
+
+# the phases in order of the report
+PHASES = ('parse', 'move', 'validate', 'apply', 'check', 'render', 'save')
+
+# the histogram buckets are [2**(i-1), 2**i) microseconds, the last one is everything longer
+BUCKETS = 24
+
+class Histogram:
+    """ Histogram of the times of a phase """
+
+    def __init__(self):
+        self.buckets = [0] * BUCKETS
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds):
+        """ Adds a time """
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+        self.buckets[min(BUCKETS - 1, int(seconds * 1000000).bit_length())] += 1
+
+    def percentile(self, rate):
+        """ Returns upper bound of the bucket of a percentile (in microseconds) """
+        limit = rate * self.count
+        seen = 0
+        for i, count in enumerate(self.buckets):
+            seen += count
+            if seen >= limit:
+                return 2 ** i
+        return 2 ** BUCKETS
+
+    def to_dict(self):
+        """ Returns the histogram as a dict (for the json file) """
+        return {
+            'count': self.count,
+            'total_ms': round(self.total * 1000, 3),
+            'mean_us': round(self.total * 1000000 / self.count, 3) if self.count else 0,
+            'max_us': round(self.max * 1000000, 3),
+            'p50_us': self.percentile(0.5),
+            'p99_us': self.percentile(0.99),
+            # upper bound of the bucket (microseconds) -> count
+            'buckets': {str(2 ** i): count for i, count in enumerate(self.buckets) if count},
+        }
+
+class Profiler:
+    """ Collects the times of the phases """
+
+    def __init__(self):
+        self.histograms = {phase: Histogram() for phase in PHASES}
+        # the running phases: [phase, start time, time of the nested phases]
+        self.stack = []
+        self.wrapped = []
+
+    def wrap(self, owner, attribute, phase):
+        """ Replaces a function of a class/module with a timed one (its own time is added to the phase) """
+        original = getattr(owner, attribute)
+        stack = self.stack
+        histogram = self.histograms[phase]
+
+        def timed(*args, **kwargs):
+            stack.append([phase, time.perf_counter(), 0.0])
+            try:
+                return original(*args, **kwargs)
+            finally:
+                item = stack.pop()
+                spent = time.perf_counter() - item[1]
+                histogram.add(spent - item[2])
+                if stack:
+                    stack[-1][2] += spent
+
+        timed.__wrapped__ = original
+        timed.__doc__ = original.__doc__
+        setattr(owner, attribute, timed)
+        self.wrapped.append((owner, attribute, original))
+
+    def install(self, parse=True, module=None):
+        """ Wraps the functions of the phases (the parse phase is wrapped only if `parse` is True)
+
+        `module` is the tchess module that is running. When `tchess.py` is run as a script, it's
+        `__main__`, and the `tchess` module that is imported here is another copy of it.
+        """
+        if module is None:
+            module = tchess
+        if parse:
+            self.wrap(module.Game, 'run_command', 'parse')
+        self.wrap(module.Game, 'apply_move', 'move')
+        self.wrap(module.Piece, 'allowed_moves', 'validate')
+        self.wrap(module.Game, 'move', 'apply')
+        self.wrap(module.Game, 'handle_check', 'check')
+        self.wrap(module.Game, 'render', 'render')
+        self.wrap(module, 'save_game', 'save')
+
+    def uninstall(self):
+        """ Restores the original functions """
+        while self.wrapped:
+            owner, attribute, original = self.wrapped.pop()
+            setattr(owner, attribute, original)
+
+    def to_dict(self):
+        """ Returns the collected times as a dict """
+        return {phase: self.histograms[phase].to_dict() for phase in PHASES}
+
+    def report(self):
+        """ Returns the text report of the times """
+        lines = ['Profile (own time of each phase, the time of the nested phases is not counted in it):']
+        lines.append('{:<10}{:>8}{:>12}{:>12}{:>12}{:>12}'.format('phase', 'calls', 'total ms', 'mean us', 'p99 us', 'max us'))
+        for phase in PHASES:
+            item = self.histograms[phase].to_dict()
+            lines.append('{:<10}{:>8}{:>12}{:>12}{:>12}{:>12}'.format(
+                phase, item['count'], item['total_ms'], item['mean_us'], item['p99_us'], item['max_us']
+            ))
+        for phase in PHASES:
+            histogram = self.histograms[phase]
+            if not histogram.count:
+                continue
+            lines.append('')
+            lines.append(phase + ':')
+            most = max(histogram.buckets)
+            for i, count in enumerate(histogram.buckets):
+                if count:
+                    bar = '#' * max(1, int(count * 40 / most))
+                    lines.append('  < {:>9} us | {} {}'.format(2 ** i, bar, count))
+        return '\n'.join(lines)
+
+    def save(self, path):
+        """ Writes the collected times in a json file """
+        with open(path, 'w') as profile_file:
+            json.dump(self.to_dict(), profile_file, indent=4)
+
+    def finish(self, path=None):
+        """ Writes the report (in the file if `path` is given, otherwise on stderr) """
+        self.uninstall()
+        if path:
+            self.save(path)
+        else:
+            print(self.report(), file=sys.stderr)
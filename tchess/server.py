@@ -1,18 +1,176 @@
 """ Serves a game and waits for guest to play online """
 
+import time
 import uuid
 import logging
-from flask import Flask, request, Response
+import threading
+from flask import Flask, request, Response, g
 from functools import wraps
 
+try:
+    from . import metrics
+    from . import movecache
+except ImportError:
+    import metrics
+    import movecache
+
 CURRENT_SESSION = None
 
-def serve(game, host='0.0.0.0', port=8799):
-    """ Serve the server """
+# sessions of the read-only spectators: {session id: last time the session was seen}
+SPECTATOR_SESSIONS = {}
+SPECTATOR_LOCK = threading.Lock()
+
+# how many seconds a `/watch` request waits for a new state before returning
+WATCH_TIMEOUT = 25
+
+# a spectator session that has not watched for this many seconds is expired
+SPECTATOR_TIMEOUT = WATCH_TIMEOUT * 4
+
+# the maximum number of the live spectator sessions
+MAX_SPECTATORS = 256
+
+def prune_spectators(now=None):
+    """ Removes the expired spectator sessions and returns number of the live ones """
+    if now is None:
+        now = time.monotonic()
+    with SPECTATOR_LOCK:
+        for session in [session for session, seen in SPECTATOR_SESSIONS.items() if now - seen > SPECTATOR_TIMEOUT]:
+            del SPECTATOR_SESSIONS[session]
+        return len(SPECTATOR_SESSIONS)
+
+def add_spectator():
+    """ Adds a new spectator session and returns its id (or None if there are too many spectators) """
+    now = time.monotonic()
+    if prune_spectators(now) >= MAX_SPECTATORS:
+        return None
+    session = str(uuid.uuid4())
+    with SPECTATOR_LOCK:
+        SPECTATOR_SESSIONS[session] = now
+    return session
+
+def touch_spectator(session):
+    """ Marks a spectator session as seen now, returns False if the session is unknown or expired """
+    now = time.monotonic()
+    with SPECTATOR_LOCK:
+        seen = SPECTATOR_SESSIONS.get(session)
+        if seen is None:
+            return False
+        if now - seen > SPECTATOR_TIMEOUT:
+            del SPECTATOR_SESSIONS[session]
+            return False
+        SPECTATOR_SESSIONS[session] = now
+        return True
+
+def render_state(game) -> str:
+    """ Renders the game state in the format that is sent to the guest and spectators """
+    output = game.turn + '\n' + game.render()
+    if game.is_end:
+        # game is finished
+        for line in game.end_message():
+            output += '\n' + (line + (' ' * (len(game.ROW_SEPARATOR)-10)))
+    return output
+
+class Broadcast:
+    """ Keeps the last rendered state of the game and fans it out to the watchers
+
+    Each state version is rendered only once (in `publish`), then the same bytes
+    are returned to every guest/spectator request until the next version.
+    """
+
+    def __init__(self):
+        self.version = 0
+        self.payload = b''
+        self.condition = threading.Condition()
+
+    def publish(self, game):
+        """ Renders the current state of the game as a new version and wakes up the watchers """
+        with RENDER_SECONDS.time():
+            output = render_state(game)
+        with SERIALIZE_SECONDS.time():
+            payload = output.encode()
+        with self.condition:
+            self.payload = payload
+            self.version += 1
+            self.condition.notify_all()
+
+    def current(self):
+        """ Returns the last published version and its bytes """
+        with self.condition:
+            return self.version, self.payload
+
+    def wait(self, since, timeout=None):
+        """ Waits until a version newer than `since` is published, then returns (version, bytes)
+
+        If nothing is published before the timeout, the current version is returned.
+        """
+        with self.condition:
+            self.condition.wait_for(lambda: self.version > since, timeout)
+            return self.version, self.payload
+
+BROADCAST = Broadcast()
+
+# the metrics of the `/metrics` route
+REGISTRY = metrics.Registry()
+REQUESTS = REGISTRY.add(metrics.Counter(
+    'tchess_http_requests_total', 'Number of the http requests', ('route', 'status')
+))
+REQUEST_SECONDS = REGISTRY.add(metrics.Histogram(
+    'tchess_http_request_duration_seconds', 'Latency of the http requests', ('route',)
+))
+COMMANDS = REGISTRY.add(metrics.Counter(
+    'tchess_commands_total', 'Number of the commands that are run on the game', ('player',)
+))
+COMMANDS_RATE = metrics.RateMeter()
+REGISTRY.add(metrics.Gauge(
+    'tchess_commands_per_second', 'Commands per second in the last minute', function=COMMANDS_RATE.rate
+))
+REGISTRY.add(metrics.Gauge(
+    'tchess_active_sessions', 'Number of the active sessions', ('kind',),
+    function=lambda: {('guest',): int(CURRENT_SESSION is not None), ('spectator',): prune_spectators()}
+))
+RENDER_SECONDS = REGISTRY.add(metrics.Histogram(
+    'tchess_render_seconds', 'Time of rendering the published states'
+))
+SERIALIZE_SECONDS = REGISTRY.add(metrics.Histogram(
+    'tchess_serialize_seconds', 'Time of serializing the rendered states to bytes'
+))
+REGISTRY.add(metrics.Gauge(
+    'tchess_state_version', 'Version of the last published state', function=lambda: BROADCAST.version
+))
+REGISTRY.add(metrics.Gauge(
+    'tchess_move_cache_hit_ratio', 'Rate of the lookups that were found in the cache of the legal moves',
+    function=lambda: movecache.CACHE.hit_rate
+))
+REGISTRY.add(metrics.Gauge(
+    'tchess_move_cache_entries', 'Number of the positions/cells in the cache of the legal moves',
+    function=lambda: len(movecache.CACHE)
+))
+
+def publish(game):
+    """ Publishes the new state of the game to the guest and spectators """
+    BROADCAST.publish(game)
+
+def record_command(player):
+    """ Counts a command of a player (`host` or `guest`) in the metrics """
+    COMMANDS.inc(player=player)
+    COMMANDS_RATE.mark()
+
+def create_app(game):
+    """ Creates the flask app of the game """
     app = Flask(__name__)
 
-    log = logging.getLogger('werkzeug')
-    log.setLevel(logging.ERROR)
+    @app.before_request
+    def start_timer():
+        g.start_time = time.perf_counter()
+
+    @app.after_request
+    def record_request(response):
+        # the route pattern is used (not the path), so unknown paths don't make new labels
+        route = request.url_rule.rule if request.url_rule is not None else 'unknown'
+        REQUESTS.inc(route=route, status=str(response.status_code))
+        if 'start_time' in g:
+            REQUEST_SECONDS.observe(time.perf_counter() - g.start_time, route=route)
+        return response
 
     def get_session():
         """ Returns user session id """
@@ -30,6 +188,27 @@ def serve(game, host='0.0.0.0', port=8799):
             return f(*args, **kwargs)
         return decorated_function
 
+    def requires_spectator_session(f):
+        """ Middleware for requiring a spectator (or the guest) session in some routes """
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            session = get_session()
+            if session is None or (session != CURRENT_SESSION and not touch_spectator(session)):
+                return Response('invalid session', status=403)
+            try:
+                return f(*args, **kwargs)
+            finally:
+                # a `/watch` request may wait for a long time, the session is alive until it returns
+                if session != CURRENT_SESSION:
+                    touch_spectator(session)
+        return decorated_function
+
+    def state_response(version, payload):
+        """ Makes the response of a rendered state """
+        response = Response(payload, mimetype='text/plain')
+        response.headers['X-State-Version'] = str(version)
+        return response
+
     @app.route('/connect')
     def connect():
         global CURRENT_SESSION
@@ -53,6 +232,9 @@ def serve(game, host='0.0.0.0', port=8799):
             print('Rejected.')
             return Response('Rejected', status=403)
 
+        # the guest name is changed, so the rendered state should be updated
+        publish(game)
+
         # by setting this prop to True, main thread will know that guest was connected and starts the game
         game.guest_connected = True
 
@@ -60,6 +242,14 @@ def serve(game, host='0.0.0.0', port=8799):
         CURRENT_SESSION = str(uuid.uuid4())
         return CURRENT_SESSION
 
+    @app.route('/spectate')
+    def spectate():
+        # spectators are read-only, so they don't need the confirmation
+        session_id = add_spectator()
+        if session_id is None:
+            return Response('too many spectators', status=503)
+        return session_id
+
     @app.route('/me')
     @requires_session
     def me():
@@ -69,12 +259,17 @@ def serve(game, host='0.0.0.0', port=8799):
     @requires_session
     def render():
         # render the game and turn
-        output = game.turn + '\n' + game.render()
-        if game.is_end:
-            # game is finished
-            output += '\n' + ('Checkmate!' + (' ' * (len(game.ROW_SEPARATOR)-10)))
-            output += '\n' + (game.winner + ' won!' + (' ' * (len(game.ROW_SEPARATOR)-10)))
-        return output
+        return state_response(*BROADCAST.current())
+
+    @app.route('/watch')
+    @requires_spectator_session
+    def watch():
+        # waits for a state newer than `version` argument (long polling)
+        try:
+            since = int(request.args['version'])
+        except:
+            since = -1
+        return state_response(*BROADCAST.wait(since, WATCH_TIMEOUT))
 
     @app.route('/command')
     @requires_session
@@ -84,10 +279,30 @@ def serve(game, host='0.0.0.0', port=8799):
             return Response('missing `cmd` argument', status=401)
         if request.args['cmd'].strip().lower() == 'back':
             return Response('command `back` is disabled for guest', status=401)
-        game.guest_ran = game.run_command(request.args['cmd'])
-        return game.guest_ran
+        result = game.run_command(request.args['cmd'])
+        record_command('guest')
+        publish(game)
+        game.guest_ran = result
+        return result
+
+    @app.route('/metrics')
+    def metrics_route():
+        return Response(REGISTRY.render(), content_type=metrics.Registry.CONTENT_TYPE)
+
+    return app
+
+def serve(game, host='0.0.0.0', port=8799):
+    """ Serve the server """
+    app = create_app(game)
+
+    log = logging.getLogger('werkzeug')
+    log.setLevel(logging.ERROR)
+
+    publish(game)
 
     print('Serving on ' + host + ':' + str(port))
     print('Others can join this game by running `tchess --connect ' + host + ':' + str(port) + '`')
+    print('Others can watch this game by running `tchess --spectate ' + host + ':' + str(port) + '`')
+    print('Metrics of the server are served on http://' + host + ':' + str(port) + '/metrics')
 
-    app.run(host, port)
+    app.run(host, port, threaded=True)
@@ -0,0 +1,431 @@
+""" Endgame tablebases
+
+A tablebase has the exact result of every position of a small material set
+(for example `KQK`: white king and queen against the black king). It's generated by
+retrograde analysis over the move rules of `tchess.moves`:
+
+1. Each position is initialized: the checkmated positions are lost, the captures
+   are looked up in the smaller tablebases, and the other legal moves are counted.
+   The positions that the side to move can capture the king in are illegal.
+2. Starting from the decided positions (in order of their distance), the moves are
+   taken back: a predecessor of a lost position is won, and a predecessor is lost
+   when all of its moves are counted down as won for the opponent.
+
+Positions are indexed by `turn * 64**n + square_1 * 64**(n-1) + ... + square_n`
+(squares are `x * 8 + y`), and the results are stored in an `array('h')`:
+0 is a draw, `-1` means the side to move is checkmated, `+d` means the side to move
+checkmates after `d - 1` plies and `-d` means the side to move is checkmated after
+`d - 1` plies. The illegal positions are stored as `ILLEGAL_VALUE` (they are probed as None).
+
+The initialization (the expensive step) can run in a pool of processes.
+"""
+
+import os
+import sys
+import struct
+import multiprocessing
+from array import array
+
+try:
+    from .tchess import Piece
+    from . import moves
+except ImportError:
+    from tchess import Piece
+    import moves
+
+LETTERS = {
+    'K': Piece.KING,
+    'Q': Piece.QUEEN,
+    'R': Piece.ROOK,
+    'B': Piece.BISHOP,
+    'N': Piece.KNIGHT,
+}
+
+MAGIC = b'TCTB'
+FORMAT_VERSION = 2
+FILE_EXTENSION = '.tctb'
+
+# the material sets that the cli generates by default: the 3 piece ones (2 * 64**3 positions
+# each, generated in about half a minute), a 4 piece set is 64 times bigger
+DEFAULT_MATERIALS = ('KQK', 'KRK')
+
+TURNS = ('white', 'black')
+
+# the largest material set that a tablebase can have (larger ones don't fit in the memory)
+MAX_PIECES = 4
+
+# the moves count of the positions that have a won move (they are never counted down to a loss)
+WON = 255
+
+# the moves count of the illegal positions (they are never decided)
+ILLEGAL = 254
+
+# the stored result of the illegal positions (the side to move can capture the king)
+ILLEGAL_VALUE = -32768
+
+class TablebaseError(Exception):
+    """ Raised for invalid material sets and tablebase files """
+
+def parse_material(name):
+    """ Converts a material name like `KQKR` to the list of pieces: [(color, piece id), ...] """
+    name = name.upper()
+    if not name.startswith('K') or name.count('K') != 2:
+        raise TablebaseError('invalid material `' + name + '`, each side should have one king (e.g. KQK)')
+    black_start = name.index('K', 1)
+    pieces = []
+    for i, letter in enumerate(name):
+        if letter not in LETTERS:
+            raise TablebaseError('invalid piece `' + letter + '` in material `' + name + '`')
+        pieces.append(('white' if i < black_start else 'black', LETTERS[letter]))
+    return pieces
+
+def material_name(pieces):
+    """ Returns name of a list of pieces (reverse of `parse_material`) """
+    icons = {LETTERS[letter]: letter for letter in LETTERS}
+    return ''.join(icons[name] for color, name in pieces)
+
+def material_key(pieces):
+    """ Returns a key of the material that doesn't depend on order of the pieces """
+    return tuple(sorted(pieces))
+
+class Tablebase:
+    """ Results of all of the positions of a material set """
+
+    def __init__(self, pieces, values):
+        self.pieces = list(pieces)
+        self.values = values
+        self.size = 64 ** len(self.pieces)
+
+    @property
+    def name(self):
+        """ Name of the material (e.g. `KQK`) """
+        return material_name(self.pieces)
+
+    def index(self, squares, turn):
+        """ Returns index of a position (squares are in order of `pieces`) """
+        result = 0 if turn == 'white' else 1
+        for square in squares:
+            result = result * 64 + square
+        return result
+
+    def probe_squares(self, squares, turn):
+        """ Returns result of a position for the side to move, or None if the position is illegal """
+        value = self.values[self.index(squares, turn)]
+        if value == ILLEGAL_VALUE:
+            return None
+        return value
+
+    def probe(self, board, turn):
+        """ Returns result of a board for the side to move, or None if the material is different or the position is illegal """
+        squares = [None] * len(self.pieces)
+        for x in range(8):
+            for y in range(8):
+                piece = board[x][y]
+                if piece is None:
+                    continue
+                for i, item in enumerate(self.pieces):
+                    if squares[i] is None and item == (piece.color, piece.name):
+                        squares[i] = x * 8 + y
+                        break
+                else:
+                    return None
+        if None in squares:
+            return None
+        return self.probe_squares(squares, turn)
+
+    def save(self, path):
+        """ Writes the tablebase in a file """
+        values = array('h', self.values)
+        if sys.byteorder == 'big':
+            values.byteswap()
+        with open(path, 'wb') as table_file:
+            table_file.write(struct.pack('<4sIB', MAGIC, FORMAT_VERSION, len(self.pieces)))
+            table_file.write(bytes(1 + name + (6 if color == 'black' else 0) for color, name in self.pieces))
+            values.tofile(table_file)
+
+    @staticmethod
+    def load(path):
+        """ Loads a tablebase file """
+        with open(path, 'rb') as table_file:
+            header = table_file.read(9)
+            if len(header) != 9:
+                raise TablebaseError('invalid tablebase file `' + path + '`')
+            magic, version, count = struct.unpack('<4sIB', header)
+            if magic != MAGIC:
+                raise TablebaseError('invalid tablebase file `' + path + '`')
+            if version != FORMAT_VERSION:
+                raise TablebaseError('tablebase file `' + path + '` has an old format, generate it again')
+            pieces = []
+            for code in table_file.read(count):
+                code -= 1
+                pieces.append(('black' if code >= 6 else 'white', code % 6))
+            values = array('h')
+            try:
+                values.fromfile(table_file, 2 * 64 ** count)
+            except EOFError:
+                raise TablebaseError('invalid tablebase file `' + path + '`')
+        if sys.byteorder == 'big':
+            values.byteswap()
+        return Tablebase(pieces, values)
+
+def probe(tables, board, turn):
+    """ Probes the board in the tablebases ({material key: tablebase})
+
+    Returns result of the position for the side to move, or None if there is no tablebase for its material
+    or the position is illegal (the side to move can capture the king).
+    """
+    pieces = []
+    squares = []
+    for x in range(8):
+        row = board[x]
+        for y in range(8):
+            piece = row[y]
+            if piece is not None:
+                if len(pieces) == MAX_PIECES:
+                    return None
+                pieces.append((piece.color, piece.name))
+                squares.append(x * 8 + y)
+    table = tables.get(material_key(pieces))
+    if table is None:
+        return None
+    return table.probe_squares(reorder(pieces, squares, table.pieces), turn)
+
+def load_directory(path):
+    """ Loads all of the tablebase files of a directory, returns {material key: tablebase} """
+    result = {}
+    for file_name in sorted(os.listdir(path)):
+        if file_name.endswith(FILE_EXTENSION):
+            table = Tablebase.load(os.path.join(path, file_name))
+            result[material_key(table.pieces)] = table
+    return result
+
+class Board:
+    """ A reusable board that the positions of a tablebase are placed on
+
+    The move validators only use `board` of the game, so this is enough for them.
+    """
+
+    def __init__(self, pieces):
+        self.pieces = [Piece(name, color) for color, name in pieces]
+        self.board = [[None] * 8 for i in range(8)]
+
+    def place(self, squares):
+        """ Places the pieces, returns False if two pieces are on a cell """
+        for i, square in enumerate(squares):
+            if self.board[square // 8][square % 8] is not None:
+                self.clear(squares[:i])
+                return False
+            self.board[square // 8][square % 8] = self.pieces[i]
+        return True
+
+    def clear(self, squares):
+        """ Removes the pieces """
+        for square in squares:
+            self.board[square // 8][square % 8] = None
+
+    def targets(self, square):
+        """ Returns target squares of the piece in a square (ignoring the check, for taking the moves back) """
+        piece = self.board[square // 8][square % 8]
+        result = []
+        for dst in piece.pseudo_moves(self, [square // 8, square % 8]):
+            if 0 <= dst[0] < 8 and 0 <= dst[1] < 8:
+                result.append(dst[0] * 8 + dst[1])
+        return result
+
+def decode_index(index, count):
+    """ Returns (turn index, squares) of a position index """
+    squares = [0] * count
+    for i in range(count - 1, -1, -1):
+        squares[i] = index % 64
+        index //= 64
+    return index, squares
+
+# the state of the initialization workers (see `init_worker`)
+WORKER_STATE = None
+
+def init_worker(pieces, subtables):
+    """ Initializes a worker process of the initialization step """
+    global WORKER_STATE
+    WORKER_STATE = (pieces, subtables)
+
+def init_chunk(bounds):
+    """ Initializes a range of positions in a worker process """
+    pieces, subtables = WORKER_STATE
+    return initialize(pieces, subtables, bounds[0], bounds[1])
+
+def initialize(pieces, subtables, start, end):
+    """ Initializes positions of a range of indexes
+
+    Returns (counts, distances, candidates): number of the unresolved moves of each position,
+    the longest resolved loss of the moves, and list of (index, value) of the decided positions.
+    """
+    count = len(pieces)
+    board = Board(pieces)
+    counts = array('B', [0]) * (end - start)
+    distances = array('H', [0]) * (end - start)
+    candidates = []
+    # index of the king of each color in the pieces
+    kings = [pieces.index((color, Piece.KING)) for color in TURNS]
+    for index in range(start, end):
+        turn, squares = decode_index(index, count)
+        if not board.place(squares):
+            # two pieces on a cell
+            counts[index - start] = ILLEGAL
+            continue
+        color = TURNS[turn]
+        enemy = TURNS[1 - turn]
+        enemy_king = squares[kings[1 - turn]]
+        if moves.is_attacked(board.board, (enemy_king // 8, enemy_king % 8), color):
+            # the king of the side that moved is in check
+            board.clear(squares)
+            counts[index - start] = ILLEGAL
+            continue
+
+        win = None
+        unresolved = 0
+        longest_loss = 0
+        legal_moves = moves.legal_moves(board, color)
+        for (x, y), targets in legal_moves:
+            i = squares.index(x * 8 + y)
+            for target in targets:
+                target = target[0] * 8 + target[1]
+                if target not in squares:
+                    unresolved += 1
+                    continue
+                # the capture goes to a smaller material set
+                captured = squares.index(target)
+                child_squares = list(squares)
+                child_squares[i] = target
+                del child_squares[captured]
+                child_pieces = pieces[:captured] + pieces[captured+1:]
+                subtable = subtables[material_key(child_pieces)]
+                value = subtable.probe_squares(
+                    reorder(child_pieces, child_squares, subtable.pieces), enemy
+                )
+                if value < 0:
+                    if win is None or -value + 1 < win:
+                        win = -value + 1
+                elif value > 0:
+                    longest_loss = max(longest_loss, value)
+                else:
+                    unresolved += 1
+
+        if not legal_moves:
+            # checkmate (lost) or stalemate (draw)
+            king = squares[kings[turn]]
+            if moves.is_attacked(board.board, (king // 8, king % 8), enemy):
+                candidates.append((index, -1))
+        elif win is not None:
+            candidates.append((index, win))
+            unresolved = WON
+        elif unresolved == 0:
+            candidates.append((index, -(longest_loss + 1)))
+        board.clear(squares)
+        counts[index - start] = unresolved
+        distances[index - start] = longest_loss
+    return counts, distances, candidates
+
+def reorder(pieces, squares, order):
+    """ Returns squares of the pieces in another order of the same pieces """
+    result = []
+    used = [False] * len(pieces)
+    for item in order:
+        for i, piece in enumerate(pieces):
+            if not used[i] and piece == item:
+                used[i] = True
+                result.append(squares[i])
+                break
+    return result
+
+def generate(material, workers=1, tables=None, progress=None):
+    """ Generates the tablebase of a material (e.g. `KQK`)
+
+    The smaller tablebases that the captures go to are generated (or taken from `tables`,
+    a dict of {material key: tablebase}) first. `progress` is called with a message for each step.
+    """
+    pieces = parse_material(material) if isinstance(material, str) else list(material)
+    if len(pieces) > MAX_PIECES:
+        raise TablebaseError('material `' + material_name(pieces) + '` has more than ' + str(MAX_PIECES) + ' pieces')
+    if tables is None:
+        tables = {}
+    key = material_key(pieces)
+    if key in tables:
+        return tables[key]
+
+    # the smaller tables
+    subtables = {}
+    for i in range(len(pieces)):
+        if pieces[i][1] != Piece.KING:
+            child = pieces[:i] + pieces[i+1:]
+            subtables[material_key(child)] = generate(child, workers, tables, progress)
+
+    count = len(pieces)
+    total = 2 * 64 ** count
+    if progress is not None:
+        progress('generating ' + material_name(pieces) + ' (' + str(total) + ' positions)')
+
+    # step 1: initialize the positions
+    counts = array('B')
+    distances = array('H')
+    candidates = []
+    if workers > 1:
+        chunk = max(4096, total // (workers * 16))
+        ranges = [(start, min(total, start + chunk)) for start in range(0, total, chunk)]
+        with multiprocessing.Pool(workers, initializer=init_worker, initargs=(pieces, subtables)) as pool:
+            for chunk_counts, chunk_distances, chunk_candidates in pool.imap(init_chunk, ranges):
+                counts.extend(chunk_counts)
+                distances.extend(chunk_distances)
+                candidates.extend(chunk_candidates)
+    else:
+        counts, distances, candidates = initialize(pieces, subtables, 0, total)
+
+    # step 2: the retrograde analysis, positions are decided in order of their distance
+    values = array('h', [0]) * total
+    buckets = {}
+    for index, value in candidates:
+        buckets.setdefault(abs(value), []).append((index, value))
+    board = Board(pieces)
+    distance = 1
+    while buckets:
+        bucket = buckets.pop(distance, [])
+        for index, value in bucket:
+            if values[index] != 0:
+                continue
+            values[index] = value
+            turn, squares = decode_index(index, count)
+            board.place(squares)
+            # the predecessors: the other side moves one of its pieces back (to an empty cell)
+            previous_turn = 1 - turn
+            previous_color = TURNS[previous_turn]
+            for i, (piece_color, name) in enumerate(pieces):
+                if piece_color != previous_color:
+                    continue
+                for target in board.targets(squares[i]):
+                    if target in squares:
+                        continue
+                    previous_squares = list(squares)
+                    previous_squares[i] = target
+                    previous = previous_turn
+                    for square in previous_squares:
+                        previous = previous * 64 + square
+                    if values[previous] != 0 or counts[previous] == ILLEGAL:
+                        continue
+                    if value < 0:
+                        buckets.setdefault(distance + 1, []).append((previous, distance + 1))
+                    elif counts[previous] != WON:
+                        counts[previous] -= 1
+                        if distance > distances[previous]:
+                            distances[previous] = distance
+                        if counts[previous] == 0:
+                            loss = distances[previous] + 1
+                            buckets.setdefault(loss, []).append((previous, -loss))
+            board.clear(squares)
+        distance += 1
+
+    for index in range(total):
+        if counts[index] == ILLEGAL:
+            values[index] = ILLEGAL_VALUE
+
+    table = Tablebase(pieces, values)
+    tables[key] = table
+    return table
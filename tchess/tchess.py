@@ -2,21 +2,38 @@
 
 """ Play the Chess in the terminal """
 
-import pickle
 import sys
 import os
 import copy
 import time
-import threading
-import requests
-import karafs
+from array import array
+
+# NOTE: the heavy modules (`requests`, `karafs`, `pickle` and the flask based `server`)
+# are imported only where they are used, so `--version`, `--help` and the offline games
+# do not pay for loading them
 
 try:
     from . import moves
-    from . import server
 except ImportError:
     import moves
-    import server
+
+def import_module(name):
+    """ Imports a module of tchess (for example `server` which loads flask) only when it's needed """
+    import importlib
+    if __package__:
+        return importlib.import_module(__package__ + '.' + name)
+    return importlib.import_module(name)
+
+# the modules that the hot paths of `Game` use, they import this module themselves, so they
+# are bound once on the first use (by `bind_modules`) instead of being imported on top
+movecache = encoding = attacks = None
+
+def bind_modules():
+    """ Imports the modules of the hot paths of `Game` and binds them in this module """
+    global movecache, encoding, attacks
+    movecache = import_module('movecache')
+    encoding = import_module('encoding')
+    attacks = import_module('attacks')
 
 VERSION = '0.0.32'
 
@@ -70,7 +87,7 @@ class Piece:
         return ('w' if self.color == 'white' else 'b') + '-' + self.ICONS[self.name]
 
     def allowed_moves(self, game, src, dst, return_locations=False):
-        """ Returns the allowed targets for move for this piece
+        """ Returns the allowed (legal) targets for move for this piece
 
         Returned structure:
         [
@@ -78,9 +95,18 @@ class Piece:
             [x, y],
             ...
         ]
+
+        The targets are cached by the position (see `Game.legal_targets`).
         """
-        x = src[0]
-        y = src[1]
+        result = game.legal_targets(src)
+        if return_locations:
+            return result
+        if dst in result:
+            return True
+        return False
+
+    def pseudo_moves(self, game, src):
+        """ Returns the pseudo-legal targets of this piece (the moves that may leave the king in check) """
         result = []
         if self.name == Piece.PAWN:
             result = moves.pawn_move(self, game, src)
@@ -94,13 +120,7 @@ class Piece:
             result = moves.knight_move(self, game, src)
         elif self.name == Piece.BISHOP:
             result = moves.bishop_move(self, game, src)
-        else:
-            result = []
-        if return_locations:
-            return result
-        if dst in result:
-            return True
-        return False
+        return result
 
     @staticmethod
     def get_longer_icon_len():
@@ -124,6 +144,130 @@ class Piece:
             if Piece.ICONS[k] == icon:
                 return k
 
+class MoveLog:
+    """ The moves of a game (the logs), each move is a 16 bit code in an `array('H')`
+
+    A code is the source cell (`x * 8 + y`, 6 bits), the target cell (6 bits) and the promotion
+    (id of the piece + 1, 3 bits). The items are read and written as the text commands, so
+    the logs are used like a list of the `mv` commands:
+
+        >>> game.logs.append('move 2.1 4.1')
+        >>> game.logs[-1]
+        'mv 2.1 to 4.1'
+        >>> game.logs.move(-1) # without parsing the command
+        ((1, 0), (3, 0), None)
+    """
+
+    def __init__(self, commands=(), strict=True):
+        """ Creates the logs of the commands, the commands that are not moves raise ValueError
+        (or are skipped if `strict` is False, like the other commands of the old saved games) """
+        self.codes = array('H')
+        if isinstance(commands, MoveLog):
+            self.codes.extend(commands.codes)
+            return
+        for command in commands:
+            try:
+                self.append(command)
+            except ValueError:
+                if strict:
+                    raise
+
+    @staticmethod
+    def encode(src, dst, promotion=None):
+        """ Returns code of a move (`encoding.encode_move`) """
+        if encoding is None:
+            bind_modules()
+        return encoding.encode_move((src, dst, promotion))
+
+    @staticmethod
+    def decode(code):
+        """ Returns the move of a code: (src, dst, promotion) (`encoding.decode_move`) """
+        if encoding is None:
+            bind_modules()
+        return encoding.decode_move(code)
+
+    @staticmethod
+    def to_command(code):
+        """ Returns the `mv` command of a code """
+        src, dst, promotion = MoveLog.decode(code)
+        command = 'mv ' + str(src[0]+1) + '.' + str(src[1]+1) + ' to ' + str(dst[0]+1) + '.' + str(dst[1]+1)
+        if promotion is not None:
+            command += ' > ' + Piece.ICONS[promotion]
+        return command
+
+    def add(self, src, dst, promotion=None):
+        """ Adds a move """
+        self.codes.append(MoveLog.encode(src, dst, promotion))
+
+    def append(self, command):
+        """ Adds a move command (any form of the `mv` command) """
+        move = Game.parse_move(command)
+        if move is None or not all(0 <= i < 8 for i in move[0] + move[1]):
+            raise ValueError('`' + str(command) + '` is not a move')
+        self.add(*move)
+
+    def move(self, index):
+        """ Returns a move: (src, dst, promotion) """
+        return MoveLog.decode(self.codes[index])
+
+    def moves(self):
+        """ Yields the moves: (src, dst, promotion) """
+        return map(MoveLog.decode, self.codes)
+
+    def pop(self, index=-1):
+        """ Removes a move and returns its command """
+        return MoveLog.to_command(self.codes.pop(index))
+
+    def __len__(self):
+        """ Returns the number of the moves """
+        return len(self.codes)
+
+    def __iter__(self):
+        """ Yields the commands of the moves """
+        return map(MoveLog.to_command, self.codes)
+
+    def __getitem__(self, index):
+        """ Returns the command of a move (or the logs of a slice of the moves) """
+        if isinstance(index, slice):
+            result = MoveLog()
+            result.codes = self.codes[index]
+            return result
+        return MoveLog.to_command(self.codes[index])
+
+    def __delitem__(self, index):
+        """ Removes a move (or a slice of the moves) """
+        del self.codes[index]
+
+    def __eq__(self, other):
+        """ Compares the moves with another logs or a list of commands """
+        if not isinstance(other, MoveLog):
+            try:
+                other = MoveLog(other)
+            except (TypeError, ValueError):
+                return False
+        return self.codes == other.codes
+
+    __hash__ = None
+
+    def __getstate__(self):
+        """ The codes are pickled as little endian bytes """
+        codes = self.codes
+        if sys.byteorder == 'big':
+            codes = array('H', codes)
+            codes.byteswap()
+        return codes.tobytes()
+
+    def __setstate__(self, state):
+        """ Loads the codes of the little endian bytes """
+        self.codes = array('H')
+        self.codes.frombytes(state)
+        if sys.byteorder == 'big':
+            self.codes.byteswap()
+
+    def __repr__(self):
+        """ Shows the logs as the list of the commands """
+        return 'MoveLog(' + repr(list(self)) + ')'
+
 class Game:
     """ The running game handler """
 
@@ -131,16 +275,39 @@ class Game:
     ROW_SEPARATOR = (('|' + ('-' * (CELL_WIDTH+1))) * 8) + '|\n'
     IS_TEST = False
 
-    def __init__(self):
+    # this item is used to validate saved games versions
+    # if we load a file that created with old version of the game,
+    # we can check it using this property
+    # if we made backward IN-compatible changes on this class,
+    # this number should be bumped.
+    SAVE_VERSION = 2
+
+    # the older versions that are still loaded: the logs of version 1 are the commands
+    # (a list), they're converted to `MoveLog` when the game is loaded
+    OLD_SAVE_VERSIONS = (1,)
+
+    # the start position, built once and copied by each new game (see `get_start_board`)
+    START_BOARD = None
+
+    # the game is drawn when a position is repeated this number of times
+    REPETITIONS = 3
+
+    # the game is drawn after this number of plies without a capture or a pawn move (the fifty-move rule)
+    FIFTY_MOVES_PLIES = 100
+
+    # the titles of the end messages (see `end_message`)
+    END_TITLES = {
+        'checkmate': 'Checkmate!',
+        'stalemate': 'Stalemate!',
+        'repetition': 'Threefold repetition!',
+        'fifty-move': 'Fifty-move rule!',
+    }
+
+    def __init__(self, white_player=None, black_player=None):
         self.turn = 'white'
-        self.logs = []
+        self.logs = MoveLog()
 
-        # this item is used to validate saved games versions
-        # if we load a file that created with old version of the game,
-        # we can check it using this property
-        # if we made backward IN-compatible changes on this class,
-        # this number should be bumped.
-        self.version = 1
+        self.version = Game.SAVE_VERSION
 
         # each cell location be in this list, will be highlighted in rendering
         self.highlight_cells = []
@@ -148,9 +315,15 @@ class Game:
         # this item determines the selected piece using `s` command
         self.selected_cell = None
 
-        # the player names
-        self.white_player = karafs.gen_str('en')
-        self.black_player = karafs.gen_str('en')
+        # the player names (random names are generated only if they are not given)
+        if white_player is None or black_player is None:
+            import karafs
+            if white_player is None:
+                white_player = karafs.gen_str('en')
+            if black_player is None:
+                black_player = karafs.gen_str('en')
+        self.white_player = white_player
+        self.black_player = black_player
 
         # game status
         self.is_end = False
@@ -163,42 +336,223 @@ class Game:
         self.enable_beep = True
 
         # initialize the board
-        self.board = []
-        for i in range(8):
-            self.board.append([])
-            for j in range(8):
-                # handle default pieces location
-                if i in (1, 6):
-                    self.board[-1].append(
-                        Piece(
-                            name=Piece.PAWN,
-                            color=('white' if i == 1 else 'black'),
+        self.board = Game.get_start_board()
+
+        # key of the pieces of `key_board` (see `board_key`)
+        self.key = None
+        self.key_board = None
+
+        # the attack map of `attacks_board` (see `attack_map`)
+        self.attacks = None
+        self.attacks_board = None
+
+        # the last result of `pins_and_checks`: ((board key, color), result)
+        self.pins = None
+
+        # the snapshots of the positions (see `history`)
+        self.snapshots = None
+
+        # number of the plies since the last capture or pawn move
+        self.halfmove_clock = 0
+
+        # why the game is drawn: `stalemate`, `repetition` or `fifty-move` (None if it's not drawn)
+        self.draw_reason = None
+
+        # number of the plies before the first position (of a game that is started from a FEN)
+        self.start_ply = 0
+
+    @staticmethod
+    def get_start_board():
+        """ Returns a new board list in the start position
+
+        The pieces are built only once (in `Game.START_BOARD`) and shared between the boards,
+        that's safe because a piece object is never changed after it's placed on a board
+        (`move` puts a copy of the piece on the target cell).
+        """
+        if Game.START_BOARD is None:
+            board = []
+            for i in range(8):
+                board.append([])
+                for j in range(8):
+                    # handle default pieces location
+                    if i in (1, 6):
+                        board[-1].append(
+                            Piece(
+                                name=Piece.PAWN,
+                                color=('white' if i == 1 else 'black'),
+                            )
                         )
-                    )
-                elif i in (0, 7):
-                    name = Piece.PAWN
-                    if j in (0, 7):
-                        name = Piece.ROOK
-                    elif j in (0, 3):
-                        name = Piece.KING
-                    elif j in (3 ,7):
-                        name = Piece.QUEEN
-                    elif j in (0, 4):
-                        name = Piece.QUEEN
-                    elif j in (4, 7):
-                        name = Piece.KING
-                    elif j in (2, 5):
-                        name = Piece.BISHOP
-                    elif j in (1, 6):
-                        name = Piece.KNIGHT
-                    self.board[-1].append(
-                        Piece(
-                            name=name,
-                            color=('white' if i == 0 else 'black'),
+                    elif i in (0, 7):
+                        name = Piece.PAWN
+                        if j in (0, 7):
+                            name = Piece.ROOK
+                        elif j in (0, 3):
+                            name = Piece.KING
+                        elif j in (3 ,7):
+                            name = Piece.QUEEN
+                        elif j in (0, 4):
+                            name = Piece.QUEEN
+                        elif j in (4, 7):
+                            name = Piece.KING
+                        elif j in (2, 5):
+                            name = Piece.BISHOP
+                        elif j in (1, 6):
+                            name = Piece.KNIGHT
+                        board[-1].append(
+                            Piece(
+                                name=name,
+                                color=('white' if i == 0 else 'black'),
+                            )
                         )
-                    )
-                else:
-                    self.board[-1].append(None)
+                    else:
+                        board[-1].append(None)
+            Game.START_BOARD = board
+        return [list(row) for row in Game.START_BOARD]
+
+    @classmethod
+    def from_state(cls, board=None, turn='white', logs=None, white_player='', black_player='',
+                   is_end=False, winner=None, current_check=None, highlight_cells=None, version=None,
+                   halfmove_clock=0, draw_reason=None, start_ply=0):
+        """ Creates a game from the given state
+
+        This is the cheap way to create a game when the state is going to be overwritten
+        (loading a saved game, replaying the logs). Random names are not generated and
+        the pieces are not built again. The rows of `board` and the logs are copied, so the
+        game doesn't share them with the caller.
+        """
+        game = cls(white_player=white_player, black_player=black_player)
+        if board is not None:
+            game.board = [list(row) for row in board]
+        game.turn = turn
+        if logs is not None:
+            game.logs = MoveLog(logs, strict=False)
+        game.is_end = is_end
+        game.winner = winner
+        game.current_check = current_check
+        game.highlight_cells = [] if highlight_cells is None else highlight_cells
+        if version is not None:
+            game.version = version
+        game.halfmove_clock = halfmove_clock
+        game.draw_reason = draw_reason
+        game.start_ply = start_ply
+        return game
+
+    def history(self):
+        """ Returns the snapshots of the positions of the game (`history.History`), `history()[ply]` is the position after `ply` plies
+
+        The history is built once (by replaying the logs of a loaded game) and each move adds its snapshot to it.
+        """
+        if self.snapshots is None:
+            history = import_module('history')
+            if self.logs:
+                self.snapshots = history.History.of(self)
+                self.halfmove_clock = self.snapshots.last.clock
+            else:
+                self.snapshots = history.History([history.Snapshot.of(self)])
+        return self.snapshots
+
+    def at_ply(self, ply):
+        """ Returns a new game in the position after `ply` plies (the negative plies are from the end) """
+        snapshots = self.history().snapshots
+        ply = range(len(snapshots))[ply]
+        snapshot = snapshots[ply]
+        game = Game.from_state(
+            board=snapshot.board(), turn=snapshot.turn, logs=self.logs[:snapshot.logs],
+            white_player=self.white_player, black_player=self.black_player,
+            is_end=snapshot.is_end, winner=snapshot.winner, current_check=snapshot.current_check,
+            start_ply=self.start_ply,
+        )
+        game.enable_beep = self.enable_beep
+        game.halfmove_clock = snapshot.clock
+        game.draw_reason = snapshot.draw_reason
+        game.snapshots = import_module('history').History(snapshots[:ply + 1])
+        return game
+
+    def __getstate__(self):
+        """ Returns the pickled state: the derived state (the attack map and the pins) is not saved """
+        state = dict(self.__dict__)
+        state['attacks'] = None
+        state['attacks_board'] = None
+        state['pins'] = None
+        state['snapshots'] = None
+        return state
+
+    def board_key(self):
+        """ Returns key of the pieces of the board (the key of the cache of the legal moves, `movecache`)
+
+        The key is updated by `move`, it's calculated again only when the board is replaced.
+        """
+        if self.key_board is not self.board:
+            if movecache is None:
+                bind_modules()
+            self.key = movecache.board_key(self.board)
+            self.key_board = self.board
+        return self.key
+
+    def legal_targets(self, src):
+        """ Returns the legal targets of the piece of a cell: [[x, y], ...]
+
+        The targets are cached by (board key, cell) in the cache of the process (`movecache.CACHE`),
+        so the same position is not validated again (in this game or another one).
+        """
+        key = (self.board_key(), src[0] * 8 + src[1])
+        cache = movecache.CACHE
+        targets = cache.get(key)
+        if targets is None:
+            piece = self.board[src[0]][src[1]]
+            info = self.pins_and_checks(piece.color)
+            attack_map = self.attack_map()
+            targets = cache.put(key, moves.legal_targets(
+                piece, self.board, src, piece.pseudo_moves(self, src), info,
+                king_can_go=lambda target: attack_map.king_can_go(self.board, piece.color, target),
+            ))
+        return list(targets)
+
+    def position_hash(self):
+        """ Returns the zobrist hash of the position (the pieces and the turn, `encoding.position_hash`) """
+        key = self.board_key()
+        if self.turn == 'black':
+            key ^= encoding.ZOBRIST_BLACK_TURN
+        return key
+
+    def pins_and_checks(self, color):
+        """ Returns the pins and checks of the king of a color (see `moves.pins_and_checks`)
+
+        The result is kept until the board is changed, so it's calculated once for all of the pieces.
+        """
+        key = (self.board_key(), color)
+        if self.pins is None or self.pins[0] != key:
+            self.pins = (key, moves.pins_and_checks(self.board, color, king=self.attack_map().king(color)))
+        return self.pins[1]
+
+    def attack_map(self):
+        """ Returns the attack map of the board (`attacks.AttackMap`)
+
+        The map is updated by `move`, it's built again only when the board is replaced.
+        """
+        if self.attacks_board is not self.board:
+            if attacks is None:
+                bind_modules()
+            self.attacks = attacks.AttackMap(self.board)
+            self.attacks_board = self.board
+        return self.attacks
+
+    def is_attacked(self, cell, color):
+        """ Checks a cell `(x, y)` is attacked by the pieces of a color """
+        return self.attack_map().is_attacked(cell, color)
+
+    def in_check(self, color):
+        """ Checks the king of a color is in check """
+        return self.attack_map().in_check(color)
+
+    def has_legal_moves(self, color):
+        """ Checks the player has at least one legal move """
+        for x in range(8):
+            for y in range(8):
+                piece = self.board[x][y]
+                if piece is not None and piece.color == color and self.legal_targets([x, y]):
+                    return True
+        return False
 
     def beep(self):
         """ Plays a beep sound """
@@ -216,27 +570,54 @@ class Game:
         self.handle_check()
 
     def handle_check(self):
-        """ Handle the check and checkmate """
-        for color in ('white', 'black'):
-            for i in range(0, len(self.board)):
-                for j in range(0, len(self.board[i])):
-                    if self.board[i][j] is not None:
-                        if self.board[i][j].color == color:
-                            for item in self.board[i][j].allowed_moves(self, [i, j], [0, 0], return_locations=True):
-                                if self.board[item[0]][item[1]] is not None:
-                                    if self.board[item[0]][item[1]].color != color:
-                                        if self.board[item[0]][item[1]].name == Piece.KING:
-                                            if color == self.turn:
-                                                self.checkmate()
-                                            else:
-                                                self.check(self.board[item[0]][item[1]].color)
+        """ Handle the check, checkmate and stalemate of the player that should move now
+
+        The game is finished when the player has no legal move: checkmate if the king is in check,
+        otherwise stalemate (draw).
+        """
+        in_check = self.in_check(self.turn)
+        self.current_check = None
+        if in_check:
+            self.check(self.turn)
+        if not self.has_legal_moves(self.turn):
+            if in_check:
+                self.checkmate()
+            else:
+                self.stalemate()
 
     def checkmate(self):
-        """ Changes game status to the checkmate """
+        """ Changes game status to the checkmate (the player of the turn is lost) """
+        self.is_end = True
+        self.winner = 'black' if self.turn == 'white' else 'white'
+        self.beep()
+
+    def stalemate(self):
+        """ Changes game status to the stalemate (draw) """
+        self.draw('stalemate')
+
+    def draw(self, reason):
+        """ Finishes the game with a draw, `reason` is `stalemate`, `repetition` or `fifty-move` """
         self.is_end = True
-        self.winner = self.turn
+        self.winner = None
+        self.draw_reason = reason
         self.beep()
 
+    def handle_draw(self, history):
+        """ Finishes the game with a draw if the position is repeated (threefold repetition)
+        or the fifty-move rule is reached, `history` is the history before the last move """
+        if self.is_end:
+            return
+        if history.repetitions(self.position_hash()) + 1 >= Game.REPETITIONS:
+            self.draw('repetition')
+        elif self.halfmove_clock >= Game.FIFTY_MOVES_PLIES:
+            self.draw('fifty-move')
+
+    def end_message(self):
+        """ Returns the lines of the result of a finished game """
+        if self.winner is None:
+            return Game.END_TITLES[self.draw_reason or 'stalemate'], 'Draw!'
+        return Game.END_TITLES['checkmate'], self.winner + ' won!'
+
     def check(self, color):
         """ Sets check status for a color """
         self.current_check = color
@@ -270,46 +651,101 @@ class Game:
                 convert_pawn_to = Piece.get_id_by_icon(convert_pawn_to)
                 src_p = Piece(convert_pawn_to, src_p.color)
 
+        if self.key_board is self.board:
+            self.key = movecache.moved_key(
+                self.key, self.board[src[0]][src[1]], src, dst, self.board[dst[0]][dst[1]], src_p
+            )
+
         self.board[src[0]][src[1]] = None
 
         self.board[dst[0]][dst[1]] = src_p
 
+        if self.attacks_board is self.board:
+            self.attacks.move(self.board, src, dst)
+
         return True, ''
 
+    @staticmethod
+    def parse_move(cmd: str):
+        """ Parses a move command like `mv 2.1 to 4.1` or `move 7.1 8.1 > q`
+
+        Returns (src, dst, promotion): the 0 based locations as (x, y) tuples and id of the piece
+        that the pawn is promoted to (or None). Returns None if the command is not a move command
+        and raises ValueError if the locations are not numbers.
+        """
+        parts = cmd.split('>', 1)
+        words = parts[0].split()
+        if len(words) == 3:
+            words.insert(2, 'to')
+        if len(words) != 4 or words[0] not in ('move', 'mv') or words[2] != 'to':
+            return None
+        src = words[1].replace('.', '-').split('-')
+        dst = words[3].replace('.', '-').split('-')
+        if len(src) != 2 or len(dst) != 2:
+            return None
+        promotion = Piece.get_id_by_icon(parts[1].strip()) if len(parts) > 1 else None
+        return (int(src[0])-1, int(src[1])-1), (int(dst[0])-1, int(dst[1])-1), promotion
+
+    def apply_move(self, src, dst, promotion=None) -> str:
+        """ Moves a piece and returns result message (the `mv` command without parsing a string)
+
+        `src` and `dst` are 0 based (x, y) locations and `promotion` is id of the piece
+        that the pawn is promoted to (it's logged only if the pawn is promoted).
+        """
+        if not (0 <= src[0] < 8 and 0 <= src[1] < 8 and 0 <= dst[0] < 8 and 0 <= dst[1] < 8):
+            return 'Error: Locations are out of range!'
+        piece = self.board[src[0]][src[1]]
+        if piece is None:
+            return 'Error: source location is empty cell!'
+        if src[0] == dst[0] and src[1] == dst[1]:
+            return 'Error: source and target locations are not different!'
+        if piece.color != self.turn:
+            return 'Error: its ' + self.turn + ' turn, you should move ' + self.turn + ' pieces!'
+
+        # the history is started before the first move
+        history = self.history()
+
+        # the captures and the pawn moves reset the halfmove clock
+        resets_clock = piece.name == Piece.PAWN or self.board[dst[0]][dst[1]] is not None
+
+        src_str = str(src[0]+1) + '.' + str(src[1]+1)
+        dst_str = str(dst[0]+1) + '.' + str(dst[1]+1)
+        result = self.move([src[0], src[1]], [dst[0], dst[1]], Piece.ICONS.get(promotion))
+        if not result[0]:
+            return result[1]
+
+        # add the move to the logs
+        self.logs.add(src, dst, promotion if piece.name == Piece.PAWN and dst[0] in (0, 7) else None)
+
+        self.halfmove_clock = 0 if resets_clock else self.halfmove_clock + 1
+
+        # change the turn
+        self.change_turn()
+
+        # the repetitions are counted in the history, so the draws are checked before adding the position
+        self.handle_draw(history)
+        history.push(self, (src[0], dst[0]))
+
+        return src_str + ' Moved to ' + dst_str
+
     def run_command(self, cmd: str) -> str:
         """ Gets a command as string and runs that on the game. Returns result message as string """
         self.beep()
 
         cmd_parts = cmd.split('>', 1)[0].split()
-        convert_to = None
-        if len(cmd.split('>', 1)) > 1:
-            convert_to = cmd.split('>', 1)[1].strip()
 
         self.highlight_cells = []
         self.selected_cell = None
 
         invalid_msg = 'Invalid Command!'
 
-        result_msg = 'Runed'
-
         if len(cmd_parts) == 1:
             if cmd_parts[0] == 'back':
-                if not self.logs:
+                if not self.logs or len(self.history()) < 2:
                     invalid_msg = 'Please move something first!'
                 else:
-                    # back
-                    new_game = Game()
-                    while self.logs:
-                        if not self.logs[-1].startswith('m'):
-                            self.logs.pop()
-                        else:
-                            self.logs.pop()
-                            break
-                    for cmd in self.logs:
-                        new_game.run_command(cmd)
-                    self.logs = new_game.logs
-                    self.board = new_game.board
-                    self.turn = new_game.turn
+                    # back to the previous snapshot
+                    self.snapshots.pop().restore(self)
                     return 'OK! now you are one step back!'
         elif len(cmd_parts) == 2:
             # s <location>
@@ -320,8 +756,7 @@ class Game:
                         location[0] = int(location[0])-1
                         location[1] = int(location[1])-1
 
-                        valid_range = list(range(0, 8))
-                        if not (location[0] in valid_range and location[1] in valid_range):
+                        if not (0 <= location[0] < 8 and 0 <= location[1] < 8):
                             return 'Error: Location is out of range!'
 
                         if self.board[location[0]][location[1]] is None:
@@ -337,54 +772,14 @@ class Game:
                     except:
                         return 'Error: Invalid location!'
 
-        if len(cmd_parts) == 3:
-            if cmd_parts[0] in ('move', 'mv'):
-                cmd_parts.insert(2, 'to')
-
-        if len(cmd_parts) == 4:
-            # the move operation
-            if cmd_parts[0] in ('move', 'mv') and cmd_parts[2] == 'to':
-                src = cmd_parts[1].replace('.', '-').split('-')
-                dst = cmd_parts[3].replace('.', '-').split('-')
-                if len(src) == 2 and len(dst) == 2:
-                    try:
-                        src[0] = int(src[0])-1
-                        src[1] = int(src[1])-1
-                        dst[0] = int(dst[0])-1
-                        dst[1] = int(dst[1])-1
-
-                        valid_range = list(range(0, 8))
-                        if not (src[0] in valid_range and src[1] in valid_range and dst[0] in valid_range and dst[1] in valid_range):
-                            return 'Error: Locations are out of range!'
-                    except:
-                        return 'Error: Invalid locations!'
-                    result_msg = cmd_parts[1] + ' Moved to ' + cmd_parts[3]
-                else:
-                    return invalid_msg
-
-                if self.board[src[0]][src[1]] is not None:
-                    pass
-                else:
-                    return 'Error: source location is empty cell!'
-                if src == dst:
-                    return 'Error: source and target locations are not different!'
-                if self.board[src[0]][src[1]].color != self.turn:
-                    return 'Error: its ' + self.turn + ' turn, you should move ' + self.turn + ' pieces!'
-                result = self.move(src, dst, convert_to)
-                if not result[0]:
-                    return result[1]
-            else:
-                return invalid_msg
-        else:
+        # the move operation
+        try:
+            move = Game.parse_move(cmd)
+        except ValueError:
+            return 'Error: Invalid locations!'
+        if move is None:
             return invalid_msg
-
-        # add command to the log
-        self.logs.append(cmd)
-
-        # change the turn
-        self.change_turn()
-
-        return result_msg
+        return self.apply_move(*move)
 
     def get_dead_items(self):
         """ Returns list of dead items like this:
@@ -525,12 +920,39 @@ OPTIONS
     --player-white=[name]: set name of white player
     --player-black=[name]: set name of black player
     --no-beep: do not play beep sound
+    --ponder: analyze the position while the player is thinking (enables the `hint` command)
     --online: serve a online game
     --online --host=[host]: set host of online game
     --online --port=[port]: set port of online game
     --online --guest-color=[color]: color of guest player (black or white)
     --connect [host]:[port]: connect to a online game
     --connect --name=[name]: set your name white joining to a game
+    --spectate [host]:[port]: watch a online game (read-only)
+    --ai=[color]: play against the AI, the AI plays this color (black or white)
+    --ai=[color] --ai-time=[seconds]: time budget of the AI for each move (default is 1)
+    --ai=[color] --ai-workers=[count]: number of processes that the AI searches with (default is 1)
+    --ai=[color] --ai-hash=[megabytes]: memory of the AI transposition table (default is 16, 0 disables it)
+    --ai=[color] --ai-book=[file]: opening book of the AI
+    --ai=[color] --ai-tablebases=[directory]: endgame tablebases of the AI
+    --build-book=[file] [game-files...]: build an opening book from the saved games
+    --build-tablebases=[directory] [materials...]: generate endgame tablebases (default is KQK KRK)
+    --build-tablebases=[directory] --tablebase-workers=[count]: number of processes of the generation
+    --import-pgn=[file] [?directory]: import the games of a PGN file as saved games (game-1.tchess, ...)
+    --export-pgn=[file] [game-files...]: export the saved games in a PGN file (`-` writes on stdout)
+    --fen [?game-file]: show the FEN of position of a saved game
+    --db-import=[database] [game-files...]: add the saved games (and the games of the .pgn files) to a SQLite database
+    --db-query=[database] [filters...]: search the games of a database (white=, black=, player=, winner=, result=, draw=, min-moves=, max-moves=, fen=, limit=)
+    --tournament=[count] [?database]: play games of the AI/random players and add them to a database (default is tournament.db)
+    --tournament=[count] --tournament-white=[player] --tournament-black=[player]: the players, `ai` (default) or `random`
+    --tournament=[count] --tournament-workers=[count]: number of processes that play the games (default is 1)
+    --tournament=[count] --tournament-time=[seconds]: time budget of the AI for each move (default is 0.1)
+    --tournament=[count] --tournament-plies=[count]: the games are stopped after this number of plies (default is 200)
+    --move-cache=[entries]: size of the cache of the legal moves (default is 65536, 0 disables it)
+    --headless [?game-file]: run the commands of stdin and write their results on stdout, one per line
+    --headless=[file] [?game-file]: run the commands of a file
+    --headless --json: write the results as JSON objects
+    --profile: show time of the phases of the commands (parse, move, validate, apply, check, render, save) on exit
+    --profile=[file]: write time of the phases in a json file on exit
 
 AUTHOR
     This software is created by Parsa Shahmaleki <parsampsh@gmail.com>
@@ -624,6 +1046,19 @@ GAME
         This is useful if you insert a wrong command or move wrong.
         (This command will be disabled for guest in online mode)
 
+        Hint
+
+        With option --ponder, the position is analyzed in background while you are thinking. The hint command shows the best move that is found so far, without waiting:
+
+        $ tchess --ponder
+        >>> hint
+
+        The analysis is stopped when a move or `back` changes the position and started again for the new position.
+
+        Draws
+
+        The game is a draw when the player that should move has no legal move and is not in check (stalemate), when a position is repeated three times (the same pieces on the same cells and the same turn), or after fifty moves of both players (100 plies) without a capture or a pawn move.
+
         Replaying a saved game
 
         If you played a game and it is saved, you can play that!
@@ -673,28 +1108,146 @@ GAME
 
         # set color of guest player (default is black)
         $ tchess --online --guest-color=white
+
+        Also other people can watch the game as spectators (they can't run commands):
+
+        $ tchess --spectate 192.168.1.2:5000
+
+        Metrics of the server (requests and their latency for each route, active sessions, commands per second and render time) are served in the prometheus text format:
+
+        $ curl http://192.168.1.2:5000/metrics
+
+        Playing against the AI
+
+        You can play against the built-in AI. option --ai determines color of the AI:
+
+        $ tchess --ai=black
+
+        The AI searches each move until its time budget is finished (1 second by default):
+
+        $ tchess --ai=black --ai-time=3
+
+        To search with more than one cpu core, set the number of search processes:
+
+        $ tchess --ai=black --ai-workers=8
+
+        The AI remembers the searched positions in a transposition table with a fixed memory (16 MB by default, for each search process):
+
+        $ tchess --ai=black --ai-hash=64
+
+        Opening book
+
+        You can build an opening book from your saved games. then the AI plays the moves of the book in the opening without searching:
+
+        $ tchess --build-book=book.bin game1.tchess game2.tchess
+        $ tchess --ai=black --ai-book=book.bin
+
+        Endgame tablebases
+
+        A tablebase has the exact result of all of the positions of an endgame with a few pieces (for example KQK: king and queen against king).
+        The AI doesn't search the positions that are in the tablebases. generate them once and give the directory to the AI:
+
+        $ tchess --build-tablebases=tablebases KQK KRK
+        $ tchess --ai=black --ai-tablebases=tablebases
+
+        Without materials, KQK and KRK are generated (a 3 piece material takes about half a minute). A 4 piece material (like KQKR) has 64 times more positions: it takes about half an hour and a few hundred MB of memory, use more processes for them:
+
+        $ tchess --build-tablebases=tablebases --tablebase-workers=8 KQKR
+
+        Tournaments
+
+        The AI (or a random player) can play many games against itself without the terminal. The games are played in a pool of processes and added to a game database, then the speed (games/sec and plies/sec), the average plies and the results are shown:
+
+        $ tchess --tournament=100 --tournament-workers=8 --tournament-black=random tournament.db
+
+        PGN and FEN
+
+        The games can be imported from PGN files (the standard format of the chess databases) and exported to them. The files are read and written game by game, so big databases don't need much memory:
+
+        $ tchess --import-pgn=games.pgn my-games
+        $ tchess --export-pgn=games.pgn game1.tchess game2.tchess
+
+        Tchess has no castling and en passant, the games that have these moves are skipped in the import.
+        Also the FEN (the standard notation of a position) of a saved game can be shown:
+
+        $ tchess --fen my-game.tchess
+
+        Game database
+
+        The saved games (and the PGN files) can be added to a SQLite database, then the games are searched with its indexes instead of loading every file:
+
+        $ tchess --db-import=games.db *.tchess games.pgn
+        $ tchess --db-query=games.db winner=white max-moves=39
+
+        The filters are white=[name], black=[name], player=[name] (any color), winner=[white, black or draw], result=[1-0, 0-1, 1/2-1/2 or *], draw=[stalemate, repetition or fifty-move], min-moves=[count], max-moves=[count], fen=[position] and limit=[count].
+
+        The positions of the games are indexed too, so the games that reached a position are found without replaying them (the FEN of a saved game is shown by --fen):
+
+        $ tchess --db-query=games.db "fen=rnbqkbnr/pppp1ppp/8/4p3/4P3/8/PPPP1PPP/RNBQKBNR w - - 0 2"
+
+        Move cache
+
+        The legal moves of the pieces are cached by the position, so the moves of a position are validated once (for example the s command and the check detection after a move use the same moves). Size of the cache can be changed (the least recently used positions are removed when it's full):
+
+        $ tchess --move-cache=200000
+
+        The hit rate of the cache is in the metrics of the server (tchess_move_cache_hit_ratio).
+
+        Headless mode
+
+        Option --headless runs the commands of stdin (or a file) and writes the result of each one in a line, without rendering the board, the beeps and saving the game after each command. The game is loaded from the game file (if it's given) and saved in it once, after the last command:
+
+        $ printf 'mv 2.4 4.4\\nmv 7.5 5.5\\n' | tchess --headless --json my-game.tchess
+        $ tchess --headless=commands.txt
+
+        Profiling
+
+        Option --profile times the phases of each command (parse, move, validate, apply, check, render and save) and shows their histograms on exit. The moves of the replay, the AI, the PGN import and the tournaments are timed too:
+
+        $ tchess --profile
+
+        Or the times can be written in a json file:
+
+        $ tchess --profile=profile.json
 '''.strip())
 
 def load_game_from_file(path: str):
     """ Loads the game object from a file """
+    import pickle
     tmp_f = open(path, 'rb')
     file_game = pickle.load(tmp_f)
     tmp_f.close()
-    game = Game()
-    game.turn = str(file_game.turn)
-    game.logs = list(file_game.logs)
-    game.version = int(file_game.version)
-    game.highlight_cells = list(file_game.highlight_cells)
-    game.white_player = str(file_game.white_player)
-    game.black_player = str(file_game.black_player)
-    game.board = list(file_game.board)
-    game.is_end = bool(file_game.is_end)
-    game.winner = file_game.winner
-    game.current_check = file_game.current_check
-    return game
+    version = int(file_game.version)
+    if version in Game.OLD_SAVE_VERSIONS:
+        # the logs are converted by `from_state`, so the game is saved with the new version
+        version = Game.SAVE_VERSION
+    return Game.from_state(
+        board=file_game.board,
+        turn=str(file_game.turn),
+        logs=file_game.logs,
+        white_player=str(file_game.white_player),
+        black_player=str(file_game.black_player),
+        is_end=bool(file_game.is_end),
+        winner=file_game.winner,
+        current_check=file_game.current_check,
+        highlight_cells=list(file_game.highlight_cells),
+        version=version,
+        # the games that are saved by the older versions don't have them
+        halfmove_clock=int(getattr(file_game, 'halfmove_clock', 0)),
+        draw_reason=getattr(file_game, 'draw_reason', None),
+        start_ply=int(getattr(file_game, 'start_ply', 0)),
+    )
+
+def save_game(game, path: str):
+    """ Saves the game object in a file """
+    import pickle
+    with open(path, 'wb') as game_file:
+        pickle.dump(game, game_file)
 
 def online_connect(target, options=[], arguments=[]):
     """ Connects user to a served game """
+    import requests
+
     my_name = None
     for option in options:
         if option.startswith('--name='):
@@ -742,7 +1295,7 @@ def online_connect(target, options=[], arguments=[]):
             print('\033[H', end='', flush=True)
             print(render, flush=True)
             retry_counter = 0
-            if 'Checkmate' in render:
+            if any(title in render for title in Game.END_TITLES.values()):
                 return
             if turn == my_color:
                 command = input(turn + ' Turn >>> ').strip()
@@ -761,6 +1314,52 @@ def online_connect(target, options=[], arguments=[]):
             retry_counter += 1
         time.sleep(0.5)
 
+def online_spectate(target, options=[], arguments=[]):
+    """ Watches a served game as a read-only spectator """
+    import requests
+
+    target = 'http://' + target
+    try:
+        res = requests.get(target + '/spectate')
+    except:
+        print('ERROR: cannot make http connection to the target', file=sys.stderr)
+        sys.exit(1)
+    if not res.ok:
+        print('ERROR: ' + res.text, file=sys.stderr)
+        sys.exit(1)
+    session_id = res.text.strip()
+
+    version = -1
+    retry_counter = 0
+
+    while True:
+        try:
+            res = requests.get(target + '/watch', {'session': session_id, 'version': version})
+            if not res.ok:
+                print('ERROR: invalid response from server: ' + str(res.status_code) + ': ' + res.text, file=sys.stderr)
+                sys.exit(1)
+            retry_counter = 0
+            new_version = int(res.headers.get('X-State-Version', version))
+            if new_version == version:
+                # nothing is changed, wait for the next state
+                continue
+            version = new_version
+            render = res.text.split('\n', 1)[-1]
+            print('\033[H', end='', flush=True)
+            print(render, flush=True)
+            if any(title in render for title in Game.END_TITLES.values()):
+                return
+        except KeyboardInterrupt:
+            break
+        except:
+            if retry_counter > 10:
+                # do not retry again
+                print('ERROR: disconnected.', file=sys.stderr, flush=True)
+                return
+            print('WARNING: unable to connect to server. retrying...', file=sys.stderr, flush=True)
+            retry_counter += 1
+            time.sleep(0.5)
+
 def run(args=[]):
     """ The main cli entry point """
 
@@ -785,11 +1384,226 @@ def run(args=[]):
         show_help()
         sys.exit()
 
+    # handle `--profile` option
+    for option in options:
+        if option == '--profile' or option.startswith('--profile='):
+            import atexit
+            profiler = import_module('profiler').Profiler()
+            profiler.install(module=sys.modules[__name__])
+            atexit.register(profiler.finish, option.split('=', 1)[1] if '=' in option else None)
+            break
+
+    # handle `--build-book` option
+    for option in options:
+        if option.startswith('--build-book='):
+            book = import_module('book')
+            output = option.split('=', 1)[1]
+            try:
+                count = book.build(arguments, output)
+            except Exception as error:
+                print('ERROR: cannot build the book: ' + str(error), file=sys.stderr)
+                sys.exit(1)
+            print('Opening book `' + output + '` was built from ' + str(len(arguments)) + ' games (' + str(count) + ' moves).')
+            sys.exit()
+
+    # handle `--build-tablebases` option
+    for option in options:
+        if option.startswith('--build-tablebases='):
+            tablebase = import_module('tablebase')
+            output = option.split('=', 1)[1]
+            workers = 1
+            for item in options:
+                if item.startswith('--tablebase-workers='):
+                    try:
+                        workers = max(1, int(item.split('=', 1)[1]))
+                    except:
+                        pass
+            tables = {}
+            try:
+                os.makedirs(output, exist_ok=True)
+                for material in (arguments or tablebase.DEFAULT_MATERIALS):
+                    start = time.time()
+                    table = tablebase.generate(material, workers, tables, progress=print)
+                    table.save(os.path.join(output, table.name + tablebase.FILE_EXTENSION))
+                    print('Tablebase `' + table.name + '` was generated in ' + str(round(time.time() - start, 1)) + ' seconds.')
+            except (OSError, tablebase.TablebaseError) as error:
+                print('ERROR: cannot generate the tablebases: ' + str(error), file=sys.stderr)
+                sys.exit(1)
+            sys.exit()
+
+    # handle `--import-pgn` option
+    for option in options:
+        if option.startswith('--import-pgn='):
+            pgn = import_module('pgn')
+            path = option.split('=', 1)[1]
+            output = arguments[0] if arguments else '.'
+            errors = []
+            count = 0
+            try:
+                os.makedirs(output, exist_ok=True)
+                with open(path, encoding='utf-8', errors='replace') as pgn_file:
+                    for game in pgn.import_games(pgn_file, errors):
+                        count += 1
+                        save_game(game, os.path.join(output, 'game-' + str(count) + '.tchess'))
+            except OSError as error:
+                print('ERROR: cannot import the games: ' + str(error), file=sys.stderr)
+                sys.exit(1)
+            for number, error in errors:
+                print('WARNING: game ' + str(number) + ' was skipped: ' + str(error), file=sys.stderr)
+            print(str(count) + ' games were imported from `' + path + '` to `' + output + '`.')
+            sys.exit()
+
+    # handle `--export-pgn` option
+    for option in options:
+        if option.startswith('--export-pgn='):
+            pgn = import_module('pgn')
+            output = option.split('=', 1)[1]
+            try:
+                games = (load_game_from_file(path) for path in arguments)
+                if output == '-':
+                    pgn.write_games(sys.stdout, games)
+                else:
+                    with open(output, 'w', encoding='utf-8') as pgn_file:
+                        count = pgn.write_games(pgn_file, games)
+                    print(str(count) + ' games were exported to `' + output + '`.')
+            except Exception as error:
+                print('ERROR: cannot export the games: ' + str(error), file=sys.stderr)
+                sys.exit(1)
+            sys.exit()
+
+    # handle `--db-import` option
+    for option in options:
+        if option.startswith('--db-import='):
+            database = import_module('database')
+            pgn = import_module('pgn')
+            output = option.split('=', 1)[1]
+            count = 0
+            start = time.time()
+            try:
+                with database.GameDatabase(output) as db:
+                    for path in arguments:
+                        if path.lower().endswith('.pgn'):
+                            errors = []
+                            with open(path, encoding='utf-8', errors='replace') as pgn_file:
+                                count += db.add_games(pgn.import_games(pgn_file, errors), source=path)
+                            for number, error in errors:
+                                print('WARNING: game ' + str(number) + ' of `' + path + '` was skipped: ' + str(error), file=sys.stderr)
+                        else:
+                            count += db.add_games([load_game_from_file(path)], source=path)
+            except Exception as error:
+                print('ERROR: cannot import the games: ' + str(error), file=sys.stderr)
+                sys.exit(1)
+            print(str(count) + ' games were imported into `' + output + '` in ' + str(round(time.time() - start, 2)) + ' seconds.')
+            sys.exit()
+
+    # handle `--db-query` option
+    for option in options:
+        if option.startswith('--db-query='):
+            database = import_module('database')
+            path = option.split('=', 1)[1]
+            if not os.path.isfile(path):
+                print('ERROR: database `' + path + '` does not exist', file=sys.stderr)
+                sys.exit(1)
+            start = time.time()
+            try:
+                with database.GameDatabase(path) as db:
+                    games = db.query(**database.parse_filters(arguments))
+            except (database.DatabaseError, database.sqlite3.Error) as error:
+                print('ERROR: cannot query the games: ' + str(error), file=sys.stderr)
+                sys.exit(1)
+            for item in games:
+                print('#' + str(item['id']) + ' ' + item['white'] + ' vs ' + item['black'] + ' ' + item['result']
+                      + (' ' + item['draw'] if item['draw'] else '') + ' (' + str((item['plies'] + 1) // 2) + ' moves)')
+            print(str(len(games)) + ' games were found in ' + str(round((time.time() - start) * 1000, 1)) + ' ms.')
+            sys.exit()
+
+    # handle `--tournament` option
+    for option in options:
+        if option.startswith('--tournament='):
+            tournament = import_module('tournament')
+            settings = {'white': 'ai', 'black': 'ai', 'workers': 1, 'ai_time': 0.1, 'max_plies': tournament.MAX_PLIES}
+            try:
+                count = int(option.split('=', 1)[1])
+                for item in options:
+                    value = item.split('=', 1)[-1]
+                    if item.startswith('--tournament-white='):
+                        settings['white'] = value
+                    elif item.startswith('--tournament-black='):
+                        settings['black'] = value
+                    elif item.startswith('--tournament-workers='):
+                        settings['workers'] = max(1, int(value))
+                    elif item.startswith('--tournament-time='):
+                        settings['ai_time'] = float(value)
+                    elif item.startswith('--tournament-plies='):
+                        settings['max_plies'] = max(1, int(value))
+            except ValueError:
+                print('ERROR: values of the --tournament options should be numbers', file=sys.stderr)
+                sys.exit(1)
+            output = arguments[0] if arguments else 'tournament.db'
+            try:
+                stats = tournament.run(count, output=output, **settings)
+            except (tournament.TournamentError, OSError, tournament.database.sqlite3.Error) as error:
+                print('ERROR: cannot run the tournament: ' + str(error), file=sys.stderr)
+                sys.exit(1)
+            print(stats.report())
+            print('The games were added to `' + output + '`.')
+            sys.exit()
+
+    # handle `--fen` option
+    if '--fen' in options:
+        pgn = import_module('pgn')
+        path = arguments[0] if arguments else game_file_name
+        try:
+            print(pgn.to_fen(load_game_from_file(path)))
+        except Exception as error:
+            print('ERROR: cannot load the game: ' + str(error), file=sys.stderr)
+            sys.exit(1)
+        sys.exit()
+
     # handle `--no-ansi` option
     if '--no-ansi' in options:
         options.remove('--no-ansi')
         Ansi.disable()
 
+    # handle `--move-cache` option
+    for option in options:
+        if option.startswith('--move-cache='):
+            try:
+                import_module('movecache').CACHE.resize(max(0, int(option.split('=', 1)[1])))
+            except ValueError:
+                pass
+
+    # handle `--headless` option
+    for option in options:
+        if option == '--headless' or option.startswith('--headless='):
+            headless = import_module('headless')
+            path = option.split('=', 1)[1] if '=' in option else '-'
+            game = Game.from_state(white_player='white', black_player='black')
+            if arguments:
+                if os.path.isfile(arguments[0]):
+                    try:
+                        game = load_game_from_file(arguments[0])
+                    except Exception as error:
+                        print('ERROR: cannot load the game: ' + str(error), file=sys.stderr)
+                        sys.exit(1)
+            for name_option in options:
+                if name_option.startswith('--player-white='):
+                    game.white_player = name_option.split('=', 1)[1]
+                elif name_option.startswith('--player-black='):
+                    game.black_player = name_option.split('=', 1)[1]
+            try:
+                if path == '-':
+                    headless.run(game, sys.stdin, sys.stdout, as_json='--json' in options)
+                else:
+                    with open(path, encoding='utf-8') as commands_file:
+                        headless.run(game, commands_file, sys.stdout, as_json='--json' in options)
+            except OSError as error:
+                print('ERROR: cannot read the commands: ' + str(error), file=sys.stderr)
+                sys.exit(1)
+            if arguments:
+                save_game(game, arguments[0])
+            sys.exit()
+
     # handle `--connect`
     if '--connect' in options:
         if len(arguments) <= 0:
@@ -799,6 +1613,15 @@ def run(args=[]):
         online_connect(target, options, arguments)
         return
 
+    # handle `--spectate`
+    if '--spectate' in options:
+        if len(arguments) <= 0:
+            print('ERROR: <host>:<port> argument is required', file=sys.stderr)
+            sys.exit(1)
+        target = arguments[0]
+        online_spectate(target, options, arguments)
+        return
+
     # handle `--replay` option
     is_play = False
     log_counter = 0
@@ -845,7 +1668,7 @@ def run(args=[]):
                 raise
 
             # check the version
-            if game.version != Game().version:
+            if game.version != Game.SAVE_VERSION:
                 print('ERROR: file `' + game_file_name + '` is created with OLD/NEW version of tchess and cannot be loaded', file=sys.stderr)
                 raise
         except:
@@ -857,7 +1680,7 @@ def run(args=[]):
 
     game_logs = game.logs
     if is_play:
-        game = Game()
+        game = Game.from_state(white_player=game.white_player, black_player=game.black_player)
 
     # set player names
     for option in options:
@@ -869,10 +1692,67 @@ def run(args=[]):
     if '--no-beep' in options:
         game.enable_beep = False
 
+    # handle `--ai`, `--ai-time` and `--ai-workers` options
+    ai_color = None
+    ai_time = 1.0
+    ai_workers = 1
+    ai_hash = 16
+    ai_book = None
+    ai_tablebases = None
+    for option in options:
+        if option.startswith('--ai='):
+            ai_color = option.split('=', 1)[1].lower()
+            if ai_color not in ('white', 'black'):
+                print('ERROR: value of --ai should be `white` or `black`', file=sys.stderr)
+                sys.exit(1)
+        elif option.startswith('--ai-time='):
+            try:
+                ai_time = float(option.split('=', 1)[1])
+            except:
+                pass
+        elif option.startswith('--ai-workers='):
+            try:
+                ai_workers = max(1, int(option.split('=', 1)[1]))
+            except:
+                pass
+        elif option.startswith('--ai-book='):
+            book = import_module('book')
+            try:
+                ai_book = book.OpeningBook(option.split('=', 1)[1])
+            except (OSError, book.BookError) as error:
+                print('ERROR: cannot open the opening book: ' + str(error), file=sys.stderr)
+                sys.exit(1)
+        elif option.startswith('--ai-tablebases='):
+            tablebase = import_module('tablebase')
+            try:
+                ai_tablebases = tablebase.load_directory(option.split('=', 1)[1])
+            except (OSError, tablebase.TablebaseError) as error:
+                print('ERROR: cannot load the tablebases: ' + str(error), file=sys.stderr)
+                sys.exit(1)
+        elif option.startswith('--ai-hash='):
+            try:
+                ai_hash = max(0, int(option.split('=', 1)[1]))
+            except:
+                pass
+    ai_engine = None
+    if ai_color is not None:
+        engine = import_module('engine')
+        ai_engine = engine.Engine(
+            time_limit=ai_time, workers=ai_workers, table_size=ai_hash * 1024 * 1024,
+            book=ai_book, tablebases=ai_tablebases
+        )
+
+    # the analysis of the position while the player is thinking (the `hint` command),
+    # it fills the table of the AI (they don't search at the same time)
+    ponderer = None
+    if '--ponder' in options and not is_play:
+        ponderer = import_module('ponder').Ponderer(table=ai_engine.table if ai_engine is not None else None)
+
     # last result of runed command
     last_message = ''
 
     is_online = False
+    server = None
     game.guest_color = 'black'
     if '--online' in options:
         for option in options:
@@ -894,6 +1774,8 @@ def run(args=[]):
                     port = int(option.split('=', 1)[1])
                 except:
                     pass
+        import threading
+        server = import_module('server')
         server_thread = threading.Thread(target=server.serve, args=[game, host, port])
         server_thread.daemon = True
         server_thread.start()
@@ -902,89 +1784,141 @@ def run(args=[]):
         while not game.guest_connected:
             pass
 
-    while True:
-        # render the game board on the terminal
-        print('\033[H', end='')
-        title = ' Welcome to the TChess! '
-        stars_len = len(Game.ROW_SEPARATOR) - len(title)
-        title = (int(stars_len/2) * '*') + title + (int(stars_len/2) * '*')
-        print(title, end='')
-        print(' ' * (len(Game.ROW_SEPARATOR) - len(title)))
-        print(' ' * len(Game.ROW_SEPARATOR))
-        print(game.render())
-
-        if game.is_end:
-            # game is finished
-            print(Ansi.GREEN + 'Checkmate!' + Ansi.RESET + (' ' * (len(Game.ROW_SEPARATOR)-10)))
-            color = Ansi.CYAN if game.winner == 'white' else Ansi.RED
-            print(color + game.winner + Ansi.GREEN + ' won!' + Ansi.RESET + (' ' * (len(Game.ROW_SEPARATOR)-10)))
+    # the worker processes of the AI are stopped however the game is finished
+    try:
+        while True:
+            # render the game board on the terminal
+            print('\033[H', end='')
+            title = ' Welcome to the TChess! '
+            stars_len = len(Game.ROW_SEPARATOR) - len(title)
+            title = (int(stars_len/2) * '*') + title + (int(stars_len/2) * '*')
+            print(title, end='')
+            print(' ' * (len(Game.ROW_SEPARATOR) - len(title)))
+            print(' ' * len(Game.ROW_SEPARATOR))
+            print(game.render())
+
+            if game.is_end:
+                # game is finished
+                if ponderer is not None:
+                    ponderer.cancel()
+                title, result = game.end_message()
+                print(Ansi.GREEN + title + Ansi.RESET + (' ' * (len(Game.ROW_SEPARATOR)-10)))
+                if game.winner is None:
+                    print(Ansi.GREEN + result + Ansi.RESET + (' ' * (len(Game.ROW_SEPARATOR)-10)))
+                else:
+                    color = Ansi.CYAN if game.winner == 'white' else Ansi.RED
+                    print(color + game.winner + Ansi.GREEN + ' won!' + Ansi.RESET + (' ' * (len(Game.ROW_SEPARATOR)-10)))
+                if is_play:
+                    next_step = ''
+                else:
+                    next_step = input('Press enter to continnue or type `back`: ').strip().lower()
+                if next_step == 'back':
+                    game.is_end = False
+                    game.winner = None
+                    game.run_command('back')
+                    if is_online:
+                        server.publish(game)
+                    continue
+                else:
+                    break
+
+            # get command from user and run it
+            tmp_turn = game.turn
+            ansi_color = Ansi.RED if tmp_turn == 'black' else Ansi.CYAN
+            # fix whitespace
+            print(last_message, end='')
+            print(' ' * (len(Game.ROW_SEPARATOR)-len(last_message)))
+            print(' ' * len(Game.ROW_SEPARATOR), end='\r')
+            ai_result = None
+            # the pre-parsed moves (of the replay and the AI) are applied without parsing the command
+            move = None
             if is_play:
-                next_step = ''
-            else:
-                next_step = input('Press enter to continnue or type `back`: ').strip().lower()
-            if next_step == 'back':
-                game.is_end = False
-                game.winner = None
-                game.run_command('back')
-                continue
-            else:
-                break
-
-        # get command from user and run it
-        tmp_turn = game.turn
-        ansi_color = Ansi.RED if tmp_turn == 'black' else Ansi.CYAN
-        # fix whitespace
-        print(last_message, end='')
-        print(' ' * (len(Game.ROW_SEPARATOR)-len(last_message)))
-        print(' ' * len(Game.ROW_SEPARATOR), end='\r')
-        if is_play:
-            time.sleep(play_speed)
-            try:
+                time.sleep(play_speed)
+                if log_counter >= len(game_logs):
+                    print('Finished.')
+                    sys.exit()
+                # the logged moves are decoded, not parsed
+                move = game_logs.move(log_counter)
                 command = game_logs[log_counter]
-            except:
-                print('Finished.')
-                sys.exit()
-            log_counter += 1
-        else:
-            if is_online and game.turn == game.guest_color:
-                print('Waiting for guest command...')
-                while not game.guest_ran:
-                    pass
-                print(game.guest_ran)
-                game.guest_ran = False
-                continue
+                log_counter += 1
+            elif ai_engine is not None and game.turn == ai_color:
+                if ponderer is not None:
+                    ponderer.cancel()
+                print('AI is thinking...', end='\r', flush=True)
+                ai_result = ai_engine.search(game)
+                if ai_result.move is None:
+                    print('AI cannot move.')
+                    break
+                move = ai_result.move
+                command = engine.move_to_command(move)
             else:
-                command = input(ansi_color + game.turn + Ansi.RESET + ' Turn >>> ').strip().lower()
+                if is_online and game.turn == game.guest_color:
+                    if ponderer is not None:
+                        ponderer.cancel()
+                    print('Waiting for guest command...')
+                    while not game.guest_ran:
+                        pass
+                    print(game.guest_ran)
+                    game.guest_ran = False
+                    continue
+                else:
+                    if ponderer is not None:
+                        ponderer.start(game)
+                    command = input(ansi_color + game.turn + Ansi.RESET + ' Turn >>> ').strip().lower()
+                    if command == 'hint':
+                        # answered from the analysis, without searching
+                        if ponderer is None:
+                            last_message = 'Error: hints are disabled, run tchess with --ponder'
+                        else:
+                            last_message = import_module('ponder').hint_message(ponderer.hint(game))
+                        continue
 
-        game.highlight_cells = []
-        game.selected_cell = None
+            game.highlight_cells = []
+            game.selected_cell = None
 
-        # check the empty command
-        if command == '':
-            last_message = ''
-            continue
+            # check the empty command
+            if command == '':
+                last_message = ''
+                continue
 
-        # check the exit command
-        if command in ['exit', 'quit', 'q']:
-            game_file_name = os.path.abspath(game_file_name)
-            print('Your game was saved in file `' + game_file_name + '`.')
-            print(
-                'To continue this game again, run `' + sys.argv[0] + ' '+repr(game_file_name)+'`.'
-            )
-            print('Good bye!')
-            sys.exit()
+            # check the exit command
+            if command in ['exit', 'quit', 'q']:
+                if ponderer is not None:
+                    ponderer.cancel()
+                game_file_name = os.path.abspath(game_file_name)
+                print('Your game was saved in file `' + game_file_name + '`.')
+                print(
+                    'To continue this game again, run `' + sys.argv[0] + ' '+repr(game_file_name)+'`.'
+                )
+                print('Good bye!')
+                sys.exit()
 
-        # run the command on the game to make effects
-        last_message = game.run_command(command)
-
-        # save the game
-        # open a file
-        # this file is used to save the game state
-        # after any command on the game, game will be re-write on this file
-        if not is_play:
-            game_file = open(game_file_name, 'wb')
-            pickle.dump(game, game_file)
-            game_file.close()
+            # run the command on the game to make effects
+            if move is not None:
+                last_message = game.apply_move(*move)
+            else:
+                last_message = game.run_command(command)
+            if ai_result is not None:
+                last_message = 'AI: ' + last_message + ' (' + str(ai_result) + ')'
+            if ponderer is not None and ponderer.is_stale(game):
+                # a move or `back` changed the position, the analysis of the new
+                # position is started before the next command is read
+                ponderer.cancel()
+            if is_online:
+                server.record_command('host')
+                server.publish(game)
+
+            # save the game
+            # open a file
+            # this file is used to save the game state
+            # after any command on the game, game will be re-write on this file
+            if not is_play:
+                save_game(game, game_file_name)
+    finally:
+        if ponderer is not None:
+            ponderer.cancel()
+        if ai_engine is not None:
+            ai_engine.close()
 
 if __name__ == '__main__':
     run(sys.argv[1:])
@@ -0,0 +1,169 @@
+""" Self-play tournaments (the `--tournament` option)
+
+The games are played without a terminal: the beeps are disabled and the games are not
+rendered or saved while they are played. They are played in a pool of processes and the
+finished games are added to a game database (`tchess.database`) as they arrive:
+
+    >>> stats = tournament.run(100, 'ai', 'random', workers=4, output='tournament.db')
+    >>> print(stats.report())
+
+The players are `random` (a random legal move) or `ai` (the search engine with a time budget
+for each move). The first plies of each game are random, so the games of two AI players
+are not all the same. This is also the benchmark of the game core: games/sec and plies/sec
+of the whole `Game` (move validation, applying the moves and the check detection).
+"""
+
+import time
+import random
+import multiprocessing
+
+try:
+    from .tchess import Game, Piece
+    from . import moves
+    from . import engine
+    from . import database
+    from . import pgn
+except ImportError:
+    from tchess import Game, Piece
+    import moves
+    import engine
+    import database
+    import pgn
+
+PLAYERS = ('random', 'ai')
+
+# the random plies in start of each game
+OPENING_PLIES = 4
+
+# the games that are not finished in this number of plies are stopped (the result is `*`)
+MAX_PLIES = 200
+
+# the AI engines of the current process, by time budget (an engine is reused for the games)
+ENGINES = {}
+
+class TournamentError(Exception):
+    """ Raised when the options of a tournament are invalid """
+
+def get_engine(ai_time):
+    """ Returns the AI engine of this process for a time budget """
+    ai = ENGINES.get(ai_time)
+    if ai is None:
+        ai = ENGINES[ai_time] = engine.Engine(time_limit=ai_time, table_size=1024 * 1024)
+    return ai
+
+def choose_move(game, player, rng, ai_time):
+    """ Returns the move of a player: (src, dst, promotion) """
+    if player == 'ai' and len(game.logs) >= OPENING_PLIES:
+        return get_engine(ai_time).search(game).move
+    src, targets = rng.choice(moves.legal_moves(game, game.turn))
+    dst = rng.choice(targets)
+    return src, (dst[0], dst[1]), Piece.QUEEN
+
+def play_game(task):
+    """ Plays a game and returns its result (it's run in the worker processes)
+
+    `task` is (number of the game, white player, black player, seed, AI time, max plies).
+    Returns (number, is_end, winner, draw reason, halfmove clock, logs).
+    """
+    number, white, black, seed, ai_time, max_plies = task
+    rng = random.Random(seed)
+    game = Game.from_state(white_player=white, black_player=black)
+    game.enable_beep = False
+    while not game.is_end and len(game.logs) < max_plies:
+        move = choose_move(game, white if game.turn == 'white' else black, rng, ai_time)
+        if move is None:
+            break
+        game.apply_move(*move)
+    return number, game.is_end, game.winner, game.draw_reason, game.halfmove_clock, game.logs
+
+class TournamentStats:
+    """ Statistics of the played games """
+
+    def __init__(self):
+        self.games = 0
+        self.plies = 0
+        self.results = {'1-0': 0, '0-1': 0, '1/2-1/2': 0, '*': 0}
+        # {draw reason: number of the games}
+        self.draws = {}
+        self.seconds = 0.0
+
+    def add(self, game):
+        """ Adds a finished game """
+        self.games += 1
+        self.plies += len(game.logs)
+        self.results[pgn.game_result(game)] += 1
+        if game.draw_reason is not None:
+            self.draws[game.draw_reason] = self.draws.get(game.draw_reason, 0) + 1
+
+    @property
+    def games_per_second(self):
+        return self.games / self.seconds if self.seconds > 0 else 0.0
+
+    @property
+    def plies_per_second(self):
+        return self.plies / self.seconds if self.seconds > 0 else 0.0
+
+    @property
+    def average_plies(self):
+        return self.plies / self.games if self.games else 0.0
+
+    def report(self):
+        """ Returns the text report """
+        lines = [
+            str(self.games) + ' games in ' + str(round(self.seconds, 2)) + ' seconds: '
+            + str(round(self.games_per_second, 2)) + ' games/sec, ' + str(round(self.plies_per_second, 1)) + ' plies/sec',
+            'average plies: ' + str(round(self.average_plies, 1)),
+            'results: ' + ', '.join(result + ' ' + str(count) for result, count in self.results.items()),
+        ]
+        if self.draws:
+            lines.append('draws: ' + ', '.join(reason + ' ' + str(count) for reason, count in sorted(self.draws.items())))
+        return '\n'.join(lines)
+
+def run(count, white='ai', black='ai', workers=1, ai_time=0.1, max_plies=MAX_PLIES, output=None, seed=None, progress=None):
+    """ Plays `count` games and returns their `TournamentStats`
+
+    The games are added to the database `output` (if it's given). `progress` is called
+    with the stats after each game.
+    """
+    for player in (white, black):
+        if player not in PLAYERS:
+            raise TournamentError('player should be one of ' + ', '.join(PLAYERS) + ', not `' + str(player) + '`')
+    if seed is None:
+        seed = random.randrange(2 ** 32)
+    tasks = [(i, white, black, seed + i, ai_time, max_plies) for i in range(count)]
+
+    stats = TournamentStats()
+    db = database.GameDatabase(output) if output else None
+    start = time.time()
+    pool = None
+    try:
+        if workers > 1:
+            pool = multiprocessing.Pool(workers)
+            results = pool.imap_unordered(play_game, tasks)
+        else:
+            results = map(play_game, tasks)
+        batch = []
+        for number, is_end, winner, draw_reason, halfmove_clock, logs in results:
+            game = Game.from_state(
+                white_player=white + ' (white)', black_player=black + ' (black)',
+                logs=logs, is_end=is_end, winner=winner, draw_reason=draw_reason, halfmove_clock=halfmove_clock,
+            )
+            stats.add(game)
+            stats.seconds = time.time() - start
+            if db is not None:
+                batch.append(game)
+                if len(batch) >= database.BATCH_SIZE:
+                    db.add_games(batch, source='tournament')
+                    batch = []
+            if progress is not None:
+                progress(stats)
+        if db is not None and batch:
+            db.add_games(batch, source='tournament')
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+        if db is not None:
+            db.close()
+    stats.seconds = time.time() - start
+    return stats
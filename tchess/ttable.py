@@ -0,0 +1,86 @@
+""" Transposition table of the search
+
+The table has a fixed memory budget. Entries are kept in flat arrays (not a dict of
+objects): key, score, move, depth and bound type, 16 bytes for each entry. Each bucket
+has two entries, the first one is replaced only by deeper (or the same) positions
+and the second one is always replaced.
+"""
+
+from array import array
+
+# bound types of the stored scores (0 means the entry is empty)
+EXACT = 1
+LOWER = 2
+UPPER = 3
+
+# bytes of each entry: key (8), score (4), move (2), depth (1) and bound type (1)
+ENTRY_SIZE = 16
+
+# default memory budget of the table
+DEFAULT_SIZE = 16 * 1024 * 1024
+
+class TranspositionTable:
+    """ A bounded, array backed transposition table """
+
+    def __init__(self, size=DEFAULT_SIZE):
+        # number of the buckets is a power of 2, so a key is mapped to the bucket by a mask
+        buckets = 1
+        while buckets * 2 * 2 * ENTRY_SIZE <= size:
+            buckets *= 2
+        self.mask = buckets - 1
+        self.entries = buckets * 2
+        self.keys = array('Q', [0]) * self.entries
+        self.scores = array('i', [0]) * self.entries
+        self.moves = array('H', [0]) * self.entries
+        self.depths = array('b', [0]) * self.entries
+        self.flags = array('B', [0]) * self.entries
+        self.probes = 0
+        self.hits = 0
+        self.stores = 0
+
+    def clear(self):
+        """ Removes all of the entries and resets the statistics """
+        self.__init__(self.entries * ENTRY_SIZE)
+
+    def probe(self, key):
+        """ Returns (depth, bound type, score, move) of the key or None if it's not stored """
+        self.probes += 1
+        index = (key & self.mask) * 2
+        for i in (index, index + 1):
+            if self.flags[i] and self.keys[i] == key:
+                self.hits += 1
+                return self.depths[i], self.flags[i], self.scores[i], self.moves[i]
+        return None
+
+    def store(self, key, depth, flag, score, move=0):
+        """ Stores the search result of a position
+
+        The depth-preferred entry of the bucket is replaced if the new depth is not less
+        than its depth (or it's the same position), otherwise the always-replace entry is used.
+        """
+        self.stores += 1
+        index = (key & self.mask) * 2
+        if self.flags[index] and self.keys[index] != key and depth < self.depths[index]:
+            index += 1
+        elif self.keys[index] == key and move == 0:
+            # keep the best move of the previous search of this position
+            move = self.moves[index]
+        self.keys[index] = key
+        self.depths[index] = max(-128, min(127, depth))
+        self.flags[index] = flag
+        self.scores[index] = score
+        self.moves[index] = move
+
+    @property
+    def hit_rate(self):
+        """ Rate of the probes that the position was found """
+        if self.probes == 0:
+            return 0.0
+        return self.hits / self.probes
+
+    def usage(self):
+        """ Rate of the used entries """
+        return sum(1 for flag in self.flags if flag) / self.entries
+
+    def __str__(self):
+        return str(self.probes) + ' probes, ' + str(round(self.hit_rate * 100, 1)) + '% hits'
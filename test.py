@@ -21,6 +21,17 @@ def str_contains_all(string, items):
             return False
     return True
 
+def wait_for_server(url, timeout=30):
+    """ Polls a url of a served game until it responds (or the timeout is passed) """
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            requests.get(url)
+            return True
+        except requests.exceptions.ConnectionError:
+            time.sleep(0.1)
+    return False
+
 def test_default_state_is_valid():
     """ Default state of chess board is valid """
     game = Game()
@@ -54,6 +65,38 @@ def test_default_state_is_valid():
         assert game.board[index][3].name == Piece.KING
         assert game.board[index][4].color == color
 
+def test_game_from_state_is_cheap_and_isolated():
+    """ Games built from the prototype start board and `Game.from_state` are independent """
+    game1 = Game(white_player='a', black_player='b')
+    game2 = Game.from_state(white_player='c', black_player='d')
+    assert game1.white_player == 'a'
+    assert game2.black_player == 'd'
+    assert [[str(p) for p in row] for row in game1.board] == [[str(p) for p in row] for row in Game().board]
+
+    # changing a game does not change the other games
+    game1.run_command('mv 2.1 4.1')
+    assert game1.board[1][0] is None
+    assert game2.board[1][0] is not None
+    assert Game.START_BOARD[1][0] is not None
+
+    # the board and the logs of the state are copied, the games don't share them
+    game3 = Game.from_state(board=game1.board, turn='black', logs=game1.logs)
+    assert game3.turn == 'black'
+    assert game3.board[3][0].name == Piece.PAWN
+    assert game3.version == Game.SAVE_VERSION
+    assert game3.board is not game1.board and game3.logs is not game1.logs
+    assert game1.legal_targets((6, 0)) == [[5, 0], [4, 0]]
+    game3.run_command('mv 7.1 5.1')
+    assert game3.board[4][0].name == Piece.PAWN and game3.board[6][0] is None
+    assert game1.board[4][0] is None and game1.board[6][0] is not None
+    assert game1.logs == ['mv 2.1 4.1']
+    assert game1.board_key() != game3.board_key()
+    assert game1.legal_targets((6, 0)) == [[5, 0], [4, 0]]
+    game3.run_command('back')
+    assert game3.logs == ['mv 2.1 4.1']
+    assert game3.board[6][0] is not None
+    assert game1.board_key() == game3.board_key()
+
 def test_turn_changer_works():
     """ Game turn can be changed correctly """
     game = Game()
@@ -96,6 +139,50 @@ def test_log_list_is_working():
 
     assert game.logs == commands
 
+def test_structured_move_api_works():
+    """ Moves are applied without parsing command strings """
+    assert Game.parse_move('mv 2.1 to 4.1') == ((1, 0), (3, 0), None)
+    assert Game.parse_move('move 7-2 8-2 > q') == ((6, 1), (7, 1), Piece.QUEEN)
+    assert Game.parse_move('s 2.1') is None
+    assert Game.parse_move('mv 2.1.3 to 4.1') is None
+    try:
+        Game.parse_move('mv a.1 to 4.1')
+        assert False
+    except ValueError:
+        pass
+
+    game = Game()
+    assert str_contains_all(game.apply_move((1, 0), (8, 0)).lower(), ['error', 'range'])
+    assert str_contains_all(game.apply_move((3, 0), (4, 0)).lower(), ['error', 'empty'])
+    assert str_contains_all(game.apply_move((6, 0), (5, 0)).lower(), ['error', 'turn'])
+    assert game.logs == []
+    assert game.apply_move((1, 0), (3, 0)) == '2.1 Moved to 4.1'
+    assert game.board[3][0].name == Piece.PAWN
+    assert game.turn == 'black'
+    assert game.apply_move((6, 1), (4, 1)) == '7.2 Moved to 5.2'
+    assert list(game.logs) == ['mv 2.1 to 4.1', 'mv 7.2 to 5.2']
+
+    # the same game with the commands
+    other = Game()
+    other.run_command('mv 2.1 to 4.1')
+    other.run_command('move 7.2 5.2')
+    assert [[str(piece) for piece in row] for row in other.board] == [[str(piece) for piece in row] for row in game.board]
+    assert other.logs == game.logs
+
+    game.run_command('back')
+    assert game.logs == ['mv 2.1 to 4.1']
+    assert game.board[6][1] is not None
+
+    # promotion
+    game = Game.from_state(board=[
+        [None] * 8, [None] * 8, [None] * 8, [None] * 8,
+        [None] * 8, [None] * 8, [Piece(Piece.PAWN, 'white')] + [None] * 7, [None] * 8,
+    ])
+    assert 'error' in game.apply_move((6, 0), (7, 0)).lower()
+    game.apply_move((6, 0), (7, 0), Piece.KNIGHT)
+    assert game.board[7][0].name == Piece.KNIGHT
+    assert game.logs == ['mv 7.1 to 8.1 > n']
+
 def test_game_file_system_works():
     """ Game file system working correct """
     if os.path.exists('game.tchess'):
@@ -148,6 +235,25 @@ def test_game_file_system_works():
     os.remove('game.tchess')
     os.remove('other.tchess')
 
+def test_heavy_modules_are_imported_lazily():
+    """ Importing tchess and running `--version` do not load the networking modules """
+    code = '''
+import sys
+import tchess
+try:
+    tchess.run(['--version'])
+except SystemExit:
+    pass
+print('loaded:' + ','.join(m for m in ('flask', 'requests', 'karafs', 'tchess.server', 'server') if m in sys.modules))
+'''
+    proc = subprocess.Popen(
+        [PY_EXE, '-c', code],
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE
+    )
+    output = proc.communicate()[0].decode().strip().splitlines()
+    assert output[0].startswith('0.')
+    assert output[-1] == 'loaded:'
+
 def test_command_s_works():
     """ Command `s` for show allowed cells to go working correct """
     game = Game()
@@ -253,7 +359,8 @@ def test_king_move_validation_works():
     game.run_command('mv 4.4 5.4')
     game.run_command('mv 7.4 6.4')
     game.run_command('s 6.4')
-    assert game.highlight_cells == [[6, 3], [5, 4], [5, 2], [4, 4], [4, 3], [4, 2]]
+    # the pawn on 5.4 attacks 6.3 and 6.5
+    assert game.highlight_cells == [[6, 3], [4, 4], [4, 3], [4, 2]]
     game.run_command('mv 2.2 3.2')
     assert str_contains_all(game.run_command('mv 6.4 5.4').lower(), ['moved', 'to'])
 
@@ -339,14 +446,500 @@ def test_checkmate_and_example():
 
     for command in commands:
         assert game.current_check is None
+        assert not game.is_end
         game.run_command(command)
 
+    # the queen is defended by the knight, so black has no legal move
     assert game.current_check == 'black'
-
-    game.run_command('mv 8.4 7.3',)
-
     assert game.is_end
     assert game.winner == 'white'
+    assert game.end_message() == ('Checkmate!', 'white won!')
+
+def test_legal_moves_work():
+    """ Only the legal moves are allowed: pins, check evasions and stalemate """
+    from tchess import moves
+
+    # the rook is pinned by the bishop, it can only move on the pin ray
+    game = Game.from_state(board=empty_board(
+        (0, 3, Piece.KING, 'white'),
+        (1, 4, Piece.ROOK, 'white'),
+        (4, 7, Piece.BISHOP, 'black'),
+        (7, 0, Piece.KING, 'black'),
+    ))
+    game.run_command('s 2.5')
+    assert game.highlight_cells == []
+    assert 'not allowed' in game.run_command('mv 2.5 to 3.5').lower()
+    # the king can not move to the attacked cells
+    game.run_command('s 1.4')
+    assert sorted(game.highlight_cells) == [[0, 2], [0, 4], [1, 2], [1, 3]]
+
+    # in check, the other pieces can only capture the checker or block the check
+    game = Game.from_state(board=empty_board(
+        (0, 3, Piece.KING, 'white'),
+        (2, 0, Piece.ROOK, 'white'),
+        (5, 3, Piece.ROOK, 'black'),
+        (7, 0, Piece.KING, 'black'),
+    ))
+    game.handle_check()
+    assert game.current_check == 'white'
+    game.run_command('s 3.1')
+    assert game.highlight_cells == [[2, 3]]
+    info = moves.pins_and_checks(game.board, 'white')
+    assert info[1] == 1
+    assert info[2] == {(1, 3), (2, 3), (3, 3), (4, 3), (5, 3)}
+
+    # the pawns on the edge don't capture on the other side of the board
+    game = Game.from_state(board=empty_board(
+        (0, 3, Piece.KING, 'white'),
+        (1, 0, Piece.PAWN, 'white'),
+        (2, 7, Piece.KNIGHT, 'black'),
+        (7, 3, Piece.KING, 'black'),
+    ))
+    game.run_command('s 2.1')
+    assert sorted(game.highlight_cells) == [[2, 0], [3, 0]]
+
+    # black has no legal move but isn't in check
+    game = Game.from_state(board=empty_board(
+        (5, 6, Piece.KING, 'white'),
+        (6, 4, Piece.QUEEN, 'white'),
+        (7, 7, Piece.KING, 'black'),
+    ))
+    game.run_command('mv 7.5 7.6')
+    assert game.current_check is None
+    assert game.is_end
+    assert game.winner is None
+    assert game.end_message() == ('Stalemate!', 'Draw!')
+
+def test_move_cache_works():
+    """ Legal moves are cached by the position for all of the games """
+    from tchess import movecache
+
+    cache = movecache.MoveCache(size=2)
+    assert cache.get('a') is None
+    cache.put('a', [1])
+    cache.put('b', [2])
+    assert cache.get('a') == [1]
+    # `b` is the least recently used one
+    cache.put('c', [3])
+    assert cache.get('b') is None
+    assert cache.get('a') == [1] and cache.get('c') == [3]
+    assert cache.stats() == {'size': 2, 'entries': 2, 'hits': 3, 'misses': 2, 'evictions': 1, 'hit_rate': 0.6}
+    cache.resize(1)
+    assert len(cache) == 1 and cache.get('c') == [3]
+    cache.resize(0)
+    cache.put('d', [4])
+    assert len(cache) == 0
+
+    old_cache = movecache.CACHE
+    movecache.CACHE = movecache.MoveCache()
+    try:
+        game = Game()
+        game.run_command('mv 2.5 4.5')
+        # the key is updated by the moves like the key of the whole board
+        assert game.board_key() == movecache.board_key(game.board)
+        game.run_command('s 7.5')
+        misses = movecache.CACHE.misses
+        hits = movecache.CACHE.hits
+
+        # the same position in another game is a lookup
+        other = Game()
+        other.run_command('mv 2.5 4.5')
+        other.run_command('s 7.5')
+        assert other.highlight_cells == game.highlight_cells == [[5, 4], [4, 4]]
+        assert movecache.CACHE.misses - misses <= 1
+        assert movecache.CACHE.hits > hits
+        assert movecache.CACHE.hit_rate > 0
+
+        # the cached list is not changed by the callers
+        other.highlight_cells.append([0, 0])
+        other.run_command('s 7.5')
+        assert other.highlight_cells == [[5, 4], [4, 4]]
+
+        # the key is calculated again when the board is replaced
+        game.run_command('back')
+        assert game.board_key() == movecache.board_key(Game.get_start_board())
+        assert game.run_command('s 2.5') == ''
+        assert game.highlight_cells == [[2, 4], [3, 4]]
+    finally:
+        movecache.CACHE = old_cache
+
+def test_attack_map_works():
+    """ Attack maps of the games are updated by the moves """
+    import pickle
+    from tchess import attacks, moves
+
+    game = Game()
+    assert game.is_attacked((2, 0), 'white')
+    assert not game.is_attacked((3, 3), 'white')
+    assert game.attack_map().counts['white'][2 * 8 + 2] == 3
+    attack_map = game.attack_map()
+    for command in ['mv 2.4 4.4', 'mv 7.5 5.5', 'mv 1.5 5.1', 'mv 5.5 4.4', 'mv 2.5 4.5', 'mv 8.6 4.2']:
+        game.run_command(command)
+        # the map is updated, not built again
+        assert game.attack_map() is attack_map
+        fresh = attacks.AttackMap(game.board)
+        assert attack_map.counts == fresh.counts
+        assert attack_map.attackers == fresh.attackers
+        for x in range(8):
+            for y in range(8):
+                for color in ('white', 'black'):
+                    assert game.is_attacked((x, y), color) == moves.is_attacked(game.board, (x, y), color)
+    # the queen on 5.1 attacks the pawn on 7.3 through the empty cell 6.2
+    assert game.is_attacked((6, 2), 'white')
+    assert not game.in_check('black')
+
+    # the king can't go back on the ray of the rook that checks it
+    game = Game.from_state(board=empty_board(
+        (2, 3, Piece.KING, 'white'),
+        (6, 3, Piece.ROOK, 'black'),
+        (7, 0, Piece.KING, 'black'),
+    ))
+    game.handle_check()
+    assert game.in_check('white') and game.current_check == 'white'
+    assert game.attack_map().king('white') == (2, 3)
+    assert not game.is_attacked((1, 3), 'black')
+    game.run_command('s 3.4')
+    assert [1, 3] not in game.highlight_cells
+    assert sorted(game.highlight_cells) == [[1, 2], [1, 4], [2, 2], [2, 4], [3, 2], [3, 4]]
+
+    # the attack map is not saved with the game
+    loaded = pickle.loads(pickle.dumps(game))
+    assert loaded.attacks is None
+    assert loaded.in_check('white')
+
+def test_history_works():
+    """ The snapshots of the positions are kept and shared between the plies """
+    import pickle
+    from tchess import history
+
+    game = Game()
+    game.enable_beep = False
+    commands = ['mv 2.4 4.4', 'mv 7.5 5.5', 'mv 1.5 5.1', 'mv 5.5 4.4', 'mv 5.1 7.3']
+    boards = [[[str(piece) for piece in row] for row in game.board]]
+    for command in commands:
+        game.run_command(command)
+        boards.append([[str(piece) for piece in row] for row in game.board])
+    snapshots = game.history()
+    assert len(snapshots) == len(commands) + 1
+    for ply, board in enumerate(boards):
+        assert [[str(piece) for piece in row] for row in snapshots[ply].board()] == board
+        assert snapshots[ply].turn == ('white' if ply % 2 == 0 else 'black')
+        assert snapshots[ply].logs == ply
+    assert str(snapshots[3][4][4]) == 'b-p'
+    # the rows that are not changed by a move are shared with the previous snapshot
+    for ply in range(1, len(snapshots)):
+        shared = [x for x in range(8) if snapshots[ply][x] is snapshots[ply - 1][x]]
+        assert len(shared) >= 6
+    assert snapshots[-1].current_check == 'black'
+
+    # the history of a loaded game is built by replaying its logs
+    loaded = pickle.loads(pickle.dumps(game))
+    assert loaded.snapshots is None
+    assert [[[str(piece) for piece in row] for row in snapshot.board()] for snapshot in loaded.history()] == boards
+
+    # a past position as a new game
+    past = game.at_ply(2)
+    assert past.logs == commands[:2] and past.turn == 'white'
+    assert [[str(piece) for piece in row] for row in past.board] == boards[2]
+    assert len(past.history()) == 3
+    past.run_command('mv 1.7 3.6')
+    assert len(past.history()) == 4 and len(snapshots) == len(commands) + 1
+    assert game.at_ply(-1).current_check == 'black'
+
+    # `back` restores the previous snapshot with its state
+    game.run_command('back')
+    assert game.logs == commands[:4] and game.turn == 'white' and game.current_check is None
+    assert [[str(piece) for piece in row] for row in game.board] == boards[4]
+    assert len(game.history()) == 5
+
+    # a game that is not started from the start position
+    game = Game.from_state(board=empty_board((0, 3, Piece.KING, 'white'), (7, 3, Piece.KING, 'black')))
+    assert len(game.history()) == 1
+    game.run_command('mv 1.4 2.4')
+    assert len(game.history()) == 2
+    assert game.run_command('back') == 'OK! now you are one step back!'
+    assert str(game.board[0][3]) == 'w-k' and game.logs == []
+    assert str_contains_all(game.run_command('back'), ['first', 'move'])
+    assert isinstance(game.history(), history.History)
+
+def test_move_log_works():
+    """ The moves are logged as 16 bit codes """
+    import pickle
+    from tchess.tchess import MoveLog
+
+    logs = MoveLog(['mv 2.1 to 4.1', 'move 7.2 5.2', 'mv 7-1 8-1 > q', 'mv 2.8 to 1.8 > n'])
+    assert logs.codes.itemsize == 2 and len(logs) == 4
+    assert list(logs) == ['mv 2.1 to 4.1', 'mv 7.2 to 5.2', 'mv 7.1 to 8.1 > q', 'mv 2.8 to 1.8 > n']
+    assert logs.move(0) == ((1, 0), (3, 0), None)
+    assert logs.move(-1) == ((1, 7), (0, 7), Piece.KNIGHT)
+    assert list(logs.moves())[2] == ((6, 0), (7, 0), Piece.QUEEN)
+    for x in range(8):
+        for y in range(8):
+            for promotion in (None, Piece.QUEEN, Piece.KNIGHT, Piece.BISHOP, Piece.ROOK):
+                assert MoveLog.decode(MoveLog.encode((x, y), (7 - x, y), promotion)) == ((x, y), (7 - x, y), promotion)
+
+    # the text form is lossless
+    assert MoveLog(list(logs)) == logs
+    assert logs == ['mv 2.1 4.1', 'mv 7.2 to 5.2', 'move 7.1 8.1 > q', 'mv 2.8 1.8 > n']
+    assert logs != ['mv 2.1 4.1']
+    assert logs[1:3] == ['mv 7.2 to 5.2', 'mv 7.1 to 8.1 > q'] and isinstance(logs[1:3], MoveLog)
+    assert logs.pop() == 'mv 2.8 to 1.8 > n'
+    del logs[1:]
+    assert logs == ['mv 2.1 to 4.1']
+    for command in ['s 2.1', 'back', 'mv 9.1 to 1.1', 'mv a b']:
+        try:
+            MoveLog([command])
+            assert False
+        except ValueError:
+            pass
+
+    # the commands of the old saved games are converted (and the other commands are skipped)
+    game = Game.from_state(logs=['mv 2.1 4.1', 'back', 'move 7.2 to 5.2'])
+    assert isinstance(game.logs, MoveLog)
+    assert list(game.logs) == ['mv 2.1 to 4.1', 'mv 7.2 to 5.2']
+
+    # the codes are pickled, not the commands
+    game = Game()
+    game.enable_beep = False
+    for command in ['mv 1.2 3.1', 'mv 8.2 6.1', 'mv 3.1 1.2', 'mv 6.1 8.2'] * 5:
+        game.run_command(command)
+    assert len(game.logs) == 20
+    assert len(pickle.dumps(game.logs)) < len(pickle.dumps(list(game.logs))) / 2
+    assert pickle.loads(pickle.dumps(game)).logs == game.logs
+
+    # the games of save version 1 (the logs are a list of the commands) are loaded
+    old = Game.from_state()
+    old.enable_beep = False
+    old.run_command('mv 2.1 4.1')
+    old.run_command('mv 7.2 5.2')
+    old.logs = ['mv 2.1 4.1', 'mv 7.2 to 5.2']
+    old.version = 1
+    with open('old.tchess', 'wb') as game_file:
+        pickle.dump(old, game_file)
+    loaded = load_game_from_file('old.tchess')
+    assert loaded.version == Game.SAVE_VERSION == 2
+    assert isinstance(loaded.logs, MoveLog) and list(loaded.logs) == ['mv 2.1 to 4.1', 'mv 7.2 to 5.2']
+    proc = subprocess.Popen(
+        PY_EXE + ' -m tchess old.tchess', shell=True,
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE, stdin=subprocess.PIPE
+    )
+    proc.communicate(input='mv 2.3 to 4.3\nexit'.encode())
+    assert proc.returncode == 0
+    loaded = load_game_from_file('old.tchess')
+    assert loaded.version == Game.SAVE_VERSION
+    assert loaded.logs == ['mv 2.1 to 4.1', 'mv 7.2 to 5.2', 'mv 2.3 to 4.3']
+    os.remove('old.tchess')
+
+def test_headless_mode_works():
+    """ The headless mode runs the commands of stdin or a file """
+    import io
+    import json
+    from tchess import headless
+
+    game = Game.from_state()
+    output = io.StringIO()
+    commands = ['mv 2.6 3.6', 'mv 7.1 6.1', '', '# a comment', 'mv 1.5 3.7', 's 7.8', 'mv 9.1 1.1', 'foo', 'mv 6.1 5.1',
+                'mv 1.2 3.3', 'mv 5.1 4.1', 'mv 3.3 5.4', 'mv 4.1 3.1', 'mv 3.7 7.3', 'mv 2.1 3.1', 'back', 'exit', 'mv 2.1 3.1']
+    assert headless.run(game, (command + '\n' for command in commands), output) == 14
+    lines = output.getvalue().splitlines()
+    assert len(lines) == 14
+    assert lines[0] == '2.6 Moved to 3.6'
+    assert lines[3] == '5.8 6.8'
+    assert str_contains_all(lines[4].lower(), ['error', 'range'])
+    assert lines[5] == 'Invalid Command!'
+    assert lines[11] == '3.7 Moved to 7.3 (Checkmate! white won!)'
+    assert str_contains_all(lines[12].lower(), ['error', 'finished'])
+    assert lines[13] == 'OK! now you are one step back!'
+    assert not game.enable_beep and not game.is_end and len(game.logs) == 8
+
+    output = io.StringIO()
+    headless.run(Game.from_state(), ['mv 2.1 3.1\n', 's 7.2\n'], output, as_json=True)
+    results = [json.loads(line) for line in output.getvalue().splitlines()]
+    assert results[0] == {
+        'command': 'mv 2.1 3.1', 'result': '2.1 Moved to 3.1', 'cells': [], 'turn': 'black',
+        'check': None, 'is_end': False, 'winner': None, 'draw': None, 'plies': 1,
+    }
+    assert results[1]['result'] == '' and results[1]['cells'] == ['5.2', '6.2'] and results[1]['plies'] == 1
+
+    # the cli reads the commands of stdin or a file and saves the game once
+    for path in ('headless.tchess', 'headless.txt'):
+        if os.path.exists(path):
+            os.remove(path)
+    proc = subprocess.Popen(
+        PY_EXE + ' tchess --headless --json headless.tchess', shell=True,
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE, stdin=subprocess.PIPE
+    )
+    out, err = proc.communicate(input='mv 2.1 4.1\nmv 7.2 5.2\n'.encode())
+    assert [json.loads(line)['plies'] for line in out.decode().splitlines()] == [1, 2]
+    assert load_game_from_file('headless.tchess').logs == ['mv 2.1 4.1', 'mv 7.2 5.2']
+    with open('headless.txt', 'w') as commands_file:
+        commands_file.write('mv 4.1 5.2\n')
+    proc = subprocess.Popen(
+        PY_EXE + ' tchess --headless=headless.txt headless.tchess', shell=True,
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE, stdin=subprocess.PIPE
+    )
+    out, err = proc.communicate()
+    assert out.decode() == '4.1 Moved to 5.2\n'
+    assert len(load_game_from_file('headless.tchess').logs) == 3
+    os.remove('headless.tchess')
+    os.remove('headless.txt')
+
+def test_pondering_works():
+    """ The position is analyzed in background and the hints are answered from the analysis """
+    from tchess import ponder, engine
+
+    def wait_for_hint(ponderer, game):
+        for i in range(300):
+            result = ponderer.hint(game)
+            if result is not None:
+                return result
+            time.sleep(0.01)
+        return None
+
+    game = Game.from_state()
+    ponderer = ponder.Ponderer(time_limit=10, table=engine.ttable.TranspositionTable(1024 * 1024))
+    ponderer.start(game)
+    thread = ponderer.thread
+    result = wait_for_hint(ponderer, game)
+    assert result is not None and result.depth >= 1
+    assert result.move in engine.generate_moves(engine.Position(game.board, game.turn), 'white')
+    assert ponder.hint_message(result).startswith('Hint: `mv ')
+
+    # the analysis of the same position is not started again
+    ponderer.start(game)
+    assert ponderer.thread is thread and ponderer.running
+
+    # the commands that don't change the position don't make the analysis stale
+    game.run_command('s 2.4')
+    game.run_command('mv 2.4 6.4')
+    assert not ponderer.is_stale(game) and ponderer.running
+
+    # the analysis is restarted when the position is changed
+    game.run_command('mv 2.4 4.4')
+    assert ponderer.is_stale(game)
+    assert ponderer.hint(game) is None
+    ponderer.start(game)
+    assert ponderer.thread is not thread and not thread.is_alive()
+    result = wait_for_hint(ponderer, game)
+    assert result.move in engine.generate_moves(engine.Position(game.board, game.turn), 'black')
+    start = time.time()
+    ponderer.cancel()
+    assert time.time() - start < 1
+    assert not ponderer.running and ponderer.hint(game) is None
+    assert ponder.hint_message(None).startswith('There is no hint')
+
+    # without the table of the AI, the analysis has a small table of its own
+    assert ponder.Ponderer().engine.table.entries * engine.ttable.ENTRY_SIZE <= ponder.PONDER_TABLE_SIZE
+
+    # a stopped search returns the last finished depth
+    ai = engine.Engine(time_limit=30)
+    timer = threading.Timer(0.3, ai.stop)
+    timer.start()
+    start = time.time()
+    result = ai.search(game)
+    assert time.time() - start < 5 and result.move is not None
+
+    # the hint command of the cli
+    proc = subprocess.Popen(
+        PY_EXE + ' tchess --dont-check-terminal --no-beep --ponder hint.tchess', shell=True,
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE, stdin=subprocess.PIPE
+    )
+    out, err = proc.communicate(input='hint\nexit'.encode())
+    assert 'hint' in out.decode().lower()
+    # the game is not changed by the hint, so it's not saved
+    assert not os.path.exists('hint.tchess')
+    proc = subprocess.Popen(
+        PY_EXE + ' tchess --dont-check-terminal --no-beep hint.tchess', shell=True,
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE, stdin=subprocess.PIPE
+    )
+    out, err = proc.communicate(input='hint\nexit'.encode())
+    # pondering is disabled by default
+    assert 'run tchess with --ponder' in out.decode()
+
+    # the analysis is restarted after the moves and `back`
+    proc = subprocess.Popen(
+        PY_EXE + ' tchess --dont-check-terminal --no-beep --ponder hint.tchess', shell=True,
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE, stdin=subprocess.PIPE
+    )
+    out, err = proc.communicate(input='s 2.4\nmv 2.4 4.4\nhint\nmv 7.4 5.4\nback\nexit'.encode())
+    assert proc.returncode == 0
+    assert load_game_from_file('hint.tchess').logs == ['mv 2.4 to 4.4']
+    os.remove('hint.tchess')
+
+def test_draws_work():
+    """ The games are drawn by the threefold repetition and the fifty-move rule """
+    from tchess import pgn
+    from tchess.tchess import save_game
+
+    game = Game.from_state()
+    game.enable_beep = False
+    commands = ['mv 1.2 3.1', 'mv 8.2 6.1', 'mv 3.1 1.2', 'mv 6.1 8.2']
+    for command in commands * 2:
+        assert not game.is_end
+        game.run_command(command)
+    # the start position is repeated three times
+    assert game.is_end and game.winner is None and game.draw_reason == 'repetition'
+    assert game.end_message() == ('Threefold repetition!', 'Draw!')
+    assert pgn.game_result(game) == '1/2-1/2'
+    assert game.halfmove_clock == 8
+    assert game.history().repetitions(game.position_hash()) == 3
+    assert game.history().repetitions(Game.from_state().position_hash()) == 3
+
+    # `back` removes the last position from the counts
+    game.run_command('back')
+    assert not game.is_end and game.draw_reason is None
+    assert game.history().repetitions(Game.from_state().position_hash()) == 2
+    # the position after 2 and 6 plies is repeated the third time
+    game.run_command('mv 8.7 6.6')
+    game.run_command('mv 1.2 3.1')
+    assert not game.is_end
+    game.run_command('mv 6.6 8.7')
+    assert game.is_end and game.draw_reason == 'repetition'
+    game.run_command('back')
+    game.run_command('mv 7.8 6.8')
+    assert not game.is_end and game.halfmove_clock == 0
+    game.run_command('mv 3.1 1.2')
+
+    # the counts of a loaded game are built from its logs
+    loaded = Game.from_state(board=game.board, turn=game.turn, logs=list(game.logs))
+    assert loaded.history().repetitions(loaded.position_hash()) == game.history().repetitions(game.position_hash())
+    assert loaded.halfmove_clock == game.halfmove_clock == 1
+
+    # the captures and the pawn moves reset the clock
+    game = pgn.from_fen('4k3/8/8/8/8/8/1p6/R3K3 w - - 98 80')
+    assert game.halfmove_clock == 98
+    game.run_command('mv 1.8 2.8')
+    assert game.halfmove_clock == 99 and not game.is_end
+    game.run_command('mv 2.7 1.7 > q')
+    assert game.halfmove_clock == 0 and not game.is_end
+
+    # fifty moves without a capture or a pawn move
+    game = pgn.from_fen('4k3/8/8/8/8/8/8/R3K3 w - - 99 80')
+    game.run_command('mv 1.8 2.8')
+    assert game.is_end and game.draw_reason == 'fifty-move'
+    assert game.end_message() == ('Fifty-move rule!', 'Draw!')
+    assert pgn.to_fen(game).split()[4] == '100'
+
+    # the draw reason and the clock are saved and loaded
+    game = Game.from_state()
+    game.enable_beep = False
+    for command in commands * 2:
+        game.run_command(command)
+    save_game(game, 'draw.tchess')
+    loaded = load_game_from_file('draw.tchess')
+    assert loaded.is_end and loaded.draw_reason == 'repetition'
+    assert loaded.end_message() == ('Threefold repetition!', 'Draw!')
+    assert loaded.halfmove_clock == 8
+    save_game(pgn.from_fen('4k3/8/8/8/8/8/8/R3K3 w - - 37 80'), 'draw.tchess')
+    loaded = load_game_from_file('draw.tchess')
+    assert loaded.halfmove_clock == 37
+    assert pgn.to_fen(loaded).split()[4] == '37'
+    os.remove('draw.tchess')
+
+    # the checkmate is not a draw
+    game = pgn.from_fen('7k/8/6K1/8/8/8/8/R7 w - - 99 80')
+    game.run_command('mv 1.8 8.8')
+    assert game.is_end and game.winner == 'white' and game.draw_reason is None
 
 def test_pawn_promotion():
     """ Pawn promotion system works """
@@ -372,6 +965,825 @@ def test_pawn_promotion():
     assert game.board[0][0].name == Piece.ROOK
     assert game.board[0][0].color == 'black'
 
+def empty_board(*pieces):
+    """ Returns an empty board with the given pieces: (x, y, name, color) """
+    board = [[None] * 8 for i in range(8)]
+    for x, y, name, color in pieces:
+        board[x][y] = Piece(name, color)
+    return board
+
+def test_ai_engine_works():
+    """ The AI engine finds the winning moves in its time budget """
+    from tchess import engine
+
+    # a free queen
+    game = Game.from_state(board=empty_board(
+        (0, 3, Piece.KING, 'white'),
+        (3, 3, Piece.ROOK, 'white'),
+        (7, 0, Piece.KING, 'black'),
+        (3, 6, Piece.QUEEN, 'black'),
+    ))
+    result = engine.Engine(time_limit=0.5).search(game)
+    assert result.move == ((3, 3), (3, 6), None)
+    assert result.depth >= 1
+    assert result.nodes > 0
+    assert result.nps > 0
+
+    # the checkmate example
+    game = Game()
+    for command in ['mv 2.6 3.6', 'mv 7.1 6.1', 'mv 1.5 3.7', 'mv 6.1 5.1', 'mv 1.2 3.3', 'mv 5.1 4.1', 'mv 3.3 5.4', 'mv 4.1 3.1']:
+        game.run_command(command)
+    start = time.time()
+    result = engine.Engine(time_limit=1).search(game)
+    assert time.time() - start < 3
+    assert result.score >= engine.MATE_SCORE - engine.MAX_DEPTH
+    game.run_command(engine.move_to_command(result.move))
+    assert game.current_check == 'black'
+
+    # pawn promotion
+    game = Game.from_state(board=empty_board(
+        (0, 0, Piece.KING, 'white'),
+        (6, 4, Piece.PAWN, 'white'),
+        (4, 7, Piece.KING, 'black'),
+    ))
+    result = engine.Engine(time_limit=0.5).search(game)
+    assert result.move == ((6, 4), (7, 4), Piece.QUEEN)
+    assert engine.move_to_command(result.move) == 'mv 7.5 to 8.5 > q'
+    assert 'Moved' in game.run_command(engine.move_to_command(result.move))
+    assert game.board[7][4].name == Piece.QUEEN
+
+    # playing against the AI in the cli
+    if os.path.exists('ai.tchess'):
+        os.remove('ai.tchess')
+    proc = subprocess.Popen(
+        PY_EXE + ' tchess --ai=black --ai-time=0.2 ai.tchess', shell=True,
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE, stdin=subprocess.PIPE
+    )
+    proc.communicate(input='mv 2.1 to 3.1\nexit'.encode())
+    saved_game = load_game_from_file('ai.tchess')
+    assert len(saved_game.logs) == 2
+    assert saved_game.turn == 'white'
+    os.remove('ai.tchess')
+
+def test_ai_parallel_search_works():
+    """ The AI searches with a pool of processes on the encoded position """
+    import multiprocessing
+    from tchess import engine, encoding
+
+    game = Game()
+    game.run_command('mv 2.4 4.4')
+    data = encoding.encode_board(game.board, game.turn)
+    assert len(data) == 65
+    board, turn = encoding.decode_board(data)
+    assert turn == 'black'
+    assert [[str(p) for p in row] for row in board] == [[str(p) for p in row] for row in game.board]
+    assert encoding.encode_board(board, turn) == data
+
+    game = Game.from_state(board=empty_board(
+        (0, 3, Piece.KING, 'white'),
+        (3, 3, Piece.ROOK, 'white'),
+        (1, 0, Piece.PAWN, 'white'),
+        (7, 0, Piece.KING, 'black'),
+        (3, 6, Piece.QUEEN, 'black'),
+    ))
+    ai = engine.Engine(time_limit=0.5, workers=2)
+    try:
+        result = ai.search(game)
+    finally:
+        ai.close()
+    assert result.move == ((3, 3), (3, 6), None)
+    assert result.depth >= 1
+    assert result.nodes > 0
+
+    # the stop flag is shared with the worker processes, so `stop` stops the chunks that they search
+    ai = engine.Engine(time_limit=60, workers=2)
+    try:
+        ai.get_pool()
+        ai.stop()
+        assert ai.stop_flag.value == 1
+        ai.stopped = False
+        assert ai.stop_flag.value == 0
+    finally:
+        ai.close()
+    game = Game()
+    moves = engine.generate_moves(engine.Position(game.board, game.turn), game.turn)
+    task = (encoding.encode_board(game.board, game.turn), moves, 4, None)
+    engine.init_worker(None, 0, stop_flag=multiprocessing.Value('b', 1))
+    try:
+        move, score, nodes, completed, probes, hits = engine.search_root_chunk(task)
+    finally:
+        engine.init_worker(None, 0)
+    assert not completed and nodes == 256
+
+def test_transposition_table_works():
+    """ Transposition table has a fixed size and depth-preferred/always-replace entries """
+    from tchess import engine, encoding, ttable
+
+    table = ttable.TranspositionTable(1024)
+    assert table.entries * ttable.ENTRY_SIZE <= 1024
+    assert table.entries == 64
+    assert table.probe(5) is None
+
+    move = encoding.encode_move(((1, 2), (7, 3), Piece.QUEEN))
+    assert move < 2 ** 16
+    assert encoding.decode_move(move) == ((1, 2), (7, 3), Piece.QUEEN)
+    assert encoding.decode_move(encoding.encode_move(((0, 0), (0, 1), None))) == ((0, 0), (0, 1), None)
+
+    table.store(5, 3, ttable.EXACT, -10, move)
+    assert table.probe(5) == (3, ttable.EXACT, -10, move)
+    # same bucket, less depth: goes to the always-replace entry
+    table.store(5 + 32, 1, ttable.LOWER, 20)
+    assert table.probe(5) == (3, ttable.EXACT, -10, move)
+    assert table.probe(5 + 32) == (1, ttable.LOWER, 20, 0)
+    table.store(5 + 64, 2, ttable.UPPER, 30)
+    assert table.probe(5 + 32) is None
+    assert table.probe(5 + 64) == (2, ttable.UPPER, 30, 0)
+    # deeper position replaces the depth-preferred entry
+    table.store(5 + 96, 4, ttable.EXACT, 40)
+    assert table.probe(5) is None
+    assert table.probe(5 + 96) == (4, ttable.EXACT, 40, 0)
+
+    assert table.probes == 8
+    assert table.hits == 5
+    assert abs(table.hit_rate - 5 / 8) < 0.0001
+    table.clear()
+    assert table.probe(5 + 96) is None
+    assert table.hits == 0
+
+    # the incremental hash of the moves is the same as the hash of the new position
+    game = Game()
+    key = encoding.position_hash(game.board, game.turn)
+    move = ((1, 3), (3, 3), None)
+    new_key = engine.move_hash(game.board, move, key)
+    game.run_command(engine.move_to_command(move))
+    assert new_key == encoding.position_hash(game.board, game.turn)
+    assert new_key != key
+
+    result = engine.Engine(time_limit=0.5).search(game)
+    assert result.probes > 0
+    assert result.hits > 0
+    assert 'tt hits' in str(result)
+
+def test_opening_book_works():
+    """ Opening book is built from saved games and looked up with mmap """
+    import pickle
+    from tchess import engine, encoding, book
+
+    games = [
+        ['mv 2.4 4.4', 'mv 7.4 5.4', 'mv 1.2 3.3'],
+        ['mv 2.4 to 4.4', 'mv 7.5 5.5'],
+        ['mv 2.5 4.5', 'fdgfd', 'mv 7.4 5.4'],
+    ]
+    paths = []
+    for i, commands in enumerate(games):
+        game = Game()
+        for command in commands:
+            game.run_command(command)
+        paths.append('book-game-' + str(i) + '.tchess')
+        with open(paths[-1], 'wb') as game_file:
+            pickle.dump(game, game_file)
+
+    assert book.build(paths, 'book.bin') == 6
+    assert os.path.getsize('book.bin') == book.HEADER.size + 6 * book.ENTRY.size
+
+    opening_book = book.OpeningBook('book.bin')
+    start = Game()
+    moves = dict(opening_book.lookup(encoding.position_hash(start.board, start.turn)))
+    assert moves == {((1, 3), (3, 3), None): 2, ((1, 4), (3, 4), None): 1}
+    assert opening_book.lookup(12345) == []
+
+    start.run_command('mv 2.4 4.4')
+    moves = dict(opening_book.lookup(encoding.position_hash(start.board, start.turn)))
+    assert moves == {((6, 3), (4, 3), None): 1, ((6, 4), (4, 4), None): 1}
+
+    ai = engine.Engine(time_limit=0.5, book=opening_book)
+    result = ai.search(start)
+    assert result.from_book
+    assert result.move in moves
+    assert str(result) == 'book move'
+
+    start.run_command('mv 7.1 6.1')
+    result = ai.search(start)
+    assert not result.from_book
+    opening_book.close()
+
+    with open('book.bin', 'wb') as book_file:
+        book_file.write(b'invalid')
+    try:
+        book.OpeningBook('book.bin')
+        assert False
+    except book.BookError:
+        pass
+
+    proc = subprocess.Popen(
+        PY_EXE + ' -m tchess --build-book=book.bin ' + ' '.join(paths), shell=True,
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE
+    )
+    output = proc.communicate()[0].decode()
+    assert str_contains_all(output, ['book.bin', '3 games', '6 moves'])
+
+    for path in paths:
+        os.remove(path)
+    os.remove('book.bin')
+
+def test_endgame_tablebase_works():
+    """ Endgame tablebases are generated by retrograde analysis and probed by the AI """
+    import shutil
+    from tchess import engine, tablebase
+
+    tables = {}
+    kqk = tablebase.generate('KQK', tables=tables)
+    assert kqk.name == 'KQK'
+    assert set(tables) == {tablebase.material_key(tablebase.parse_material(name)) for name in ('KQK', 'KK')}
+
+    def probe(turn, *pieces):
+        return tablebase.probe(tables, empty_board(*pieces), turn)
+
+    # black is checkmated
+    assert probe('black', (5, 5, Piece.KING, 'white'), (6, 6, Piece.QUEEN, 'white'), (7, 7, Piece.KING, 'black')) == -1
+    # white mates in one move
+    assert probe('white', (5, 5, Piece.KING, 'white'), (0, 6, Piece.QUEEN, 'white'), (7, 7, Piece.KING, 'black')) == 2
+    # the undefended queen is captured
+    assert probe('black', (0, 3, Piece.KING, 'white'), (6, 6, Piece.QUEEN, 'white'), (7, 7, Piece.KING, 'black')) == 0
+    # black is in check while white is to move, the position is illegal
+    assert probe('white', (0, 3, Piece.KING, 'white'), (7, 0, Piece.QUEEN, 'white'), (7, 7, Piece.KING, 'black')) is None
+    assert kqk.probe(empty_board((0, 3, Piece.KING, 'white'), (7, 0, Piece.QUEEN, 'white'), (7, 7, Piece.KING, 'black')), 'white') is None
+    # stalemate
+    assert probe('black', (5, 6, Piece.KING, 'white'), (6, 5, Piece.QUEEN, 'white'), (7, 7, Piece.KING, 'black')) == 0
+    assert probe('white', (0, 3, Piece.KING, 'white'), (7, 7, Piece.KING, 'black'), (0, 0, Piece.ROOK, 'white')) is None
+    assert probe('white', (0, 3, Piece.KING, 'white'), (7, 7, Piece.KING, 'black')) == 0
+
+    board = empty_board((5, 5, Piece.KING, 'white'), (0, 0, Piece.QUEEN, 'white'), (7, 7, Piece.KING, 'black'))
+    value = tablebase.probe(tables, board, 'white')
+    assert value > 0
+    ai = engine.Engine(time_limit=1, tablebases=tables)
+    result = ai.search(Game.from_state(board=board))
+    assert result.score == engine.MATE_SCORE - (value - 1)
+    assert ai.tablebase_hits > 0
+
+    # the 4 piece materials are too big to be generated by default
+    assert all(len(tablebase.parse_material(name)) == 3 for name in tablebase.DEFAULT_MATERIALS)
+
+    try:
+        tablebase.parse_material('KQ')
+        assert False
+    except tablebase.TablebaseError:
+        pass
+
+    # the files of the old format (without the illegal positions) are not loaded
+    with open('old.tctb', 'wb') as table_file:
+        table_file.write(tablebase.MAGIC + bytes([1, 0, 0, 0, 2]))
+    try:
+        tablebase.Tablebase.load('old.tctb')
+        assert False
+    except tablebase.TablebaseError as error:
+        assert 'old format' in str(error)
+    os.remove('old.tctb')
+
+    proc = subprocess.Popen(
+        PY_EXE + ' -m tchess --build-tablebases=tablebases KK', shell=True,
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE
+    )
+    output = proc.communicate()[0].decode()
+    assert str_contains_all(output, ['generating KK', 'Tablebase `KK` was generated'])
+    loaded = tablebase.load_directory('tablebases')
+    kk = tables[tablebase.material_key(tablebase.parse_material('KK'))]
+    assert list(loaded) == [tablebase.material_key(kk.pieces)]
+    assert list(loaded[tablebase.material_key(kk.pieces)].values) == list(kk.values)
+    shutil.rmtree('tablebases')
+
+def test_batch_evaluation_works():
+    """ Batches of positions are evaluated with numpy like the AI evaluation """
+    try:
+        import numpy
+    except ImportError:
+        print('Igonred...', end=' ', flush=True)
+        return
+    from tchess import batch, engine, encoding
+
+    games = [Game()]
+    games.append(Game.from_state(board=empty_board(
+        (0, 3, Piece.KING, 'white'),
+        (3, 3, Piece.ROOK, 'white'),
+        (7, 0, Piece.KING, 'black'),
+        (6, 5, Piece.QUEEN, 'black'),
+    ), turn='black'))
+    games.append(Game())
+    games[-1].run_command('mv 2.4 4.4')
+
+    data = batch.from_games(games)
+    assert data.shape == (3, 65)
+    assert (data == batch.from_encodings([encoding.encode_board(game.board, game.turn) for game in games])).all()
+    assert list(batch.evaluate(data)) == [engine.evaluate(game.board, game.turn) for game in games]
+    assert list(batch.evaluate(data, for_white=True)) == [engine.evaluate(game.board, 'white') for game in games]
+
+    planes = batch.to_planes(data)
+    assert planes.shape == (3, 12, 64)
+    assert planes[1].sum() == 4
+    assert planes[1][encoding.piece_code(Piece(Piece.QUEEN, 'black')) - 1][6 * 8 + 5]
+    assert list(batch.evaluate_planes(planes)) == list(batch.evaluate(data, for_white=True))
+
+    try:
+        batch.from_encodings([b'abc'])
+        assert False
+    except ValueError:
+        pass
+
+def test_batch_move_generation_works():
+    """ Pseudo-legal moves of batches of positions are generated like the moves of the pieces """
+    try:
+        import numpy
+    except ImportError:
+        print('Igonred...', end=' ', flush=True)
+        return
+    from tchess import batch, encoding
+
+    games = [Game(), Game(), Game.from_state(board=empty_board(
+        (0, 3, Piece.KING, 'white'),
+        (3, 3, Piece.ROOK, 'white'),
+        (7, 0, Piece.KING, 'black'),
+        (6, 5, Piece.QUEEN, 'black'),
+        (1, 6, Piece.PAWN, 'black'),
+        (6, 7, Piece.PAWN, 'white'),
+    ))]
+    for command in ['mv 2.4 4.4', 'mv 7.5 5.5', 'mv 1.2 3.3', 'mv 8.3 4.7', 'mv 4.4 5.5']:
+        games[1].run_command(command)
+    games.append(Game.from_state(board=games[2].board, turn='black'))
+
+    data = batch.from_games(games)
+    positions, codes = batch.generate_moves(data)
+    assert len(positions) == len(codes)
+    moves = batch.split_moves(data, positions, codes)
+    for game, game_moves in zip(games, moves):
+        expected = []
+        for x in range(8):
+            for y in range(8):
+                piece = game.board[x][y]
+                if piece is None or piece.color != game.turn:
+                    continue
+                for a, b in piece.pseudo_moves(game, (x, y)):
+                    if 0 <= a < 8 and 0 <= b < 8:
+                        promotion = Piece.QUEEN if piece.name == Piece.PAWN and a in (0, 7) else None
+                        expected.append(((x, y), (a, b), promotion))
+        assert sorted(game_moves) == sorted(expected)
+    assert len(moves[0]) == 20
+    assert ((6, 7), (7, 7), Piece.QUEEN) in moves[2]
+    assert ((1, 6), (0, 6), Piece.QUEEN) in moves[3]
+
+    checked = batch.is_valid_move(data, [
+        encoding.encode_move(((1, 3), (3, 3), None)),
+        encoding.encode_move(((1, 3), (3, 3), None)),
+        encoding.encode_move(((3, 3), (3, 0), None)),
+        encoding.encode_move(((3, 3), (3, 0), None)),
+    ])
+    assert list(checked) == [True, False, True, False]
+
+def test_pgn_and_fen_work():
+    """ Games are imported from PGN and exported to it, positions are converted to/from FEN """
+    import io
+    import shutil
+    from tchess import pgn
+    from tchess.tchess import save_game
+
+    text = '''[Event "Example"]
+[White "Alice"]
+[Black "Bob"]
+
+1. e4 e5 2. Qh5 {a comment
+in two lines} Nc6 (2... g6 3. Qe5+) 3. Bc4 $2 Nf6?? ; a line comment
+4. Qxf7# 1-0
+
+[Event "Castling"]
+1. e4 e5 2. Nf3 Nc6 3. Bc4 Bc5 4. O-O *
+
+1. d4 d5 2. Nf3
+'''
+    pgn_games = list(pgn.read_games(io.StringIO(text)))
+    assert len(pgn_games) == 3
+    assert pgn_games[0].headers == {'Event': 'Example', 'White': 'Alice', 'Black': 'Bob'}
+    assert pgn_games[0].moves == ['e4', 'e5', 'Qh5', 'Nc6', 'Bc4', 'Nf6??', 'Qxf7#']
+    assert pgn_games[0].result == '1-0'
+    assert pgn_games[2].moves == ['d4', 'd5', 'Nf3'] and pgn_games[2].result == '*'
+
+    errors = []
+    games = list(pgn.import_games(io.StringIO(text), errors))
+    assert len(games) == 2
+    assert [number for number, error in errors] == [2]
+    assert 'castling' in str(errors[0][1])
+    game = games[0]
+    assert game.white_player == 'Alice'
+    assert game.logs[:2] == ['mv 2.4 to 4.4', 'mv 7.4 to 5.4']
+    assert game.is_end and game.winner == 'white'
+
+    # export and import again
+    output = io.StringIO()
+    assert pgn.write_games(output, games) == 2
+    exported = output.getvalue()
+    assert str_contains_all(exported, ['[White "Alice"]', '[Result "1-0"]', '1. e4 e5 2. Qh5 Nc6 3. Bc4 Nf6 4. Qxf7# 1-0', '[Result "*"]'])
+    assert [item.logs for item in pgn.import_games(io.StringIO(exported))] == [item.logs for item in games]
+
+    # the disambiguation of the moves and the promotion
+    game = Game.from_state(board=empty_board(
+        (1, 3, Piece.KING, 'white'),
+        (0, 0, Piece.ROOK, 'white'),
+        (0, 7, Piece.ROOK, 'white'),
+        (6, 1, Piece.PAWN, 'white'),
+        (7, 6, Piece.KING, 'black'),
+    ))
+    assert pgn.move_to_san(game, (0, 0), (0, 1)) == 'Rhg1'
+    assert pgn.move_to_san(game, (6, 1), (7, 1), Piece.KNIGHT) == 'g8=N'
+    pgn.apply_san(game, 'g8=N')
+    assert game.board[7][1].name == Piece.KNIGHT
+    for san in ('Kd8', 'Rg1', 'e5'):
+        try:
+            pgn.parse_san(game, san)
+            assert False
+        except pgn.PGNError:
+            pass
+
+    # FEN
+    start = Game.from_state()
+    assert pgn.to_fen(start) == pgn.START_FEN
+    assert [[str(piece) for piece in row] for row in pgn.from_fen(pgn.START_FEN).board] == [[str(piece) for piece in row] for row in start.board]
+    start.run_command('mv 2.4 4.4')
+    assert pgn.to_fen(start) == 'rnbqkbnr/pppppppp/8/8/4P3/8/PPPP1PPP/RNBQKBNR b - - 0 1'
+    mated = pgn.from_fen('7k/6Q1/5K2/8/8/8/8/8 b - - 0 1')
+    assert mated.is_end and mated.winner == 'white'
+    for fen in (
+        '8/8/8 w - - 0 1', '9/8/8/8/8/8/8/8 w - - 0 1', 'rnbqkbnrr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w - - 0 1',
+        'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNX w - - 0 1', 'x',
+    ):
+        try:
+            pgn.from_fen(fen)
+            assert False
+        except pgn.PGNError:
+            pass
+    # the halfmove clock and the fullmove number of the FEN are kept
+    fen = '4k3/8/8/8/8/8/8/R3K3 b - - 12 40'
+    game = pgn.from_fen(fen)
+    assert pgn.to_fen(game) == fen
+    game.run_command('mv 8.4 7.4')
+    assert pgn.to_fen(game) == '8/4k3/8/8/8/8/8/R3K3 w - - 13 41'
+    save_game(game, 'fen.tchess')
+    assert pgn.to_fen(load_game_from_file('fen.tchess')) == '8/4k3/8/8/8/8/8/R3K3 w - - 13 41'
+    os.remove('fen.tchess')
+
+    # the command line options
+    with open('games.pgn', 'w') as pgn_file:
+        pgn_file.write(text)
+    proc = subprocess.Popen(
+        PY_EXE + ' -m tchess --import-pgn=games.pgn imported', shell=True,
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE
+    )
+    output, errors_output = proc.communicate()
+    assert '2 games were imported' in output.decode()
+    assert 'game 2 was skipped' in errors_output.decode()
+    assert sorted(os.listdir('imported')) == ['game-1.tchess', 'game-2.tchess']
+    proc = subprocess.Popen(
+        PY_EXE + ' -m tchess --export-pgn=- imported/game-1.tchess imported/game-2.tchess', shell=True,
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE
+    )
+    assert proc.communicate()[0].decode() == exported
+    proc = subprocess.Popen(
+        PY_EXE + ' -m tchess --fen imported/game-2.tchess', shell=True,
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE
+    )
+    assert proc.communicate()[0].decode().strip() == 'rnbqkbnr/ppp1pppp/8/3p4/3P4/5N2/PPP1PPPP/RNBQKB1R b - - 1 2'
+    shutil.rmtree('imported')
+    os.remove('games.pgn')
+
+def test_game_database_works():
+    """ Games are ingested in a SQLite database and queried with its indexes """
+    import io
+    from tchess import database, pgn
+
+    text = '''[White "Alice"]
+[Black "Bob"]
+
+1. e4 e5 2. Qh5 Nc6 3. Bc4 Nf6 4. Qxf7# 1-0
+
+[White "Bob"]
+[Black "Carol"]
+
+1. d4 d5 2. Nf3 *
+'''
+    path = 'games.db'
+    with database.GameDatabase(path) as db:
+        assert db.connection.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+        assert db.add_games(pgn.import_games(io.StringIO(text)), source='games.pgn', batch_size=1) == 2
+        game = Game.from_state(white_player='Carol', black_player='Alice')
+        for command in ['mv 2.5 4.5', 'mv 7.5 5.5', 'hello', 'mv 2.6 4.6']:
+            game.run_command(command)
+        assert db.add_games([game]) == 1
+        assert db.count() == 3
+
+        assert [item['id'] for item in db.query(winner='white', max_moves=39)] == [1]
+        assert db.query(winner='white', max_moves=3) == []
+        assert db.query(winner='white', min_moves=4)[0] == {
+            'id': 1, 'white': 'Alice', 'black': 'Bob', 'winner': 'white', 'result': '1-0', 'draw': None, 'plies': 7,
+            'source': 'games.pgn',
+        }
+        assert [item['id'] for item in db.query(player='Bob')] == [1, 2]
+        assert [item['id'] for item in db.query(result='*', black='Alice')] == [3]
+        assert [item['plies'] for item in db.query(result='*')] == [3, 3]
+        assert [item['id'] for item in db.query(limit=2)] == [1, 2]
+        assert db.query(winner='draw') == []
+
+        # the reason of a draw is saved with the game
+        drawn = Game.from_state(white_player='Dave', black_player='Erin')
+        drawn.enable_beep = False
+        for command in ['mv 1.2 3.1', 'mv 8.2 6.1', 'mv 3.1 1.2', 'mv 6.1 8.2'] * 2:
+            drawn.run_command(command)
+        assert db.add_games([drawn]) == 1
+        assert [(item['id'], item['result'], item['draw']) for item in db.query(winner='draw')] == [(4, '1/2-1/2', 'repetition')]
+        assert [item['id'] for item in db.query(draw='repetition')] == [4]
+        assert db.query(draw='stalemate') == []
+        assert db.load_game(4).draw_reason == 'repetition'
+
+        loaded = db.load_game(3)
+        assert loaded.logs == ['mv 2.5 4.5', 'mv 7.5 5.5', 'mv 2.6 4.6']
+        assert loaded.white_player == 'Carol'
+        assert db.load_game(1).is_end
+        assert db.load_game(100) is None
+
+        plan = ' '.join(str(row) for row in db.connection.execute(
+            'EXPLAIN QUERY PLAN SELECT id FROM games WHERE winner = ? AND plies <= ?', ('white', 78)
+        ))
+        assert 'games_winner' in plan
+
+    assert database.parse_filters(['white=Alice', 'max-moves=39']) == {'white': 'Alice', 'max_moves': 39}
+    assert database.parse_filters(['draw=repetition']) == {'draw': 'repetition'}
+    for arguments in (['foo=bar'], ['max-moves=many'], ['white']):
+        try:
+            database.parse_filters(arguments)
+            assert False
+        except database.DatabaseError:
+            pass
+
+    with open('games.pgn', 'w') as pgn_file:
+        pgn_file.write(text)
+    with open('db-game.tchess', 'wb') as game_file:
+        import pickle
+        pickle.dump(game, game_file)
+    proc = subprocess.Popen(
+        PY_EXE + ' -m tchess --db-import=cli.db games.pgn db-game.tchess', shell=True,
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE
+    )
+    assert '3 games were imported into `cli.db`' in proc.communicate()[0].decode()
+    proc = subprocess.Popen(
+        PY_EXE + ' -m tchess --db-query=cli.db winner=white max-moves=39', shell=True,
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE
+    )
+    output = proc.communicate()[0].decode()
+    assert str_contains_all(output, ['#1 Alice vs Bob 1-0 (4 moves)', '1 games were found'])
+    proc = subprocess.Popen(
+        PY_EXE + ' -m tchess --db-query=cli.db color=white', shell=True,
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE
+    )
+    assert 'unknown filter' in proc.communicate()[1].decode()
+    assert proc.returncode == 1
+
+    for name in ('games.db', 'cli.db'):
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(name + suffix):
+                os.remove(name + suffix)
+    os.remove('games.pgn')
+    os.remove('db-game.tchess')
+
+def test_position_index_works():
+    """ Games that reached a position are found with the position index of the database """
+    import sqlite3
+    from tchess import database, encoding, pgn
+
+    games = []
+    for commands in (
+        ['mv 2.4 4.4', 'mv 7.4 5.4', 'mv 1.2 3.3', 'mv 8.2 6.3'],
+        ['mv 1.2 3.3', 'mv 8.2 6.3', 'mv 2.4 4.4', 'mv 7.4 5.4'],
+        ['mv 2.4 4.4', 'mv 7.5 5.5', 'mv 4.4 5.5', 'mv 7.2 5.2', 'mv 5.5 6.5', 'mv 5.2 4.2',
+         'mv 6.5 7.6', 'mv 4.2 3.2', 'mv 7.6 8.7 > n'],
+    ):
+        game = Game.from_state(white_player='a', black_player='b')
+        game.enable_beep = False
+        hashes = [encoding.position_hash(game.board, game.turn)]
+        for command in commands:
+            game.run_command(command)
+            hashes.append(encoding.position_hash(game.board, game.turn))
+        assert len(game.logs) == len(commands)
+        # the hashes are updated by the moved cells like the full hash of the board
+        assert list(database.position_hashes(game.logs)) == list(enumerate(hashes))
+        games.append(game)
+
+    # version 1 databases are indexed when they are opened
+    connection = sqlite3.connect('positions.db')
+    connection.execute('CREATE TABLE games (id INTEGER PRIMARY KEY, white TEXT NOT NULL, black TEXT NOT NULL, winner TEXT, '
+                       'result TEXT NOT NULL, plies INTEGER NOT NULL, source TEXT, logs TEXT NOT NULL)')
+    connection.execute("INSERT INTO games (white, black, result, plies, logs) VALUES ('x', 'y', '*', 1, 'mv 2.4 4.4')")
+    connection.execute('PRAGMA user_version = 1')
+    connection.commit()
+    connection.close()
+
+    with database.GameDatabase('positions.db') as db:
+        assert db.connection.execute('PRAGMA user_version').fetchone()[0] == database.SCHEMA_VERSION
+        assert db.add_games(games) == 3
+        assert db.connection.execute('SELECT COUNT(*) FROM positions').fetchone()[0] == 2 + 5 + 5 + 10
+
+        start = encoding.position_hash(Game.get_start_board(), 'white')
+        assert [(item['id'], item['ply']) for item in db.find_position(start)] == [(1, 0), (2, 0), (3, 0), (4, 0)]
+        # the same position is reached by the different move orders
+        item = games[0]
+        key = encoding.position_hash(item.board, item.turn)
+        assert [(item['id'], item['ply']) for item in db.find_position(key)] == [(2, 4), (3, 4)]
+        assert [item['id'] for item in db.find_position(start, limit=2)] == [1, 2]
+        assert [item['id'] for item in db.query(position=key, white='a')] == [2, 3]
+        assert db.find_position(12345) == []
+        promoted = encoding.position_hash(games[2].board, games[2].turn)
+        assert [item['id'] for item in db.find_position(promoted)] == [4]
+        # the hashes with the highest bit are stored as signed numbers
+        high = [key for game in games for ply, key in database.position_hashes(game.logs) if key >= 1 << 63]
+        assert high and all(db.find_position(key) for key in high)
+
+        filters = database.parse_filters(['fen=' + pgn.to_fen(games[1])])
+        assert filters == {'position': key}
+        assert [item['id'] for item in db.query(**filters)] == [2, 3]
+
+        plan = ' '.join(str(row) for row in db.connection.execute(
+            'EXPLAIN QUERY PLAN SELECT game_id FROM positions WHERE hash = ?', (1,)
+        ))
+        assert 'PRIMARY KEY' in plan
+
+    proc = subprocess.Popen(
+        PY_EXE + ' -m tchess --db-query=positions.db "fen=' + pgn.to_fen(games[1]) + '"', shell=True,
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE
+    )
+    assert str_contains_all(proc.communicate()[0].decode(), ['#2 a vs b', '#3 a vs b', '2 games were found'])
+
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists('positions.db' + suffix):
+            os.remove('positions.db' + suffix)
+
+def test_tournament_works():
+    """ Tournaments play the games in a pool of processes and add them to a database """
+    from tchess import tournament, database
+
+    # the random games are the same for the same seed
+    first = tournament.play_game((0, 'random', 'random', 7, 0.05, 30))
+    assert first == tournament.play_game((0, 'random', 'random', 7, 0.05, 30))
+    assert len(first[5]) == 30 and not first[1] and first[3] is None
+    number, is_end, winner, draw_reason, halfmove_clock, logs = tournament.play_game((1, 'ai', 'random', 3, 0.05, 40))
+    assert len(logs) <= 40
+    assert is_end == (winner is not None or len(logs) < 40)
+    assert (draw_reason is not None) == (is_end and winner is None)
+    assert 0 <= halfmove_clock <= len(logs)
+
+    seen = []
+    stats = tournament.run(
+        4, 'random', 'random', workers=2, max_plies=30, output='tournament.db', seed=7, progress=lambda item: seen.append(item.games)
+    )
+    assert seen == [1, 2, 3, 4]
+    assert stats.games == 4
+    assert sum(stats.results.values()) == 4
+    assert stats.average_plies <= 30
+    assert stats.games_per_second > 0
+    assert str_contains_all(stats.report(), ['4 games in', 'games/sec', 'plies/sec', 'average plies', 'results:'])
+    with database.GameDatabase('tournament.db') as db:
+        assert db.count() == 4
+        games = db.query(white='random (white)')
+        assert len(games) == 4
+        assert first[5] in [db.load_game(item['id']).logs for item in games]
+
+    # the draws are counted by their reasons
+    drawn = Game.from_state()
+    drawn.enable_beep = False
+    for command in ['mv 1.2 3.1', 'mv 8.2 6.1', 'mv 3.1 1.2', 'mv 6.1 8.2'] * 2:
+        drawn.run_command(command)
+    stats = tournament.TournamentStats()
+    stats.add(drawn)
+    assert stats.results['1/2-1/2'] == 1 and stats.draws == {'repetition': 1}
+    assert 'draws: repetition 1' in stats.report()
+
+    try:
+        tournament.run(1, 'random', 'human')
+        assert False
+    except tournament.TournamentError:
+        pass
+
+    proc = subprocess.Popen(
+        PY_EXE + ' -m tchess --tournament=2 --tournament-white=random --tournament-black=random --tournament-plies=10 tournament.db', shell=True,
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE
+    )
+    assert str_contains_all(proc.communicate()[0].decode(), ['2 games in', 'average plies: 10.0', 'were added to `tournament.db`'])
+    with database.GameDatabase('tournament.db') as db:
+        assert db.count() == 6
+
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists('tournament.db' + suffix):
+            os.remove('tournament.db' + suffix)
+
+def test_profiler_works():
+    """ Option --profile times the phases of the commands """
+    import json
+    from tchess import profiler
+
+    original = Game.run_command
+    game_profiler = profiler.Profiler()
+    game_profiler.install()
+    try:
+        game = Game()
+        game.run_command('mv 2.1 to 3.1')
+        game.run_command('mv 2.1 to 3.1')
+        game.render()
+    finally:
+        game_profiler.uninstall()
+    assert Game.run_command is original
+    times = game_profiler.to_dict()
+    assert times['parse']['count'] == 2
+    assert times['move']['count'] == 2
+    assert times['apply']['count'] == 1
+    assert times['check']['count'] == 1
+    assert times['render']['count'] == 1
+    assert times['save']['count'] == 0
+    # the validation of the move (not the validations of the check)
+    assert times['validate']['count'] == 1
+    assert sum(times['parse']['buckets'].values()) == 2
+    assert str_contains_all(game_profiler.report(), ['parse', 'validate', 'apply', 'check', 'render', 'save', '#'])
+
+    # the moves that are not parsed from a command are timed too (the parse phase is optional)
+    game_profiler = profiler.Profiler()
+    game_profiler.install(parse=False)
+    try:
+        game = Game()
+        game.apply_move((1, 0), (2, 0))
+        game.run_command('mv 7.1 to 6.1')
+    finally:
+        game_profiler.uninstall()
+    assert Game.run_command is original
+    times = game_profiler.to_dict()
+    assert times['parse']['count'] == 0
+    assert times['move']['count'] == 2
+    assert times['apply']['count'] == 2
+    assert times['check']['count'] == 2
+
+    if os.path.exists('profile.tchess'):
+        os.remove('profile.tchess')
+    proc = subprocess.Popen(
+        PY_EXE + ' tchess --dont-check-terminal --profile=profile.json profile.tchess', shell=True,
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE, stdin=subprocess.PIPE
+    )
+    proc.communicate(input='mv 2.1 to 3.1\nmv 7.1 to 6.1\nexit'.encode())
+    with open('profile.json') as profile_file:
+        times = json.load(profile_file)
+    assert times['parse']['count'] == 2
+    assert times['save']['count'] == 2
+    assert times['render']['count'] == 3
+    os.remove('profile.json')
+    os.remove('profile.tchess')
+
+    proc = subprocess.Popen(
+        PY_EXE + ' tchess --dont-check-terminal --profile profile.tchess', shell=True,
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE, stdin=subprocess.PIPE
+    )
+    output = proc.communicate(input='mv 2.1 to 3.1\nexit'.encode())[1].decode()
+    assert str_contains_all(output, ['Profile', 'parse', 'render:'])
+    os.remove('profile.tchess')
+
+    # the module that runs as a script is profiled (not another copy of it)
+    proc = subprocess.Popen(
+        PY_EXE + ' tchess/tchess.py --dont-check-terminal --profile=profile.json profile.tchess', shell=True,
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE, stdin=subprocess.PIPE
+    )
+    proc.communicate(input='mv 2.1 to 3.1\nexit'.encode())
+    with open('profile.json') as profile_file:
+        times = json.load(profile_file)
+    assert times['parse']['count'] == 1 and times['validate']['count'] == 1
+    os.remove('profile.json')
+    os.remove('profile.tchess')
+
+def test_spectator_broadcast_renders_once():
+    """ Spectator broadcast renders each state once and fans out the same bytes """
+    from tchess import server
+
+    game = Game()
+    broadcast = server.Broadcast()
+    assert broadcast.current() == (0, b'')
+
+    broadcast.publish(game)
+    version, payload = broadcast.current()
+    assert version == 1
+    assert payload.decode().startswith('white\n')
+
+    # every watcher gets the very same bytes object of the version
+    assert broadcast.wait(0, 0)[1] is payload
+    assert broadcast.wait(0, 0)[1] is payload
+
+    # nothing new is published, so waiting returns the current version after timeout
+    assert broadcast.wait(1, 0.01) == (1, payload)
+
+    game.run_command('mv 2.1 3.1')
+    broadcast.publish(game)
+    version, payload = broadcast.wait(1, 0)
+    assert version == 2
+    assert payload.decode().startswith('black\n')
+
 def test_online_playing_system_works():
     """ Online playing system works """
     if os.name == 'nt' or '--no-server' in sys.argv:
@@ -432,6 +1844,86 @@ def test_online_playing_system_works():
 
         os.remove('server.tchess')
 
+def test_server_metrics_work():
+    """ Game server serves its metrics in the prometheus text format """
+    from tchess import server, metrics
+
+    counter = metrics.Counter('test_total', 'Test counter', ('route',))
+    counter.inc(route='/a')
+    counter.inc(2, route='/a')
+    histogram = metrics.Histogram('test_seconds', 'Test histogram', buckets=(0.1, 1))
+    histogram.observe(0.05)
+    histogram.observe(0.1)
+    histogram.observe(5)
+    gauge = metrics.Gauge('test_value', 'Test gauge', function=lambda: 7)
+    output = metrics.Registry([counter, histogram, gauge]).render()
+    assert output.splitlines() == [
+        '# HELP test_total Test counter',
+        '# TYPE test_total counter',
+        'test_total{route="/a"} 3',
+        '# HELP test_seconds Test histogram',
+        '# TYPE test_seconds histogram',
+        'test_seconds_bucket{le="0.1"} 2',
+        'test_seconds_bucket{le="1"} 2',
+        'test_seconds_bucket{le="+Inf"} 3',
+        'test_seconds_sum 5.15',
+        'test_seconds_count 3',
+        '# HELP test_value Test gauge',
+        '# TYPE test_value gauge',
+        'test_value 7',
+    ]
+
+    # the events are counted in one second buckets, the old ones are removed by `mark` too
+    meter = metrics.RateMeter(window=10)
+    for i in range(1000):
+        meter.mark()
+    assert len(meter.buckets) <= 2
+    assert meter.rate() == 100
+    for bucket in meter.buckets:
+        bucket[0] -= 20
+    meter.mark()
+    assert len(meter.buckets) == 1 and meter.buckets[0][1] == 1
+
+    game = Game.from_state(white_player='host', black_player='guest')
+    game.guest_color = 'black'
+    client = server.create_app(game).test_client()
+    server.publish(game)
+    assert client.get('/render').status_code == 403
+    assert client.get('/spectate').status_code == 200
+    server.record_command('host')
+
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    assert response.headers['Content-Type'].startswith('text/plain; version=0.0.4')
+    output = response.get_data(as_text=True)
+    assert 'tchess_http_requests_total{route="/render",status="403"} 1' in output
+    assert 'tchess_http_requests_total{route="/spectate",status="200"} 1' in output
+    assert 'tchess_http_request_duration_seconds_count{route="/render"} 1' in output
+    assert 'tchess_commands_total{player="host"} 1' in output
+    assert 'tchess_active_sessions{kind="spectator"} ' + str(len(server.SPECTATOR_SESSIONS)) in output
+    assert 'tchess_render_seconds_count ' in output
+    assert 'tchess_serialize_seconds_count ' in output
+    assert 'tchess_commands_per_second ' in output
+    assert 'tchess_move_cache_hit_ratio ' in output
+
+    # the idle spectator sessions are expired and the number of them is limited
+    server.SPECTATOR_SESSIONS.clear()
+    session = client.get('/spectate').get_data(as_text=True)
+    assert client.get('/watch?session=' + session + '&version=' + str(server.BROADCAST.version - 1)).status_code == 200
+    server.SPECTATOR_SESSIONS[session] -= server.SPECTATOR_TIMEOUT + 1
+    assert 'tchess_active_sessions{kind="spectator"} 0' in client.get('/metrics').get_data(as_text=True)
+    assert client.get('/watch?session=' + session).status_code == 403
+    old_max = server.MAX_SPECTATORS
+    server.MAX_SPECTATORS = 2
+    try:
+        assert client.get('/spectate').status_code == 200
+        assert client.get('/spectate').status_code == 200
+        assert client.get('/spectate').status_code == 503
+        assert 'tchess_active_sessions{kind="spectator"} 2' in client.get('/metrics').get_data(as_text=True)
+    finally:
+        server.MAX_SPECTATORS = old_max
+        server.SPECTATOR_SESSIONS.clear()
+
 def test_server_http_api_works():
     """ Game server http APIs working correct """
     if os.name == 'nt' or '--no-server' in sys.argv:
@@ -442,9 +1934,23 @@ def test_server_http_api_works():
     if os.path.isfile('server.tchess'):
         os.remove('server.tchess')
 
-    os.system('printf "y\\nmv 2.1 3.1\\nq\\n" | ' + PY_EXE + ' tchess --online --host=127.0.0.1 --port=8799 server.tchess >/dev/null 2>&1 &')
+    # the host is stopped (by the `q` command) when the test is finished
+    host = subprocess.Popen(
+        PY_EXE + ' tchess --online --host=127.0.0.1 --port=8799 server.tchess', shell=True,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, stdin=subprocess.PIPE
+    )
+    host.stdin.write(b'y\nmv 2.1 3.1\n')
+    host.stdin.flush()
+    try:
+        assert wait_for_server('http://127.0.0.1:8799/metrics')
+        run_server_http_api_test()
+    finally:
+        host.communicate(b'q\n', timeout=30)
+
+    os.remove('server.tchess')
 
-    time.sleep(4)
+def run_server_http_api_test():
+    """ The requests of `test_server_http_api_works` to the served game """
 
     r = requests.get('http://127.0.0.1:8799/me')
     assert r.status_code == 403
@@ -508,17 +2014,36 @@ def test_server_http_api_works():
     r = requests.get('http://127.0.0.1:8799/command?cmd=back&session=' + session_id)
     assert r.status_code == 401
     assert str_contains_all(r.text, ['command', 'disabled'])
+    r = requests.get('http://127.0.0.1:8799/watch')
+    assert r.status_code == 403
+    assert str_contains_all(r.text, ['invalid', 'session'])
+    r = requests.get('http://127.0.0.1:8799/spectate')
+    assert r.status_code == 200
+    spectator_id = r.text.strip()
+    r = requests.get('http://127.0.0.1:8799/watch?session=' + spectator_id)
+    assert r.status_code == 200
+    assert int(r.headers['X-State-Version']) > 0
+    assert r.text == requests.get('http://127.0.0.1:8799/render?session=' + session_id).text
+    r = requests.get('http://127.0.0.1:8799/command?session=' + spectator_id + '&cmd=mv 7.1 6.1')
+    assert r.status_code == 403
+
     r = requests.get('http://127.0.0.1:8799/command?cmd=mv 7.1 6.1&session=' + session_id)
     assert r.status_code == 200
 
-    os.remove('server.tchess')
+    r = requests.get('http://127.0.0.1:8799/metrics')
+    assert r.status_code == 200
+    assert 'tchess_commands_total{player="guest"}' in r.text
+    assert 'tchess_active_sessions{kind="guest"} 1' in r.text
 
 TESTS = [
     test_default_state_is_valid,
+    test_game_from_state_is_cheap_and_isolated,
     test_turn_changer_works,
     test_command_runner_works,
     test_log_list_is_working,
+    test_structured_move_api_works,
     test_game_file_system_works,
+    test_heavy_modules_are_imported_lazily,
     test_command_s_works,
     test_pawn_move_validation_works,
     test_rook_move_validation_works,
@@ -527,7 +2052,29 @@ TESTS = [
     test_bishop_move_validation_works,
     test_command_back_works,
     test_checkmate_and_example,
+    test_legal_moves_work,
+    test_move_cache_works,
+    test_attack_map_works,
+    test_history_works,
+    test_move_log_works,
+    test_headless_mode_works,
+    test_pondering_works,
+    test_draws_work,
     test_pawn_promotion,
+    test_ai_engine_works,
+    test_ai_parallel_search_works,
+    test_transposition_table_works,
+    test_opening_book_works,
+    test_endgame_tablebase_works,
+    test_batch_evaluation_works,
+    test_batch_move_generation_works,
+    test_pgn_and_fen_work,
+    test_game_database_works,
+    test_position_index_works,
+    test_tournament_works,
+    test_profiler_works,
+    test_spectator_broadcast_renders_once,
+    test_server_metrics_work,
     test_server_http_api_works,
     test_online_playing_system_works,
 ]